@@ -0,0 +1,372 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import threading
+
+import cv2
+import numpy as np
+import torch
+from torch_geometric.data import Data
+
+from .predict import LeafDiseasePredictor
+from .preprocessing import (
+    apply_clahe, construct_region_adjacency_graph, extract_segments_using_slic, load_image,
+    obtain_enhanced_node_features, preprocessing_image_to_graph, resize_and_normalize
+)
+
+STAGES = ['decode', 'clahe', 'resize', 'slic', 'node_features', 'adjacency']
+
+
+def synthetic_leaf_images(count, resolution, seed=0):
+    """Yield (name, JPEG bytes) for leaf-like images: a green ellipse with brown lesions on a noisy background"""
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        img = rng.integers(0, 60, (resolution, resolution, 3), dtype=np.uint8)
+        center = (resolution // 2, resolution // 2)
+        axes = (int(resolution * rng.uniform(0.30, 0.45)), int(resolution * rng.uniform(0.15, 0.25)))
+        cv2.ellipse(img, center, axes, float(rng.uniform(0, 180)), 0, 360,
+                    (int(rng.integers(20, 60)), int(rng.integers(120, 200)), int(rng.integers(30, 80))), -1)
+        for _ in range(int(rng.integers(3, 15))):
+            spot = (int(rng.integers(0, resolution)), int(rng.integers(0, resolution)))
+            radius = max(1, int(resolution * rng.uniform(0.01, 0.05)))
+            cv2.circle(img, spot, radius, (30, int(rng.integers(60, 100)), int(rng.integers(110, 160))), -1)
+        ok, encoded = cv2.imencode('.jpg', img)
+        yield f"synthetic-{resolution}-{i}", encoded.tobytes()
+
+
+def sample_images(image_dir, limit=None):
+    """Yield (name, file bytes) for the images in `image_dir`; reading happens up front so decode time excludes disk I/O"""
+    names = sorted(
+        name for name in os.listdir(image_dir)
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))
+    )
+    for name in names[:limit]:
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            yield name, f.read()
+
+
+def labelled_images(val_dir, limit=None):
+    """Yield (class index, file bytes) for `val_dir/<class>/` images, classes numbered in sorted order as in training"""
+    classes = sorted(d for d in os.listdir(val_dir) if os.path.isdir(os.path.join(val_dir, d)))
+    for label, cls in enumerate(classes):
+        for _, data in sample_images(os.path.join(val_dir, cls), limit):
+            yield label, data
+
+
+def summarize(samples):
+    """Latency summary in milliseconds"""
+    if not samples:
+        return None
+    values = np.asarray(samples) * 1000
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'mean': float(values.mean()),
+        'count': int(values.size),
+    }
+
+
+def stage_inputs(data, image_size=128, num_segments=50, compactness=15):
+    """Intermediate results of the default pipeline for one image, so that each stage can be run on its own"""
+    decoded = load_image(data)
+    enhanced = apply_clahe(decoded)
+    img = resize_and_normalize(enhanced, image_size)
+    segments = extract_segments_using_slic(img, num_segments, compactness)
+    return {
+        'data': data, 'decoded': decoded, 'enhanced': enhanced, 'image': img, 'segments': segments,
+        'image_size': image_size, 'num_segments': num_segments, 'compactness': compactness,
+    }
+
+
+# One function per entry of STAGES, each taking the dict returned by stage_inputs
+STAGE_FUNCTIONS = {
+    'decode': lambda inputs: load_image(inputs['data']),
+    'clahe': lambda inputs: apply_clahe(inputs['decoded']),
+    'resize': lambda inputs: resize_and_normalize(inputs['enhanced'], inputs['image_size']),
+    'slic': lambda inputs: extract_segments_using_slic(inputs['image'], inputs['num_segments'], inputs['compactness']),
+    'node_features': lambda inputs: obtain_enhanced_node_features(inputs['image'], inputs['segments']),
+    'adjacency': lambda inputs: construct_region_adjacency_graph(inputs['image'], inputs['segments']),
+}
+
+
+def run_stage(stage, inputs):
+    """Run a single preprocessing stage of the default pipeline"""
+    return STAGE_FUNCTIONS[stage](inputs)
+
+
+def benchmark_dataset(predictor, images, batch_sizes, repeats=1, image_size=128, fast=False):
+    """Time every preprocessing stage per image, then the model forward pass at each batch size"""
+    stage_samples = {stage: [] for stage in STAGES}
+    # Indices of images that failed on any repeat, so a flaky image is counted once
+    totals, graphs, failed = [], [], set()
+
+    for _ in range(repeats):
+        graphs = []
+        for index, (_, data) in enumerate(images):
+            timings = {}
+            started = time.perf_counter()
+            try:
+                x, edge_index, edge_attr = preprocessing_image_to_graph(
+                    data, image_size=image_size, timings=timings, fast=fast
+                )
+            except Exception:
+                failed.add(index)
+                continue
+            totals.append(time.perf_counter() - started)
+            for stage in STAGES:
+                stage_samples[stage].append(timings.get(stage, 0.0))
+            graphs.append(Data(x=x, edge_index=edge_index, edge_attr=edge_attr))
+
+    result = {
+        'images': len(images),
+        'failed': len(failed),
+        'stages': {stage: summarize(samples) for stage, samples in stage_samples.items()},
+        'preprocess': summarize(totals),
+        'forward': {},
+        'images_per_sec': {},
+    }
+    if not graphs:
+        return result
+
+    preprocess_mean = float(np.mean(totals))
+    predictor._predict_graphs(graphs[:1])  # Warm up
+    for batch_size in batch_sizes:
+        batch_times = []
+        for _ in range(repeats):
+            for start in range(0, len(graphs), batch_size):
+                chunk = graphs[start:start + batch_size]
+                started = time.perf_counter()
+                predictor._predict_graphs(chunk)
+                batch_times.append((time.perf_counter() - started, len(chunk)))
+
+        per_graph = [seconds / size for seconds, size in batch_times]
+        result['forward'][str(batch_size)] = {
+            'batch': summarize([seconds for seconds, _ in batch_times]),
+            'per_graph': summarize(per_graph),
+        }
+        # Serial end to end: preprocess every image, then classify in batches of `batch_size`
+        result['images_per_sec'][str(batch_size)] = 1.0 / (preprocess_mean + float(np.mean(per_graph)))
+    return result
+
+
+def benchmark_clients(predictor, graphs, clients, requests_per_client=50):
+    """Throughput of `clients` threads each sending single-graph predictions, like concurrent server requests"""
+    latencies, lock = [], threading.Lock()
+
+    def client(offset):
+        samples = []
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            predictor.predict_graph(graphs[(offset + i) % len(graphs)])
+            samples.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(samples)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {'graphs_per_sec': len(latencies) / elapsed, 'latency': summarize(latencies)}
+
+
+def compare_preprocessing(predictor, samples, image_size=128, batch_size=32):
+    """Accuracy and preprocessing time of the default and fast pipelines on labelled images"""
+    labels = [label for label, _ in samples]
+    result, predictions = {'images': len(samples)}, {}
+    for mode, fast in (('default', False), ('fast', True)):
+        graphs, positions, seconds = [], [], []
+        for pos, (_, data) in enumerate(samples):
+            started = time.perf_counter()
+            try:
+                x, edge_index, edge_attr = preprocessing_image_to_graph(data, image_size=image_size, fast=fast)
+            except Exception:
+                continue
+            seconds.append(time.perf_counter() - started)
+            graphs.append(Data(x=x, edge_index=edge_index, edge_attr=edge_attr))
+            positions.append(pos)
+
+        # Images that fail preprocessing count as wrong
+        predicted = [-1] * len(samples)
+        for start in range(0, len(graphs), batch_size):
+            chunk = predictor._predict_graphs(graphs[start:start + batch_size])
+            for pos, class_idx in zip(positions[start:start + batch_size], chunk):
+                predicted[pos] = class_idx
+        predictions[mode] = predicted
+        result[mode] = {
+            'accuracy': float(np.mean([p == label for p, label in zip(predicted, labels)])) if samples else 0.0,
+            'failed': len(samples) - len(graphs),
+            'preprocess': summarize(seconds),
+        }
+
+    result['agreement'] = float(np.mean([
+        a == b for a, b in zip(predictions['default'], predictions['fast'])
+    ])) if samples else 0.0
+    result['accuracy_change'] = result['fast']['accuracy'] - result['default']['accuracy']
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a previous run and return the regressions above `threshold` (a fraction)"""
+    regressions = []
+    for dataset, current in results['datasets'].items():
+        previous = baseline.get('datasets', {}).get(dataset)
+        if previous is None:
+            continue
+        pairs = [(f"stage {stage}", current['stages'].get(stage), previous['stages'].get(stage)) for stage in STAGES]
+        pairs.append(("preprocess", current['preprocess'], previous['preprocess']))
+        for batch_size, forward in current['forward'].items():
+            old = previous['forward'].get(batch_size)
+            pairs.append((f"forward b={batch_size}", forward['per_graph'], old and old['per_graph']))
+
+        for name, new, old in pairs:
+            if not new or not old or not old['p50']:
+                continue
+            change = new['p50'] / old['p50'] - 1
+            flag = ''
+            if change > threshold:
+                flag = '  <-- regression'
+                regressions.append((dataset, name, change))
+            print(f"  {dataset:>16} {name:<18} p50 {old['p50']:8.2f} -> {new['p50']:8.2f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def print_report(name, result):
+    print(f"\n=== {name} ({result['images']} images, {result['failed']} failed) ===")
+    print(f"  {'stage':<16}{'p50':>9}{'p95':>9}{'p99':>9}  ms")
+    for stage in STAGES + ['preprocess']:
+        summary = result['preprocess'] if stage == 'preprocess' else result['stages'][stage]
+        if summary:
+            print(f"  {stage:<16}{summary['p50']:9.2f}{summary['p95']:9.2f}{summary['p99']:9.2f}")
+    for batch_size, forward in result['forward'].items():
+        summary = forward['per_graph']
+        print(f"  forward b={batch_size:<6}{summary['p50']:9.2f}{summary['p95']:9.2f}{summary['p99']:9.2f}"
+              f"  per graph, {result['images_per_sec'][batch_size]:.1f} images/s end to end")
+
+
+def print_preprocessing_comparison(result):
+    print(f"\n=== default vs fast preprocessing ({result['images']} labelled images) ===")
+    for mode in ('default', 'fast'):
+        summary = result[mode]['preprocess']
+        timing = f"p50 {summary['p50']:.2f} ms, p95 {summary['p95']:.2f} ms" if summary else "-"
+        print(f"  {mode:<8} accuracy {result[mode]['accuracy']:.2%} ({result[mode]['failed']} failed), {timing}")
+    print(f"  same prediction for {result['agreement']:.2%}, accuracy change {result['accuracy_change']:+.2%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing stages and model inference")
+    parser.add_argument('--model_path', type=str, default='ai_model/model.pt')
+    parser.add_argument('--image_dir', type=str, default=None, help="Sample images to benchmark besides the synthetic set")
+    parser.add_argument('--max_images', type=int, default=64)
+    parser.add_argument('--synthetic', type=int, default=32, help="Synthetic images per resolution (0 to skip)")
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--image_size', type=int, default=128, help="Resize target used by preprocessing")
+    parser.add_argument('--repeats', type=int, default=1)
+    parser.add_argument('--device', type=str, default='cpu', choices=['auto', 'cpu', 'cuda'])
+    parser.add_argument('--fast', action='store_true', help="Benchmark the fast preprocessing pipeline")
+    parser.add_argument('--clients', type=int, nargs='*', default=[],
+                        help="Measure single-graph prediction throughput with these numbers of concurrent threads")
+    parser.add_argument('--requests_per_client', type=int, default=50)
+    parser.add_argument('--replicas', type=int, default=0, help="Model replicas (LeafDiseasePredictor num_replicas)")
+    parser.add_argument('--intra_op_threads', type=int, default=None)
+    parser.add_argument('--micro_batch_size', type=int, default=0)
+    parser.add_argument('--quantize', action='store_true', help="Quantize a .pt model to int8 when loading it")
+    parser.add_argument('--calibration_dir', type=str, default=None,
+                        help="Graphs written by save_packed_graphs, used with --quantize to pick the int8 layers")
+    parser.add_argument('--val_dir', type=str, default=None,
+                        help="Labelled images (<val_dir>/<class>/) to compare default and fast preprocessing accuracy")
+    parser.add_argument('--max_accuracy_drop', type=float, default=0.01,
+                        help="Largest accuracy loss of fast preprocessing accepted with --val_dir")
+    parser.add_argument('--output', type=str, default=None, help="Write results as JSON")
+    parser.add_argument('--compare', type=str, default=None, help="Previous JSON results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p50 slowdown counted as a regression")
+    args = parser.parse_args()
+
+    predictor = LeafDiseasePredictor(
+        args.model_path, device=args.device, num_replicas=args.replicas,
+        intra_op_threads=args.intra_op_threads, micro_batch_size=args.micro_batch_size,
+        fast_preprocess=args.fast, quantize=args.quantize, calibration_graphs=args.calibration_dir
+    )
+
+    datasets = {}
+    if args.synthetic > 0:
+        for resolution in args.resolutions:
+            datasets[f"synthetic-{resolution}"] = list(synthetic_leaf_images(args.synthetic, resolution))
+    if args.image_dir:
+        datasets['sample'] = list(sample_images(args.image_dir, args.max_images))
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'model': os.path.basename(args.model_path),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+            'replicas': args.replicas,
+            'intra_op_threads': predictor.replicas.intra_op_threads if predictor.replicas else None,
+            'micro_batch_size': args.micro_batch_size,
+            'quantize': args.quantize,
+            'quantized_layers': predictor.quantized_layers,
+            'image_size': args.image_size,
+            'fast': args.fast,
+            'repeats': args.repeats,
+        },
+        'datasets': {},
+    }
+    for name, images in datasets.items():
+        result = benchmark_dataset(predictor, images, args.batch_sizes, args.repeats, args.image_size, args.fast)
+        results['datasets'][name] = result
+        print_report(name, result)
+
+    if args.clients:
+        images = next(iter(datasets.values()), [])[:32]
+        graphs = [predictor._image_to_graph(data) for _, data in images]
+        results['clients'] = {}
+        print(f"\n=== concurrent clients ({args.requests_per_client} single-graph requests each) ===")
+        for clients in args.clients:
+            result = benchmark_clients(predictor, graphs, clients, args.requests_per_client)
+            results['clients'][str(clients)] = result
+            print(f"  {clients:>3} clients: {result['graphs_per_sec']:8.1f} graphs/s, "
+                  f"p50 {result['latency']['p50']:.2f} ms, p99 {result['latency']['p99']:.2f} ms")
+
+    if args.val_dir:
+        samples = list(labelled_images(args.val_dir, args.max_images))
+        results['preprocessing_modes'] = compare_preprocessing(predictor, samples, args.image_size)
+        print_preprocessing_comparison(results['preprocessing_modes'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {args.compare}:")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            failed = True
+
+    if args.val_dir and results['preprocessing_modes']['accuracy_change'] < -args.max_accuracy_drop:
+        print(f"Fast preprocessing loses more than {args.max_accuracy_drop:.0%} accuracy")
+        failed = True
+
+    predictor.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
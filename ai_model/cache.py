@@ -0,0 +1,136 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class GraphCache:
+    """
+    Content-addressed cache of image graphs and predictions.
+
+    Entries are keyed by a hash of the image bytes and the preprocessing
+    parameters. Recently used entries are kept in memory (LRU); when
+    `cache_dir` is given, entries are also written to disk and the oldest
+    files are evicted once the directory grows beyond `max_disk_bytes`.
+    """
+    def __init__(self, max_entries=1024, cache_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk_bytes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    @staticmethod
+    def make_key(image_bytes, num_segments=50, compactness=15, image_size=128, fast=False):
+        digest = hashlib.sha256(image_bytes)
+        digest.update(f"|{num_segments}|{compactness}|{image_size}".encode())
+        if fast:
+            # Fast preprocessing builds different graphs; keys for the default pipeline are unchanged
+            digest.update(b"|fast")
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _disk_files(self):
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir) if name.endswith('.pt')
+        ]
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached entry dict for `key`, or None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir:
+            import torch  # Only needed for the on-disk cache
+
+            path = self._disk_path(key)
+            try:
+                entry = torch.load(path, weights_only=True)
+                os.utime(path)  # Mark as recently used for eviction
+            except (OSError, RuntimeError):
+                entry = None
+
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        """Store an entry dict (graph tensors and optionally the prediction)"""
+        with self._lock:
+            self._remember(key, entry)
+
+        if self.cache_dir:
+            import torch
+
+            path = self._disk_path(key)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            torch.save(entry, tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - previous
+            self._evict_disk()
+
+    def _evict_disk(self):
+        with self._lock:
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            # Remove least recently used files first
+            files = sorted(self._disk_files(), key=os.path.getmtime)
+            for path in files:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                    self._disk_bytes -= size
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.cache_dir:
+                for path in self._disk_files():
+                    os.remove(path)
+                self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+            }
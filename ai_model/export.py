@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import torch
+import torch.nn.functional as F
+
+
+def _bn_affine(bn):
+    """Per-channel (scale, shift) equivalent to an eval-mode BatchNorm1d"""
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    shift = bn.bias - bn.running_mean * scale
+    return scale, shift
+
+
+def _fold_linear_bn(weight, bias, bn):
+    """Fold `bn(x @ weight.T + bias)` into a single (weight, bias)"""
+    scale, shift = _bn_affine(bn)
+    if bias is None:
+        bias = torch.zeros_like(scale)
+    return weight * scale[:, None], bias * scale + shift
+
+
+def _linear(weight, bias=None):
+    """Frozen nn.Linear with the given parameters; kept as nn.Linear so it can be quantized"""
+    linear = torch.nn.Linear(weight.size(1), weight.size(0), bias=bias is not None)
+    linear.weight = torch.nn.Parameter(weight.detach().clone(), requires_grad=False)
+    if bias is not None:
+        linear.bias = torch.nn.Parameter(bias.detach().clone(), requires_grad=False)
+    return linear
+
+
+class FrozenGCNLayer(torch.nn.Module):
+    """GCNConv followed by BatchNorm, with the BatchNorm folded into the weights"""
+    def __init__(self, conv, bn):
+        super(FrozenGCNLayer, self).__init__()
+        weight, bias = _fold_linear_bn(conv.lin.weight, conv.bias, bn)
+        # The bias is added after aggregation, so it stays out of the linear layer
+        self.lin = _linear(weight)
+        self.bias = torch.nn.Parameter(bias.detach().clone(), requires_grad=False)
+
+    def forward(self, x, src, dst, norm):
+        h = self.lin(x)
+        out = torch.zeros_like(h).index_add_(0, dst, h.index_select(0, src) * norm.unsqueeze(1))
+        return out + self.bias
+
+
+class FrozenGATLayer(torch.nn.Module):
+    """
+    GATConv followed by BatchNorm. The projection also feeds the attention
+    scores, so the BatchNorm is folded into the output bias and scale instead
+    """
+    def __init__(self, conv, bn):
+        super(FrozenGATLayer, self).__init__()
+        self.heads = conv.heads
+        self.channels = conv.out_channels
+        self.negative_slope = float(conv.negative_slope)
+        scale, shift = _bn_affine(bn)
+        self.lin = _linear(conv.lin.weight)
+        self.att_src = torch.nn.Parameter(conv.att_src.detach().view(self.heads, self.channels).clone(), requires_grad=False)
+        self.att_dst = torch.nn.Parameter(conv.att_dst.detach().view(self.heads, self.channels).clone(), requires_grad=False)
+        self.scale = torch.nn.Parameter(scale.detach().clone(), requires_grad=False)
+        self.shift = torch.nn.Parameter((conv.bias * scale + shift).detach().clone(), requires_grad=False)
+
+    def forward(self, x, src, dst):
+        num_nodes = x.size(0)
+        h = self.lin(x).view(num_nodes, self.heads, self.channels)
+        alpha_src = (h * self.att_src).sum(dim=-1)
+        alpha_dst = (h * self.att_dst).sum(dim=-1)
+        alpha = F.leaky_relu(alpha_src.index_select(0, src) + alpha_dst.index_select(0, dst), self.negative_slope)
+
+        # Softmax over the incoming edges of every node
+        index = dst.view(-1, 1).expand_as(alpha)
+        alpha_max = torch.full_like(alpha_src, float('-inf')).scatter_reduce(0, index, alpha, 'amax')
+        alpha = torch.exp(alpha - alpha_max.index_select(0, dst))
+        alpha_sum = torch.zeros_like(alpha_src).index_add_(0, dst, alpha) + 1e-16
+        alpha = alpha / alpha_sum.index_select(0, dst)
+
+        messages = h.index_select(0, src) * alpha.unsqueeze(-1)
+        out = torch.zeros_like(h).index_add_(0, dst, messages)
+        return out.view(num_nodes, self.heads * self.channels) * self.scale + self.shift
+
+
+class FrozenHybridGCNGATModel(torch.nn.Module):
+    """
+    Inference-only equivalent of HybridGCNGATModel in plain torch ops so it can
+    be compiled with TorchScript. BatchNorm layers are folded into the
+    preceding layers, and the two classifier layers (which have no activation
+    between them) are merged into one.
+
+    Takes node features, edge_index, the node-to-graph `batch` vector and the
+    number of graphs, and returns class logits.
+    """
+    def __init__(self, model):
+        super(FrozenHybridGCNGATModel, self).__init__()
+        model = model.eval()
+        linear, bn = model.feature_transform[0], model.feature_transform[1]
+        self.input = _linear(*_fold_linear_bn(linear.weight, linear.bias, bn))
+
+        self.gcn_layers = torch.nn.ModuleList()
+        for block in model.gcn_blocks:
+            self.gcn_layers.append(FrozenGCNLayer(block.gcn1, block.bn1))
+            self.gcn_layers.append(FrozenGCNLayer(block.gcn2, block.bn2))
+
+        self.gat_layers = torch.nn.ModuleList()
+        for block in model.gat_blocks:
+            self.gat_layers.append(FrozenGATLayer(block.gat1, block.bn1))
+            self.gat_layers.append(FrozenGATLayer(block.gat2, block.bn2))
+
+        classifier = model.classifier
+        w1, b1 = _fold_linear_bn(classifier.fc1.weight, classifier.fc1.bias, classifier.bn1)
+        w2, b2 = _fold_linear_bn(classifier.fc2.weight, classifier.fc2.bias, classifier.bn2)
+        self.hidden = _linear(w2 @ w1, w2 @ b1 + b2)
+        self.output = _linear(classifier.output.weight, classifier.output.bias)
+
+    def forward(self, x, edge_index, batch, num_graphs: int):
+        num_nodes = x.size(0)
+        x = F.leaky_relu(self.input(x), 0.2)
+
+        # Same graph for every layer: drop existing self-loops and add one per node
+        keep = edge_index[0] != edge_index[1]
+        loops = torch.arange(num_nodes, dtype=edge_index.dtype, device=edge_index.device)
+        src = torch.cat([edge_index[0][keep], loops])
+        dst = torch.cat([edge_index[1][keep], loops])
+
+        # Symmetric GCN normalisation D^-1/2 (A + I) D^-1/2
+        degree = torch.zeros(num_nodes, dtype=x.dtype, device=x.device).index_add_(
+            0, dst, torch.ones(dst.size(0), dtype=x.dtype, device=x.device)
+        )
+        degree_inv_sqrt = degree.pow(-0.5)
+        norm = degree_inv_sqrt.index_select(0, src) * degree_inv_sqrt.index_select(0, dst)
+
+        for layer in self.gcn_layers:
+            x = F.elu(layer(x, src, dst, norm))
+        for layer in self.gat_layers:
+            x = F.elu(layer(x, src, dst))
+
+        # Global mean + max pooling per graph
+        index = batch.view(-1, 1).expand_as(x)
+        total = x.new_zeros(num_graphs, x.size(1)).index_add_(0, batch, x)
+        count = x.new_zeros(num_graphs).index_add_(0, batch, x.new_ones(num_nodes)).clamp(min=1)
+        maximum = x.new_zeros(num_graphs, x.size(1)).scatter_reduce(0, index, x, 'amax', include_self=False)
+        x = torch.cat([total / count.unsqueeze(1), maximum], dim=1)
+
+        x = F.leaky_relu(self.hidden(x), 0.2)
+        return self.output(x)
+
+
+def _predictions(frozen, graphs):
+    with torch.inference_mode():
+        return [
+            frozen(g.x, g.edge_index, torch.zeros(g.num_nodes, dtype=torch.long), 1).argmax(dim=1).item()
+            for g in graphs
+        ]
+
+
+def _quantize_layers(frozen, names):
+    config = torch.ao.quantization.per_channel_dynamic_qconfig
+    return torch.ao.quantization.quantize_dynamic(frozen, {name: config for name in names}, dtype=torch.qint8)
+
+
+def quantize_frozen(frozen, calibration_graphs=None, tolerance=0.01):
+    """
+    Dynamically quantize the linear layers of a FrozenHybridGCNGATModel to
+    int8 (per-channel weights, activations quantized per batch at run time).
+    Returns the quantized model and the names of the quantized layers.
+
+    Without calibration graphs every linear layer is quantized. With them,
+    layers are tried from largest to smallest and one is left in fp32 if
+    quantizing it would change the prediction for more than `tolerance` of
+    the graphs
+    """
+    linears = [
+        (name, module.weight.numel()) for name, module in frozen.named_modules()
+        if isinstance(module, torch.nn.Linear)
+    ]
+    names = [name for name, _ in sorted(linears, key=lambda item: -item[1])]
+    if not calibration_graphs:
+        return _quantize_layers(frozen, names), names
+
+    expected = _predictions(frozen, calibration_graphs)
+    selected = []
+    for name in names:
+        candidate = _quantize_layers(frozen, selected + [name])
+        changed = sum(a != b for a, b in zip(expected, _predictions(candidate, calibration_graphs)))
+        if changed <= tolerance * len(calibration_graphs):
+            selected.append(name)
+    return _quantize_layers(frozen, selected), selected
+
+
+def export_torchscript(model, output_path, metadata=None, quantize=False, calibration_graphs=None, tolerance=0.01):
+    """
+    Freeze an eval-mode HybridGCNGATModel into a TorchScript file and return the scripted module.
+    With `quantize`, linear layers are converted to int8 first (see quantize_frozen)
+    """
+    frozen = FrozenHybridGCNGATModel(model.cpu()).eval()
+    metadata = dict(metadata or {}, num_classes=model.num_classes)
+    if quantize:
+        frozen, metadata['quantized_layers'] = quantize_frozen(frozen, calibration_graphs, tolerance)
+    scripted = torch.jit.freeze(torch.jit.script(frozen))
+    torch.jit.save(scripted, output_path, _extra_files={'meta.json': json.dumps(metadata)})
+    return scripted
+
+
+def _random_graphs(count, num_node_features, seed=0):
+    from torch_geometric.data import Data
+
+    generator = torch.Generator().manual_seed(seed)
+    graphs = []
+    for _ in range(count):
+        num_nodes = int(torch.randint(20, 60, (1,), generator=generator))
+        edges = torch.randint(0, num_nodes, (2, num_nodes * 3), generator=generator)
+        edges = torch.cat([edges, edges.flip(0)], dim=1)
+        graphs.append(Data(
+            x=torch.rand(num_nodes, num_node_features, generator=generator),
+            edge_index=edges,
+            edge_attr=torch.rand(edges.size(1), 1, generator=generator)
+        ))
+    return graphs
+
+
+def _per_graph_ms(run, graphs, repeats=3):
+    with torch.inference_mode():
+        for graph in graphs[:5]:
+            run(graph)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for graph in graphs:
+                run(graph)
+    return (time.perf_counter() - started) * 1000 / (repeats * len(graphs))
+
+
+def _loaded_rss_mb(model_path):
+    """Resident memory added by loading `model_path` and running one image, measured in a fresh process"""
+    code = (
+        "import sys, torch\n"
+        "from ai_model.predict import LeafDiseasePredictor\n"
+        "rss = lambda: int(open('/proc/self/statm').read().split()[1]) * 4096\n"
+        "before = rss()\n"
+        "predictor = LeafDiseasePredictor(sys.argv[1], device='cpu')\n"
+        "predictor.warm_up()\n"
+        "print((rss() - before) / 2 ** 20)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        result = subprocess.run([sys.executable, '-c', code, model_path], cwd=root,
+                                capture_output=True, text=True, check=True)
+        return float(result.stdout.strip().splitlines()[-1])
+    except (subprocess.CalledProcessError, ValueError, IndexError, OSError):
+        # /proc is Linux only
+        return None
+
+
+def main():
+    from .predict import LeafDiseasePredictor
+    from .utils import PackedGraphDataset
+
+    parser = argparse.ArgumentParser(description="Export the leaf disease model to TorchScript for inference")
+    parser.add_argument('--model_path', type=str, required=True)
+    parser.add_argument('--output', type=str, default=None,
+                        help="Defaults to the model path with a .ts (or .int8.ts with --quantize) suffix")
+    parser.add_argument('--image_dir', type=str, default=None, help="Images to verify against; random graphs otherwise")
+    parser.add_argument('--graphs_dir', type=str, default=None,
+                        help="Labelled graphs written by save_packed_graphs, for calibration and an accuracy report")
+    parser.add_argument('--num_graphs', type=int, default=64)
+    parser.add_argument('--quantize', action='store_true', help="Quantize the linear layers to int8")
+    parser.add_argument('--num_calibration', type=int, default=256,
+                        help="Graphs from --graphs_dir used to pick the layers to quantize")
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="Share of calibration predictions a quantized layer may change")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.model_path)[0] + ('.int8.ts' if args.quantize else '.ts')
+    predictor = LeafDiseasePredictor(args.model_path, device='cpu')
+    model = predictor.model
+
+    labels, calibration = None, None
+    if args.graphs_dir:
+        dataset = PackedGraphDataset(args.graphs_dir)
+        count = len(dataset)
+        # Calibrate and verify on different graphs
+        num_calibration = min(args.num_calibration, count // 2) if args.quantize else 0
+        calibration = [dataset[i] for i in range(num_calibration)]
+        graphs = [dataset[i] for i in range(num_calibration, min(count, num_calibration + args.num_graphs))]
+        labels = [graph.y.item() for graph in graphs]
+    elif args.image_dir:
+        paths = [os.path.join(args.image_dir, name) for name in sorted(os.listdir(args.image_dir))]
+        graphs = [graph for _, graph in predictor._iter_graphs(paths[:args.num_graphs]) if graph is not None]
+    else:
+        graphs = _random_graphs(args.num_graphs, model.num_node_features)
+    if not graphs:
+        # Verification and timing need at least one graph
+        source = args.graphs_dir or args.image_dir
+        parser.error(f"no graphs to verify the export with in {source}" if source else "--num_graphs must be positive")
+
+    metadata = {'source': os.path.basename(args.model_path)}
+    scripted = export_torchscript(model, output, metadata, args.quantize, calibration, args.tolerance)
+    print(f"Exported {args.model_path} -> {output}")
+    if args.quantize:
+        extra = {'meta.json': ''}
+        torch.jit.load(output, _extra_files=extra)
+        quantized = json.loads(extra['meta.json'])['quantized_layers']
+        print(f"Quantized {len(quantized)} linear layers to int8: {', '.join(quantized) or 'none'}")
+
+    # Check the exported model against the original before it is deployed
+    max_diff, agree = 0.0, 0
+    expected_classes, actual_classes = [], []
+    with torch.inference_mode():
+        for graph in graphs:
+            expected = model(graph)
+            batch = torch.zeros(graph.num_nodes, dtype=torch.long)
+            actual = scripted(graph.x, graph.edge_index, batch, 1)
+            max_diff = max(max_diff, (expected - actual).abs().max().item())
+            expected_classes.append(expected.argmax(dim=1).item())
+            actual_classes.append(actual.argmax(dim=1).item())
+            agree += int(expected_classes[-1] == actual_classes[-1])
+    print(f"Verified on {len(graphs)} graphs: max |logit diff| = {max_diff:.2e}, "
+          f"same prediction for {agree}/{len(graphs)}")
+    if labels:
+        accuracy = lambda predicted: sum(p == y for p, y in zip(predicted, labels)) / len(labels)
+        print(f"Accuracy: original {accuracy(expected_classes):.2%}, exported {accuracy(actual_classes):.2%}")
+
+    run = lambda module: lambda g: module(g.x, g.edge_index, torch.zeros(g.num_nodes, dtype=torch.long), 1)
+    eager_ms = _per_graph_ms(model, graphs)
+    scripted_ms = _per_graph_ms(run(scripted), graphs)
+    if args.quantize:
+        fp32 = torch.jit.freeze(torch.jit.script(FrozenHybridGCNGATModel(model).eval()))
+        print(f"Per-graph latency on CPU: eager {eager_ms:.2f} ms, TorchScript fp32 "
+              f"{_per_graph_ms(run(fp32), graphs):.2f} ms, TorchScript int8 {scripted_ms:.2f} ms")
+    else:
+        print(f"Per-graph latency on CPU: eager {eager_ms:.2f} ms, TorchScript {scripted_ms:.2f} ms")
+
+    size_mb = lambda path: os.path.getsize(path) / 2 ** 20
+    print(f"File size: {args.model_path} {size_mb(args.model_path):.2f} MB, {output} {size_mb(output):.2f} MB")
+    source_rss, output_rss = _loaded_rss_mb(args.model_path), _loaded_rss_mb(output)
+    if source_rss is not None and output_rss is not None:
+        print(f"Memory added by loading: {args.model_path} {source_rss:.1f} MB, {output} {output_rss:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
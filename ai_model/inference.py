@@ -0,0 +1,238 @@
+import os
+import copy
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import torch
+
+
+def _percentiles_ms(samples):
+    values = sorted(samples)
+    if not values:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))] * 1000
+    return {'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99), 'max': values[-1] * 1000}
+
+
+class ReplicaPool:
+    """
+    Runs forward passes on `num_replicas` worker threads, each owning its own
+    copy of the model.
+
+    Every worker pins its intra-op thread count with torch.set_num_threads
+    (a per-thread setting with OpenMP), so N concurrent requests use about
+    N * `intra_op_threads` cores instead of each one spreading over every
+    core. Callers block in `run` while a free replica executes
+    `fn(model, *args)`.
+    """
+    def __init__(self, model, num_replicas, intra_op_threads=None, inter_op_threads=None, window=1000):
+        self.num_replicas = num_replicas
+        self.intra_op_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // num_replicas)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError:
+                # Only allowed before the first inter-op parallel work in the process
+                pass
+        self.replicas = [model] + [copy.deepcopy(model) for _ in range(num_replicas - 1)]
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, args=(replica,), name=f'replica-{i}', daemon=True)
+            for i, replica in enumerate(self.replicas)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.busy = 0
+        self._queue_wait = deque(maxlen=window)
+        self._run_time = deque(maxlen=window)
+
+    def _run(self, replica):
+        torch.set_num_threads(self.intra_op_threads)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            fn, args, future, enqueued = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            started = time.perf_counter()
+            with self._lock:
+                self.busy += 1
+            try:
+                future.set_result(fn(replica, *args))
+            except Exception as e:
+                future.set_exception(e)
+            finished = time.perf_counter()
+            with self._lock:
+                self.busy -= 1
+                self.requests += 1
+                self._queue_wait.append(started - enqueued)
+                self._run_time.append(finished - started)
+
+    def submit(self, fn, *args):
+        """Queue `fn(model, *args)` for the next free replica and return a Future of its result"""
+        future = Future()
+        self._queue.put((fn, args, future, time.perf_counter()))
+        return future
+
+    def run(self, fn, *args):
+        return self.submit(fn, *args).result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': self.num_replicas,
+                'intra_op_threads': self.intra_op_threads,
+                'inter_op_threads': torch.get_num_interop_threads(),
+                'queue_depth': self._queue.qsize(),
+                'busy': self.busy,
+                'requests': self.requests,
+                'queue_wait_ms': _percentiles_ms(self._queue_wait),
+                'run_ms': _percentiles_ms(self._run_time),
+            }
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+class MicroBatchScheduler:
+    """
+    Coalesces concurrent single-graph predictions into batched forward passes.
+
+    Requests are queued by `submit`; a worker thread takes the first waiting
+    graph, gathers any others that arrive within `max_wait_ms` (up to
+    `max_batch_size`), runs one forward pass through `predictor._predict_graphs`
+    and resolves each request's future with its class index. With
+    `num_workers` > 1 (e.g. one per model replica) several batches are
+    collected and run at the same time.
+    """
+    def __init__(self, predictor, max_batch_size=16, max_wait_ms=5.0, window=1000, num_workers=1):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.num_workers = num_workers
+        self._queue = queue.Queue()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self._batch_sizes = Counter()
+        self._queue_wait = deque(maxlen=window)
+        self._forward_time = deque(maxlen=window)
+
+    def _ensure_started(self):
+        if not self._threads:
+            with self._start_lock:
+                if not self._threads:
+                    threads = [
+                        threading.Thread(target=self._run, name=f'micro-batch-{i}', daemon=True)
+                        for i in range(self.num_workers)
+                    ]
+                    for thread in threads:
+                        thread.start()
+                    self._threads = threads
+
+    def submit(self, graph):
+        """Queue a graph for prediction and return a Future of its class index"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((graph, future, time.perf_counter()))
+        return future
+
+    def predict(self, graph):
+        return self.submit(graph).result()
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the window closes"""
+        item = self._queue.get()
+        if item is None:
+            # Leave the sentinel for the other workers
+            self._queue.put(None)
+            return None
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # After the window closes, still take whatever is already queued
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        graphs = [graph for graph, _, _ in batch]
+        try:
+            results = list(zip(batch, self.predictor._predict_graphs(graphs)))
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                results = []
+            else:
+                # Retry one by one so a single bad graph does not fail the whole batch
+                results = []
+                for item in batch:
+                    try:
+                        results.append((item, self.predictor._predict_graphs([item[0]])[0]))
+                    except Exception as item_error:
+                        item[1].set_exception(item_error)
+        finished = time.perf_counter()
+
+        for (_, future, _), class_idx in results:
+            future.set_result(class_idx)
+
+        with self._lock:
+            self.requests += len(batch)
+            self.batches += 1
+            self._batch_sizes[len(batch)] += 1
+            self._queue_wait.extend(started - enqueued for _, _, enqueued in batch)
+            self._forward_time.append(finished - started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'workers': self.num_workers,
+                'queue_depth': self._queue.qsize(),
+                'requests': self.requests,
+                'batches': self.batches,
+                'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+                'batch_size_histogram': {size: self._batch_sizes[size] for size in sorted(self._batch_sizes)},
+                'queue_wait_ms': _percentiles_ms(self._queue_wait),
+                'forward_ms': _percentiles_ms(self._forward_time),
+            }
+
+    def close(self):
+        if self._threads:
+            # Each worker re-queues the sentinel for the next one when it stops
+            self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            self._queue = queue.Queue()
@@ -1,29 +1,83 @@
 import torch
 import json
+import numpy as np
 import argparse
 import glob
 import os
+import hashlib
+import time
+import zipfile
 import warnings
 warnings.filterwarnings('ignore')
 
 # Suppress torch warnings
 torch.set_warn_always(False)
-from torch_geometric.data import Data
+from torch_geometric.data import Data, Batch
 
-from .utils import HybridGCNGATModel
-from .utils import preprocessing_image_to_graph
+from .preprocessing import preprocessing_image_to_graph, _record_stage
+from .preprocess_pool import GraphPreprocessingPool
+from .inference import MicroBatchScheduler, ReplicaPool
 
 class LeafDiseasePredictor:
-    def __init__(self, model_path, label_map_path=None, device='cpu'):
+    def __init__(self, model_path, label_map_path=None, device='cpu', max_batch_size=64, num_workers=0,
+                 cache=None, micro_batch_size=0, micro_batch_wait_ms=5.0, fast_preprocess=False,
+                 num_replicas=0, intra_op_threads=None, inter_op_threads=None, quantize=False,
+                 calibration_graphs=None, quantize_tolerance=0.01):
         if device == 'auto':
             device = 'cuda' if torch.cuda.is_available() else 'cpu'
         self.device = torch.device(device)
+        self.max_batch_size = max_batch_size
+        # Downscale-first preprocessing, see preprocessing_image_to_graph(fast=True)
+        self.fast_preprocess = fast_preprocess
+        # Image-to-graph preprocessing runs in worker processes when num_workers > 0
+        self.preprocess_pool = (
+            GraphPreprocessingPool(num_workers=num_workers, fast=fast_preprocess) if num_workers > 0 else None
+        )
         self.model = self._load_model(model_path)
+        # Names of the int8 linear layers when quantize is set
+        self.quantized_layers = None
+        if quantize:
+            self._quantize(calibration_graphs, quantize_tolerance)
+        # Quantized predictions can differ slightly, so they are cached separately
+        self.model_fingerprint = self._fingerprint(model_path)
+        if self.quantized_layers is not None:
+            self.model_fingerprint += '-int8:' + ','.join(self.quantized_layers)
+        # Optional GraphCache consulted by predict() before preprocessing
+        self.cache = cache
         self.label_map = self._load_label_map(label_map_path)
         self.idx_to_label = {v: k for k, v in self.label_map.items()} if self.label_map else None
+        # With num_replicas > 0, forward passes run on that many model replicas, each on its own
+        # thread limited to intra_op_threads; num_replicas=1 serializes all forward passes
+        self.replicas = (
+            ReplicaPool(self.model, num_replicas, intra_op_threads, inter_op_threads)
+            if num_replicas > 0 else None
+        )
+        # Concurrent predict() calls share forward passes when micro_batch_size > 1
+        self.scheduler = (
+            MicroBatchScheduler(self, max_batch_size=micro_batch_size, max_wait_ms=micro_batch_wait_ms,
+                                num_workers=max(1, num_replicas))
+            if micro_batch_size > 1 else None
+        )
 
     
+    @staticmethod
+    def _is_torchscript(model_path):
+        # TorchScript archives carry compiled code, torch.save checkpoints do not
+        if not zipfile.is_zipfile(model_path):
+            return False
+        with zipfile.ZipFile(model_path) as archive:
+            return any(name.endswith('/constants.pkl') for name in archive.namelist())
+
     def _load_model(self, model_path):
+        # Models exported with `python -m ai_model.export` run without rebuilding HybridGCNGATModel
+        self.scripted = self._is_torchscript(model_path)
+        if self.scripted:
+            model = torch.jit.load(model_path, map_location=self.device)
+            model.eval()
+            return model
+
+        from .utils import HybridGCNGATModel
+
         checkpoint = torch.load(model_path, map_location=self.device, weights_only=True)
         
         if isinstance(checkpoint, dict):
@@ -50,14 +104,54 @@ class LeafDiseasePredictor:
         model.eval()
         return model
     
+    def _quantize(self, calibration_graphs, tolerance):
+        """
+        Replace the model with a TorchScript copy whose linear layers are dynamically quantized to int8.
+        `calibration_graphs` (a list of graphs or a directory written by save_packed_graphs) picks the
+        layers: one stays in fp32 if quantizing it changes more than `tolerance` of their predictions,
+        as with `python -m ai_model.export --quantize --graphs_dir ...`
+        """
+        if self.scripted:
+            raise ValueError("quantize needs a .pt checkpoint; TorchScript models are quantized when exported")
+        if self.device.type != 'cpu':
+            raise ValueError("int8 dynamic quantization is only supported on CPU")
+        if isinstance(calibration_graphs, (str, os.PathLike)):
+            from .utils import PackedGraphDataset
+
+            dataset = PackedGraphDataset(calibration_graphs)
+            calibration_graphs = [dataset[i] for i in range(min(len(dataset), 256))]
+        if not calibration_graphs:
+            raise ValueError("quantize needs calibration graphs to check the int8 layers against fp32")
+        from .export import FrozenHybridGCNGATModel, quantize_frozen
+
+        frozen, self.quantized_layers = quantize_frozen(
+            FrozenHybridGCNGATModel(self.model), calibration_graphs, tolerance
+        )
+        self.model = torch.jit.freeze(torch.jit.script(frozen))
+        self.scripted = True
+        print(f"Quantized {len(self.quantized_layers)} linear layers to int8 on {len(calibration_graphs)} "
+              f"calibration graphs: {', '.join(self.quantized_layers) or 'none'}")
+
+    def _fingerprint(self, model_path):
+        digest = hashlib.sha256()
+        with open(model_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
     def _load_label_map(self, label_map_path):
         if label_map_path and os.path.exists(label_map_path):
             with open(label_map_path, 'r') as f:
                 return json.load(f)
         return None
     
-    def _image_to_graph(self, image_path):
-        node_features, edge_index, edge_attr = preprocessing_image_to_graph(image_path)
+    def _image_to_graph(self, image, timings=None):
+        if self.preprocess_pool is not None:
+            return self.preprocess_pool.image_to_graph(image, timings)
+
+        node_features, edge_index, edge_attr = preprocessing_image_to_graph(
+            image, timings=timings, fast=self.fast_preprocess
+        )
         
         # Create PyTorch Geometric Data object
         graph_data = Data(
@@ -68,27 +162,181 @@ class LeafDiseasePredictor:
         
         return graph_data
     
+    def _iter_graphs(self, image_paths):
+        """Yield (index, graph) for every image, with graph None if preprocessing failed"""
+        if self.preprocess_pool is not None:
+            # Graphs arrive as soon as workers finish them
+            for result in self.preprocess_pool.map(image_paths, ordered=False):
+                yield result.index, result.graph
+            return
+
+        for index, image_path in enumerate(image_paths):
+            try:
+                yield index, self._image_to_graph(image_path)
+            except Exception:
+                yield index, None
     
-    def predict(self, image_path):
-        graph_data = self._image_to_graph(image_path).to(self.device)
+    def _label_for(self, class_idx):
+        if self.idx_to_label:
+            return self.idx_to_label[class_idx]
+        return f"Class_{class_idx}"
+
+    def _forward(self, data, model=None):
+        model = model or self.model
+        if not self.scripted:
+            return model(data)
+        if isinstance(data, Batch):
+            return model(data.x, data.edge_index, data.batch, data.num_graphs)
+        batch = torch.zeros(data.num_nodes, dtype=torch.long, device=data.x.device)
+        return model(data.x, data.edge_index, batch, 1)
+
+    def _predict_with(self, model, graphs):
+        # Collate into one disconnected graph; the model pools per graph via `batch`
+        batch = Batch.from_data_list(graphs).to(self.device)
+
+        # inference_mode also skips the version counters and view tracking that no_grad keeps
+        with torch.inference_mode():
+            output = self._forward(batch, model)
+            predicted = torch.argmax(output, dim=1)
+
+        return predicted.tolist()
+
+    def _predict_one(self, model, graph_data):
+        with torch.inference_mode():
+            output = self._forward(graph_data.to(self.device), model)
+            return torch.argmax(output, dim=1).item()
+
+    def _predict_graphs(self, graphs):
+        """Run a single forward pass over a list of graphs and return class indices"""
+        if self.replicas is not None:
+            return self.replicas.run(self._predict_with, graphs)
+        return self._predict_with(self.model, graphs)
+
+    def predict_graph(self, graph_data):
+        """Class index of one graph, through the micro-batch scheduler or a model replica when enabled"""
+        if self.scheduler is not None:
+            return self.scheduler.predict(graph_data)
+        if self.replicas is not None:
+            return self.replicas.run(self._predict_one, graph_data)
+        return self._predict_one(self.model, graph_data)
+
+    def warm_up(self, image_size=128):
+        """
+        Run a noise image through preprocessing (including the worker pool) and one forward pass,
+        bypassing the cache and the micro-batch scheduler, so the first request does not pay for it
+        """
+        dummy = np.random.default_rng(0).integers(0, 256, (image_size, image_size, 3), dtype=np.uint8)
+        return self._label_for(self._predict_graphs([self._image_to_graph(dummy)])[0])
+
+    def _read_image(self, image):
+        """Return `image` as a path, encoded bytes or decoded array; file-like objects are read"""
+        if hasattr(image, 'read'):
+            return image.read()
+        return image
+
+    def _image_bytes(self, image):
+        if isinstance(image, (str, os.PathLike)):
+            with open(image, 'rb') as f:
+                return f.read()
+        if isinstance(image, np.ndarray):
+            return str(image.shape).encode() + image.tobytes()
+        return bytes(image)
+
+    def predict(self, image, timings=None):
+        """
+        Predict the label of an image given as a path, encoded bytes, file-like object or BGR array.
+        If `timings` is a dict, the seconds spent in the cache lookup, each preprocessing
+        stage and the forward pass (including any micro-batch wait) are added to it
+        """
+        image = self._read_image(image)
+
+        started = time.perf_counter()
+        cache_key, entry = None, None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self._image_bytes(image), fast=self.fast_preprocess)
+            entry = self.cache.get(cache_key)
+            started = _record_stage(timings, 'cache_lookup', started)
+            if entry is not None and entry.get('model') == self.model_fingerprint:
+                return entry['prediction']
+
+        if entry is not None:
+            # Graph is cached but was classified by a different model
+            graph_data = Data(x=entry['x'], edge_index=entry['edge_index'], edge_attr=entry['edge_attr'])
+        else:
+            graph_data = self._image_to_graph(image, timings)
+            started = time.perf_counter()
         
-        with torch.no_grad():
-            output = self.model(graph_data)
-            predicted_class = torch.argmax(output, dim=1).item()
+        predicted_class = self.predict_graph(graph_data)
+        _record_stage(timings, 'forward', started)
         
-        if self.idx_to_label:
-            return self.idx_to_label[predicted_class]
-        return f"Class_{predicted_class}"
+        label = self._label_for(predicted_class)
+        if self.cache is not None:
+            self.cache.put(cache_key, {
+                'x': graph_data.x.cpu(),
+                'edge_index': graph_data.edge_index.cpu(),
+                'edge_attr': graph_data.edge_attr.cpu(),
+                'prediction': label,
+                'model': self.model_fingerprint,
+            })
+        return label
 
-    def predict_batch(self, image_paths):
-        results = []
-        for image_path in image_paths:
-            try:
-                label = self.predict(image_path)
-                results.append((image_path, label))
-            except Exception:
-                results.append((image_path, "ERROR"))
-        return results
+    def _assign_labels(self, labels, positions, graphs, image_paths):
+        try:
+            predictions = list(zip(positions, self._predict_graphs(graphs)))
+        except Exception as e:
+            if len(graphs) == 1:
+                print(f"Prediction failed for {image_paths[positions[0]]}: {type(e).__name__}: {e}")
+                predictions = []
+            else:
+                # Retry one by one so a single bad graph does not fail the whole batch
+                predictions = []
+                for pos, graph_data in zip(positions, graphs):
+                    try:
+                        predictions.append((pos, self._predict_graphs([graph_data])[0]))
+                    except Exception as item_error:
+                        print(f"Prediction failed for {image_paths[pos]}: {type(item_error).__name__}: {item_error}")
+
+        for pos, class_idx in predictions:
+            labels[pos] = self._label_for(class_idx)
+
+    def predict_batch(self, image_paths, max_batch_size=None):
+        max_batch_size = max_batch_size or self.max_batch_size
+        image_paths = list(image_paths)
+
+        # Images that fail preprocessing are reported as errors
+        labels = ["ERROR"] * len(image_paths)
+        graphs, positions = [], []
+        for pos, graph_data in self._iter_graphs(image_paths):
+            if graph_data is None:
+                continue
+            graphs.append(graph_data)
+            positions.append(pos)
+
+            if len(graphs) == max_batch_size:
+                self._assign_labels(labels, positions, graphs, image_paths)
+                graphs, positions = [], []
+
+        if graphs:
+            self._assign_labels(labels, positions, graphs, image_paths)
+
+        return list(zip(image_paths, labels))
+
+    def stats(self):
+        """Micro-batching, replica and quantization statistics for the enabled features"""
+        stats = self.scheduler.stats() if self.scheduler is not None else {}
+        if self.replicas is not None:
+            stats['replicas'] = self.replicas.stats()
+        if self.quantized_layers is not None:
+            stats['quantized_layers'] = self.quantized_layers
+        return stats
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.close()
+        if self.replicas is not None:
+            self.replicas.close()
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Deploy leaf disease classification model")
@@ -97,6 +345,13 @@ def main():
     parser.add_argument('--label_map', type=str, default=None)
     parser.add_argument('--device', type=str, default='auto', choices=['auto', 'cpu', 'cuda'])
     parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_workers', type=int, default=0)
+    parser.add_argument('--fast_preprocess', action='store_true',
+                        help="Resize before CLAHE and decode large JPEGs at reduced resolution")
+    parser.add_argument('--quantize', action='store_true', help="Quantize the model's linear layers to int8 (CPU only)")
+    parser.add_argument('--calibration_dir', type=str, default=None,
+                        help="Graphs written by save_packed_graphs, used with --quantize to pick the int8 layers")
     
     args = parser.parse_args()
     
@@ -105,7 +360,12 @@ def main():
     predictor = LeafDiseasePredictor(
         model_path=args.model_path,
         label_map_path=args.label_map,
-        device=device
+        device=device,
+        max_batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        fast_preprocess=args.fast_preprocess,
+        quantize=args.quantize,
+        calibration_graphs=args.calibration_dir
     )
     
     if os.path.isfile(args.image_path):
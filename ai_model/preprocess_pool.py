@@ -0,0 +1,167 @@
+import os
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import torch
+from torch_geometric.data import Data
+
+from .preprocessing import preprocessing_image_to_graph
+
+
+# One entry per input image; `graph` is None and `error` is set when preprocessing failed
+PreprocessResult = collections.namedtuple('PreprocessResult', ['index', 'image_path', 'graph', 'error'])
+
+
+def _init_worker():
+    # Each worker handles one image at a time, so avoid intra-op thread oversubscription
+    torch.set_num_threads(1)
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+
+def _image_to_arrays(image_path, num_segments, compactness, fast=False):
+    timings = {}
+    node_features, edge_index, edge_attr = preprocessing_image_to_graph(
+        image_path, num_segments, compactness, timings=timings, fast=fast
+    )
+    # Send plain arrays back to the parent; pickling tensors across processes
+    # goes through shared memory file descriptors which is slower for small graphs
+    return node_features.numpy(), edge_index.numpy(), edge_attr.numpy(), timings
+
+
+def _arrays_to_graph(arrays):
+    node_features, edge_index, edge_attr = arrays[:3]
+    return Data(
+        x=torch.from_numpy(node_features),
+        edge_index=torch.from_numpy(edge_index),
+        edge_attr=torch.from_numpy(edge_attr)
+    )
+
+
+class GraphPreprocessingPool:
+    """
+    Process pool that converts images to graphs in parallel.
+
+    At most `max_pending` images are in flight at a time so that results are
+    consumed (e.g. by the model) while the workers keep preprocessing.
+    A failing image yields a result with `error` set instead of raising.
+    If a worker dies, the pool is replaced and the images it was running are
+    retried once; an image that kills the fresh pool too is reported as failed.
+    """
+    def __init__(self, num_workers=None, max_pending=None, num_segments=50, compactness=15, fast=False):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.num_workers * 4
+        self.num_segments = num_segments
+        self.compactness = compactness
+        self.fast = fast
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_worker)
+        return self._executor
+
+    def _submit(self, image_path):
+        """Submit one image, returning its future and the executor running it"""
+        with self._lock:
+            executor = self._get_executor()
+        try:
+            return executor.submit(
+                _image_to_arrays, image_path, self.num_segments, self.compactness, self.fast
+            ), executor
+        except BrokenProcessPool:
+            # A worker died (e.g. crashed on a corrupt file); start a fresh pool
+            self._reset_executor(executor)
+            with self._lock:
+                executor = self._get_executor()
+            return executor.submit(
+                _image_to_arrays, image_path, self.num_segments, self.compactness, self.fast
+            ), executor
+
+    def _reset_executor(self, broken):
+        """Shut down a pool whose worker died so that the next submission starts a fresh one"""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        # Stops the broken pool's management thread and releases its queues and pipes
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _arrays(self, image_path, future, executor):
+        """
+        Wait for a submitted image. If its pool broke (this or another image killed a
+        worker), the image is retried once on a fresh pool
+        """
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._reset_executor(executor)
+            future, _ = self._submit(image_path)
+            return future.result()
+
+    def _result(self, index, image_path, future, executor):
+        try:
+            graph = _arrays_to_graph(self._arrays(image_path, future, executor))
+            return PreprocessResult(index, image_path, graph, None)
+        except Exception as e:
+            return PreprocessResult(index, image_path, None, e)
+
+    def image_to_graph(self, image_path, timings=None):
+        """
+        Preprocess a single image in a worker process and return a PyG Data object.
+        Stage timings measured in the worker are added to `timings` if it is a dict
+        """
+        future, executor = self._submit(image_path)
+        arrays = self._arrays(image_path, future, executor)
+        if timings is not None:
+            for stage, seconds in arrays[3].items():
+                timings[stage] = timings.get(stage, 0.0) + seconds
+        return _arrays_to_graph(arrays)
+
+    def map(self, image_paths, ordered=True):
+        """
+        Preprocess many images, yielding a PreprocessResult per image either in
+        input order (`ordered=True`) or as soon as each one completes
+        """
+        inputs = iter(enumerate(image_paths))
+        pending = collections.OrderedDict()
+
+        def fill():
+            while len(pending) < self.max_pending:
+                item = next(inputs, None)
+                if item is None:
+                    return
+                index, image_path = item
+                future, executor = self._submit(image_path)
+                pending[future] = (index, image_path, executor)
+
+        fill()
+        while pending:
+            if ordered:
+                future = next(iter(pending))
+                done = [future]
+                wait(done)
+            else:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                index, image_path, executor = pending.pop(future)
+                yield self._result(index, image_path, future, executor)
+            fill()
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
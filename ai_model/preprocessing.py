@@ -0,0 +1,325 @@
+import os
+import cv2
+import time
+import numpy as np
+from skimage import color
+from skimage.segmentation import slic
+
+import torch
+
+# Image-to-graph preprocessing shared by training (utils.py) and inference. Only OpenCV,
+# scikit-image, NumPy and torch are needed, so serving an exported model does not import
+# torch_geometric's layers or the model classes
+
+
+def extract_segments_using_slic(image, num_segments=50, compactness=15, lab=None):
+    """
+    Extract super-pixel segments using SLIC algorithm with improved parameters
+    for leaf disease classification. Pass `lab` to reuse an existing LAB
+    conversion of `image` (L in [0, 100])
+    """
+    # Convert to LAB color space for better segmentation of leaf patterns
+    img_lab = color.rgb2lab(image) if lab is None else lab
+    
+    # Apply SLIC with adjusted parameters for capturing disease patterns
+    segments = slic(
+        img_lab, 
+        n_segments=num_segments, 
+        compactness=compactness, 
+        sigma=2, 
+        start_label=0,
+        channel_axis=2
+    )
+    
+    return segments
+
+def obtain_enhanced_node_features(image, segments, float_hsv=False):
+    """
+    Enhanced feature extraction for each segment including color and texture.
+    All segments are processed in one pass using label-indexed sums.
+    With `float_hsv`, HSV is computed from the float image directly instead of
+    a uint8 round trip, scaled to the same ranges
+    """
+    # Convert to multiple color spaces for richer features
+    if float_hsv:
+        # Float HSV has H in [0, 360) and S, V in [0, 1]; uint8 HSV stores H / 2
+        img_hsv = cv2.cvtColor(image.astype(np.float32), cv2.COLOR_RGB2HSV)
+        img_hsv[..., 0] *= 1.0 / 510.0
+    else:
+        img_hsv = cv2.cvtColor(
+            (image * 255).astype(np.uint8), 
+            cv2.COLOR_RGB2HSV
+        ).astype(np.float32) / 255.0
+    
+    # Get maximum segment ID
+    num_nodes = segments.max() + 1
+    labels = segments.ravel()
+    rgb = image.reshape(-1, 3)
+    hsv = img_hsv.reshape(-1, 3)
+    
+    def segment_sum(values):
+        # Per-channel sum of pixel values for every segment, shape (num_nodes, 3)
+        return np.stack([
+            np.bincount(labels, weights=values[:, c], minlength=num_nodes)
+            for c in range(values.shape[1])
+        ], axis=1)
+    
+    counts = np.bincount(labels, minlength=num_nodes)
+    safe_counts = np.maximum(counts, 1)[:, None]  # Empty segments are zeroed below
+    
+    # Extract RGB features (segment means)
+    rgb_features = segment_sum(rgb) / safe_counts
+    
+    # Extract HSV features; accumulate in float32 like ndarray.mean does for
+    # float32 input so the features match the per-segment implementation
+    hsv_sum = np.zeros((num_nodes, 3), dtype=np.float32)
+    np.add.at(hsv_sum, labels, hsv)
+    hsv_features = (hsv_sum / safe_counts).astype(np.float32)
+    
+    # Extract simple texture features (standard deviation of colors),
+    # using deviations from the segment mean as np.std does
+    deviation = rgb - rgb_features[labels]
+    texture_rgb = np.sqrt(segment_sum(deviation ** 2) / safe_counts)
+    
+    # Calculate segment size (normalized by image size)
+    segment_size = counts / (image.shape[0] * image.shape[1])
+    
+    # Combine features
+    node_features = np.concatenate([
+        rgb_features,              # RGB mean (3)
+        hsv_features,              # HSV mean (3)
+        texture_rgb,               # RGB std (3)
+        segment_size[:, None]      # Size (1)
+    ], axis=1)
+    
+    # Default features for empty segments
+    node_features[counts == 0] = 0
+    
+    return node_features
+
+def find_adjacent_segments(segments):
+    """
+    Find pairs of segments that touch in the 8-neighbourhood, in the same order
+    as the edges of skimage's RAG (connectivity=2) are iterated
+    """
+    height, width = segments.shape
+    padded = np.pad(segments, 1, mode='edge')
+    
+    # Compare every pixel with its 3x3 neighbourhood; the scan order
+    # (pixel, then neighbour offset) is the order in which the RAG adds edges
+    centers, neighbours, times = [], [], []
+    pixel_order = np.arange(height * width).reshape(height, width) * 9
+    for k, (dy, dx) in enumerate((dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)):
+        shifted = padded[1 + dy:height + 1 + dy, 1 + dx:width + 1 + dx]
+        mask = shifted != segments
+        centers.append(segments[mask])
+        neighbours.append(shifted[mask])
+        times.append(pixel_order[mask] + k)
+    
+    centers = np.concatenate(centers).astype(np.int64)
+    neighbours = np.concatenate(neighbours).astype(np.int64)
+    times = np.concatenate(times)
+    if times.size == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    
+    # Keep the first occurrence of every undirected pair
+    num_labels = int(segments.max()) + 1
+    keys = np.minimum(centers, neighbours) * num_labels + np.maximum(centers, neighbours)
+    order = np.lexsort((times, keys))
+    first = order[np.r_[True, keys[order][1:] != keys[order][:-1]]]
+    first = first[np.argsort(times[first])]
+    u, v = centers[first], neighbours[first]
+    
+    # Nodes are ranked by first appearance (the center is added before its neighbour)
+    appearance = np.stack([u, v], axis=1).ravel()
+    _, first_seen = np.unique(appearance, return_index=True)
+    rank = np.full(num_labels, len(appearance), dtype=np.int64)
+    rank[appearance[first_seen]] = first_seen
+    
+    # networkx yields each edge from the endpoint that was added first,
+    # grouped by that endpoint and then in insertion order
+    swap = rank[v] < rank[u]
+    src = np.where(swap, v, u)
+    dst = np.where(swap, u, v)
+    order = np.argsort(rank[src], kind='stable')
+    
+    return np.stack([src[order], dst[order]], axis=1)
+
+def construct_region_adjacency_graph(image, segments):
+    """
+    Construct region adjacency graph from segments with improved edge weighting
+    """
+    # Find adjacent regions; edge weights are based on mean color difference
+    pairs = find_adjacent_segments(segments)
+    
+    # Handle empty edge case
+    if len(pairs) == 0:
+        edge_index = [[0, 0], [0, 0]]  # Self-loop as fallback
+        edge_attr = [[1.0], [1.0]]
+        return np.array(edge_index).T, np.array(edge_attr)
+    
+    # Mean color of every region
+    num_labels = segments.max() + 1
+    labels = segments.ravel()
+    pixels = image.reshape(-1, image.shape[-1])
+    counts = np.bincount(labels, minlength=num_labels)
+    mean_color = np.stack([
+        np.bincount(labels, weights=pixels[:, c], minlength=num_labels)
+        for c in range(pixels.shape[1])
+    ], axis=1) / np.maximum(counts, 1)[:, None]
+    
+    # Extract edge weight (color distance)
+    diff = mean_color[pairs[:, 0]] - mean_color[pairs[:, 1]]
+    weight = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+    
+    # Add normalized weight as edge attribute
+    norm_weight = np.exp(-weight / 10.0)  # Exponential decay for large color differences
+    
+    # Add edge in both directions (undirected graph)
+    edge_index = np.stack([pairs, pairs[:, ::-1]], axis=1).reshape(-1, 2)
+    edge_attr = np.repeat(norm_weight, 2)[:, None]
+        
+    return edge_index.T, edge_attr
+
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+def _decode(read, min_size=None):
+    """
+    Decode with `read(flag)`. With `min_size`, try the reduced-resolution flags
+    first (JPEG decoders skip most of the work for them) and keep the first
+    result whose shorter side is still at least `min_size` pixels
+    """
+    if min_size:
+        for _, flag in REDUCED_DECODE_FLAGS:
+            img = read(flag)
+            if img is None:
+                break
+            if min(img.shape[:2]) >= min_size:
+                return img
+    return read(cv2.IMREAD_COLOR)
+
+def load_image(image, min_size=None):
+    """
+    Load an image as a BGR uint8 array from a file path, raw encoded bytes
+    (bytes, bytearray, memoryview or a 1-D uint8 array), a binary file-like
+    object, or an already decoded BGR array.
+    With `min_size`, encoded images may be decoded at 1/2, 1/4 or 1/8 scale
+    as long as the shorter side stays at least `min_size` pixels
+    """
+    if isinstance(image, (str, os.PathLike)):
+        path = os.fspath(image)
+        img = _decode(lambda flag: cv2.imread(path, flag), min_size)
+        if img is None:
+            raise ValueError(f"Failed to load image: {image}")
+        return img
+    
+    if hasattr(image, 'read'):
+        image = image.read()
+    
+    if isinstance(image, np.ndarray) and image.ndim >= 2:
+        return image
+    
+    # Decode in memory, no temporary file needed
+    buffer = np.frombuffer(image, dtype=np.uint8)
+    img = _decode(lambda flag: cv2.imdecode(buffer, flag), min_size) if buffer.size else None
+    if img is None:
+        raise ValueError("Failed to decode image bytes")
+    return img
+
+def apply_clahe(img):
+    """Convert a BGR image to RGB with CLAHE applied to the lightness channel"""
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
+    lab_planes = list(cv2.split(lab))  # Convert to list to allow assignment
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    lab_planes[0] = clahe.apply(lab_planes[0])
+    lab = cv2.merge(lab_planes)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+def resize_and_normalize(img, image_size=128):
+    """Resize to image_size x image_size and scale pixel values to [0, 1]"""
+    img = cv2.resize(img, (image_size, image_size))
+    return img / 255.0
+
+def _record_stage(timings, stage, started):
+    """Add the seconds since `started` to timings[stage] (if timings is a dict) and return the current time"""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - started)
+    return now
+
+def _fast_preprocess(image, image_size, timings, started):
+    """
+    Downscale-first variant of steps 1-5 of preprocessing_image_to_graph.
+    Decodes at reduced resolution, resizes before CLAHE and returns the
+    normalized RGB image together with its LAB conversion for SLIC
+    """
+    img = load_image(image, min_size=image_size)
+    started = _record_stage(timings, 'decode', started)
+    
+    # Area interpolation averages the pixels dropped by a large downscale
+    img = cv2.resize(img, (image_size, image_size), interpolation=cv2.INTER_AREA)
+    started = _record_stage(timings, 'resize', started)
+    
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    lab[..., 0] = clahe.apply(np.ascontiguousarray(lab[..., 0]))
+    img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB) / 255.0
+    
+    # 8-bit LAB stores L * 255 / 100 and a, b offset by 128
+    lab = lab.astype(np.float64)
+    lab[..., 0] *= 100.0 / 255.0
+    lab[..., 1:] -= 128.0
+    started = _record_stage(timings, 'clahe', started)
+    return img, lab, started
+
+def preprocessing_image_to_graph(image, num_segments=50, compactness=15, image_size=128, timings=None, fast=False):
+    """
+    Convert an image to a graph representation using enhanced SLIC segmentation
+    with richer node features and edge attributes.
+    `image` can be a file path, encoded image bytes or a decoded BGR array.
+    If `timings` is a dict, the seconds spent in each stage are added to it.
+    
+    `fast` resizes before CLAHE (decoding large JPEGs at reduced resolution),
+    reuses the CLAHE LAB conversion for SLIC and computes HSV in float. Its
+    graphs are close to but not identical with the default pipeline, see
+    `python -m ai_model.benchmark --val_dir` for an accuracy comparison
+    """
+    started = time.perf_counter()
+    
+    slic_lab = None
+    if fast:
+        img, slic_lab, started = _fast_preprocess(image, image_size, timings, started)
+    else:
+        # 1. Load image
+        img = load_image(image)
+        started = _record_stage(timings, 'decode', started)
+    
+        # 2-3. Convert to RGB and apply CLAHE for contrast enhancement
+        img = apply_clahe(img)
+        started = _record_stage(timings, 'clahe', started)
+    
+        # 4-5. Resize and normalize the image
+        img = resize_and_normalize(img, image_size)
+        started = _record_stage(timings, 'resize', started)
+    
+    # 6. Extract segments using SLIC
+    segments = extract_segments_using_slic(img, num_segments, compactness, lab=slic_lab)
+    started = _record_stage(timings, 'slic', started)
+    
+    # 7. Obtain enhanced node features
+    node_features = obtain_enhanced_node_features(img, segments, float_hsv=fast)
+    node_features = torch.tensor(node_features, dtype=torch.float)
+    started = _record_stage(timings, 'node_features', started)
+    
+    # 8. Construct region adjacency graph with edge attributes
+    edge_index, edge_attr = construct_region_adjacency_graph(img, segments)
+    edge_index = torch.tensor(edge_index, dtype=torch.long)
+    edge_attr = torch.tensor(edge_attr, dtype=torch.float)
+    _record_stage(timings, 'adjacency', started)
+    
+    return node_features, edge_index, edge_attr
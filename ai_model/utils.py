@@ -1,12 +1,10 @@
 import os
-import cv2
+import json
 import math
 import random
 import pickle
 import shutil
 import numpy as np
-from skimage import color, graph
-from skimage.segmentation import slic
 
 import torch
 import torch.nn.functional as F
@@ -17,144 +15,151 @@ from torch_geometric.data import Data
 from torch_geometric.nn import GCNConv, GATConv, global_mean_pool, global_max_pool
 from torch_geometric.nn import BatchNorm, LayerNorm, PairNorm
 
+# Preprocessing lives in preprocessing.py (no training dependencies); re-exported for existing imports
+from .preprocessing import (
+    apply_clahe, construct_region_adjacency_graph, extract_segments_using_slic, find_adjacent_segments,
+    load_image, obtain_enhanced_node_features, preprocessing_image_to_graph, resize_and_normalize
+)
 
-def extract_segments_using_slic(image, num_segments=50, compactness=15):
-    """
-    Extract super-pixel segments using SLIC algorithm with improved parameters
-    for leaf disease classification
-    """
-    # Convert to LAB color space for better segmentation of leaf patterns
-    img_lab = color.rgb2lab(image)
-    
-    # Apply SLIC with adjusted parameters for capturing disease patterns
-    segments = slic(
-        img_lab, 
-        n_segments=num_segments, 
-        compactness=compactness, 
-        sigma=2, 
-        start_label=0,
-        channel_axis=2
-    )
-    
-    return segments
 
-def obtain_enhanced_node_features(image, segments):
+PACKED_GRAPH_ARRAYS = {
+    # name: (dtype, number of columns)
+    'x': (np.float32, 10),
+    'edge_index': (np.int64, 2),
+    'edge_attr': (np.float32, 1),
+}
+
+def save_packed_graphs(root_dir, output_dir, num_segments=50, compactness=15, num_workers=0):
     """
-    Enhanced feature extraction for each segment including color and texture
+    Precompute graphs for every image in `root_dir/<class>/` and write them in
+    a packed format: node features, edges and edge attributes of all graphs
+    concatenated into flat binary files, plus offset tables locating each graph.
+    The result can be loaded with PackedGraphDataset without unpickling files
     """
-    node_features = []
+    os.makedirs(output_dir, exist_ok=True)
     
-    # Convert to multiple color spaces for richer features
-    img_hsv = cv2.cvtColor(
-        (image * 255).astype(np.uint8), 
-        cv2.COLOR_RGB2HSV
-    ).astype(np.float32) / 255.0
+    classes = sorted(d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d)))
+    label_map = {cls: idx for idx, cls in enumerate(classes)}
+    samples = []
+    for cls in classes:
+        cls_dir = os.path.join(root_dir, cls)
+        img_files = sorted(f for f in os.listdir(cls_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        samples.extend((os.path.join(cls_dir, f), label_map[cls]) for f in img_files)
     
-    # Get maximum segment ID
-    max_segment_id = segments.max()
+    image_paths = [path for path, _ in samples]
+    if num_workers > 0:
+        from .preprocess_pool import GraphPreprocessingPool
+        pool = GraphPreprocessingPool(num_workers, num_segments=num_segments, compactness=compactness)
+        results = ((r.graph, r.error) for r in pool.map(image_paths, ordered=True))
+    else:
+        pool = None
+        
+        def serial_results():
+            for path in image_paths:
+                try:
+                    x, edge_index, edge_attr = preprocessing_image_to_graph(path, num_segments, compactness)
+                    yield Data(x=x, edge_index=edge_index, edge_attr=edge_attr), None
+                except Exception as e:
+                    yield None, e
+        results = serial_results()
     
-    for i in range(max_segment_id + 1):
-        mask = segments == i
-        if np.any(mask):  # Make sure segment is not empty
-            # Extract RGB features
-            rgb_features = image[mask].mean(axis=0)  # Shape: (3,)
+    # Stream graphs to disk so memory stays flat regardless of dataset size
+    files = {name: open(os.path.join(output_dir, f"{name}.bin"), 'wb') for name in PACKED_GRAPH_ARRAYS}
+    node_ptr, edge_ptr, labels, written = [0], [0], [], []
+    try:
+        for (path, label), (data, error) in zip(samples, results):
+            if error is not None:
+                print(f"Error processing {path}: {error}")
+                continue
             
-            # Extract HSV features
-            hsv_features = img_hsv[mask].mean(axis=0)  # Shape: (3,)
+            arrays = {
+                'x': data.x.numpy(),
+                'edge_index': data.edge_index.numpy().T,
+                'edge_attr': data.edge_attr.numpy(),
+            }
+            for name, (dtype, _) in PACKED_GRAPH_ARRAYS.items():
+                files[name].write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
             
-            # Extract simple texture features (standard deviation of colors)
-            texture_rgb = np.std(image[mask], axis=0) if mask.sum() > 1 else np.zeros(3)
-            
-            # Calculate segment size (normalized by image size)
-            segment_size = mask.sum() / (image.shape[0] * image.shape[1])
-            
-            # Combine features
-            features = np.concatenate([
-                rgb_features,          # RGB mean (3)
-                hsv_features,          # HSV mean (3)
-                texture_rgb,           # RGB std (3)
-                [segment_size]         # Size (1)
-            ])
-            
-            node_features.append(features)
-        else:
-            # Default features for empty segments
-            node_features.append(np.zeros(10))
+            node_ptr.append(node_ptr[-1] + arrays['x'].shape[0])
+            edge_ptr.append(edge_ptr[-1] + arrays['edge_index'].shape[0])
+            labels.append(label)
+            written.append(os.path.relpath(path, root_dir))
+    finally:
+        for f in files.values():
+            f.close()
+        if pool is not None:
+            pool.close()
     
-    return np.array(node_features)
+    np.save(os.path.join(output_dir, 'node_ptr.npy'), np.array(node_ptr, dtype=np.int64))
+    np.save(os.path.join(output_dir, 'edge_ptr.npy'), np.array(edge_ptr, dtype=np.int64))
+    np.save(os.path.join(output_dir, 'labels.npy'), np.array(labels, dtype=np.int64))
+    with open(os.path.join(output_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'label_map': label_map,
+            'num_graphs': len(labels),
+            'num_nodes': node_ptr[-1],
+            'num_edges': edge_ptr[-1],
+            'num_segments': num_segments,
+            'compactness': compactness,
+            'files': written,
+        }, f, indent=2)
+    
+    print(f"Packed {len(labels)} graphs into {output_dir}")
 
-def construct_region_adjacency_graph(image, segments):
+class PackedGraphDataset(Dataset):
     """
-    Construct region adjacency graph from segments with improved edge weighting
+    Graph dataset backed by the packed format written by save_packed_graphs.
+    Arrays are memory-mapped, so opening the dataset is constant time and
+    graphs are only read from disk when accessed
     """
-    # Create region adjacency graph - this now uses edge weights based on color difference
-    rag = graph.rag_mean_color(image, segments)
-    
-    # Construct edge index and edge attributes for PyG
-    edge_index = []
-    edge_attr = []
-    
-    for n1, n2, data in rag.edges(data=True):
-        # Add edge in both directions (undirected graph)
-        edge_index.append([n1, n2])
-        edge_index.append([n2, n1])
+    def __init__(self, packed_dir, transform=None):
+        super().__init__(root=None, transform=transform)
+        self.packed_dir = packed_dir
         
-        # Extract edge weight (color similarity)
-        weight = data.get('weight', 1.0)
+        with open(os.path.join(packed_dir, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.label_map = meta['label_map']
+        self.files = meta['files']
+        self._num_rows = {'x': meta['num_nodes'], 'edge_index': meta['num_edges'], 'edge_attr': meta['num_edges']}
         
-        # Add normalized weight as edge attribute
-        norm_weight = np.exp(-weight / 10.0)  # Exponential decay for large color differences
-        edge_attr.append([norm_weight])
-        edge_attr.append([norm_weight])
+        self.node_ptr = np.load(os.path.join(packed_dir, 'node_ptr.npy'))
+        self.edge_ptr = np.load(os.path.join(packed_dir, 'edge_ptr.npy'))
+        self.labels = np.load(os.path.join(packed_dir, 'labels.npy'))
+        self._arrays = None
     
-    # Handle empty edge case
-    if not edge_index:
-        edge_index = [[0, 0], [0, 0]]  # Self-loop as fallback
-        edge_attr = [[1.0], [1.0]]
-        
-    return np.array(edge_index).T, np.array(edge_attr)
-
-def preprocessing_image_to_graph(image_path, num_segments=50, compactness=15):
-    """
-    Convert an image to a graph representation using enhanced SLIC segmentation
-    with richer node features and edge attributes
-    """
-    # 1. Load image
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to load image: {image_path}")
-    
-    # 2. Preprocess image
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    # 3. Apply CLAHE for contrast enhancement
-    lab = cv2.cvtColor(img, cv2.COLOR_RGB2LAB)
-    lab_planes = list(cv2.split(lab))  # Convert to list to allow assignment
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-    lab_planes[0] = clahe.apply(lab_planes[0])
-    lab = cv2.merge(lab_planes)
-    img = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    def _open(self):
+        # Opened lazily so that DataLoader workers each map the files themselves
+        if self._arrays is None:
+            self._arrays = {}
+            for name, (dtype, columns) in PACKED_GRAPH_ARRAYS.items():
+                rows = self._num_rows[name]
+                path = os.path.join(self.packed_dir, f"{name}.bin")
+                if rows == 0:
+                    # np.memmap cannot map an empty file
+                    self._arrays[name] = np.empty((0, columns), dtype=dtype)
+                else:
+                    self._arrays[name] = np.memmap(path, dtype=dtype, mode='r', shape=(rows, columns))
+        return self._arrays
     
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
     
-    # 4. Resize image
-    img = cv2.resize(img, (128, 128))
+    def len(self):
+        return len(self.labels)
     
-    # 5. Normalize the image
-    img = img / 255.0
-    
-    # 6. Extract segments using SLIC
-    segments = extract_segments_using_slic(img, num_segments, compactness)
-    
-    # 7. Obtain enhanced node features
-    node_features = obtain_enhanced_node_features(img, segments)
-    node_features = torch.tensor(node_features, dtype=torch.float)
-    
-    # 8. Construct region adjacency graph with edge attributes
-    edge_index, edge_attr = construct_region_adjacency_graph(img, segments)
-    edge_index = torch.tensor(edge_index, dtype=torch.long)
-    edge_attr = torch.tensor(edge_attr, dtype=torch.float)
-    
-    return node_features, edge_index, edge_attr
+    def get(self, idx):
+        arrays = self._open()
+        n0, n1 = self.node_ptr[idx], self.node_ptr[idx + 1]
+        e0, e1 = self.edge_ptr[idx], self.edge_ptr[idx + 1]
+        
+        return Data(
+            x=torch.from_numpy(np.array(arrays['x'][n0:n1])),
+            edge_index=torch.from_numpy(np.array(arrays['edge_index'][e0:e1]).T.copy()),
+            edge_attr=torch.from_numpy(np.array(arrays['edge_attr'][e0:e1])),
+            y=torch.tensor([self.labels[idx]], dtype=torch.long)
+        )
 
 def edge_augmentation(data, p_add=0.1, p_remove=0.1):
     """
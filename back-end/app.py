@@ -1,22 +1,126 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import os
+import json
 import sys
 import threading
+import time
+import uuid
 
 from data import disease_data
+from session_store import create_session_store
+from retrieval_executor import RetrievalExecutor
+from metrics import Metrics
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from ai_model.predict import LeafDiseasePredictor
-from rag_llm.retriever import retrieve
-from rag_llm.llm_response import call_gemini
+# ai_model.predict (torch, torch_geometric) được import khi nạp mô hình, xem get_predictor
+from ai_model.cache import GraphCache
+from rag_llm.retriever import get_retriever
+from rag_llm.llm_response import call_gemini, stream_gemini
+from rag_llm.cache import CachedQueryEmbedding, ResponseCache
 
 app = Flask(__name__)
 
-# Load mô hình AI
-predictor = LeafDiseasePredictor(
-    model_path='ai_model/model.pt',
-    label_map_path='ai_model/label_map_vi.json',
-    device='auto'
+# Cache đồ thị và kết quả dự đoán cho ảnh tải lên lặp lại
+graph_cache = GraphCache(
+    max_entries=int(os.getenv("GRAPH_CACHE_SIZE", "1024")),
+    cache_dir=os.getenv("GRAPH_CACHE_DIR") or None
+)
+
+# Mô hình AI được nạp một lần, trong warm_up hoặc ở request đầu tiên
+_predictor = None
+_predictor_lock = threading.Lock()
+_retriever_lock = threading.Lock()
+
+# Trạng thái nạp của từng thành phần, trả về qua /ready
+readiness = {
+    name: {"ready": False, "seconds": None, "error": None}
+    for name in ("predictor", "retriever")
+}
+
+def _load_component(name, load):
+    """Chạy hàm nạp một thành phần và ghi thời gian nạp (hoặc lỗi) vào `readiness`."""
+    started = time.perf_counter()
+    try:
+        result = load()
+    except Exception as e:
+        readiness[name]["error"] = f"{type(e).__name__}: {e}"
+        raise
+    readiness[name].update(ready=True, seconds=round(time.perf_counter() - started, 3), error=None)
+    print(f"✅ {name} ready in {readiness[name]['seconds']}s")
+    return result
+
+def _create_predictor():
+    from ai_model.predict import LeafDiseasePredictor
+
+    return LeafDiseasePredictor(
+        # MODEL_PATH có thể trỏ tới bản TorchScript (python -m ai_model.export) để suy luận nhanh hơn
+        model_path=os.getenv("MODEL_PATH", "ai_model/model.pt"),
+        label_map_path='ai_model/label_map_vi.json',
+        device='auto',
+        num_workers=int(os.getenv("PREPROCESS_WORKERS", "2")),
+        cache=graph_cache,
+        # Gom các ảnh tải lên cùng lúc vào một lần chạy mô hình (MICRO_BATCH_SIZE=0 để tắt)
+        micro_batch_size=int(os.getenv("MICRO_BATCH_SIZE", "16")),
+        micro_batch_wait_ms=float(os.getenv("MICRO_BATCH_WAIT_MS", "5")),
+        # Tiền xử lý nhanh (thu nhỏ ảnh trước CLAHE); so sánh độ chính xác bằng
+        # python -m ai_model.benchmark --val_dir trước khi bật FAST_PREPROCESS=1
+        fast_preprocess=os.getenv("FAST_PREPROCESS") == "1",
+        # INFERENCE_REPLICAS bản sao mô hình, mỗi bản chạy trên một thread với số thread
+        # tính toán cố định, để các request đồng thời không tranh nhau toàn bộ CPU
+        num_replicas=int(os.getenv("INFERENCE_REPLICAS", "0")),
+        intra_op_threads=int(os.getenv("INFERENCE_INTRA_OP_THREADS", "0")) or None,
+        # QUANTIZE_MODEL=1 lượng tử hóa int8 khi nạp model.pt (chỉ CPU), giữ fp32 cho các lớp làm đổi
+        # dự đoán trên các graph hiệu chỉnh trong QUANTIZE_CALIBRATION_DIR (thư mục save_packed_graphs,
+        # bắt buộc); hoặc xuất sẵn bằng python -m ai_model.export --quantize --graphs_dir ... rồi đặt MODEL_PATH
+        quantize=os.getenv("QUANTIZE_MODEL") == "1",
+        calibration_graphs=os.getenv("QUANTIZE_CALIBRATION_DIR")
+    )
+
+def get_predictor(load=True):
+    """Mô hình dự đoán dùng chung; với load=False trả về None nếu chưa nạp."""
+    global _predictor
+    if _predictor is None and load:
+        with _predictor_lock:
+            if _predictor is None:
+                _predictor = _load_component("predictor", _create_predictor)
+    return _predictor
+
+def load_retriever():
+    """Retriever dùng chung với index đã nạp; lần nạp đầu tiên (warm-up hoặc request) đánh dấu sẵn sàng."""
+    retriever = get_retriever()
+    if not readiness["retriever"]["ready"]:
+        with _retriever_lock:
+            if not readiness["retriever"]["ready"]:
+                _load_component("retriever", retriever.vectorstore)
+    return retriever
+
+def _warm_up_component(name, load):
+    try:
+        load()
+    except Exception as e:
+        print(f"Warm-up {name} failed:", e)
+
+def warm_up():
+    """Nạp mô hình, retriever và chạy thử mỗi thứ một lần để request đầu tiên không phải chờ."""
+    _warm_up_component("predictor", lambda: get_predictor().warm_up())
+    _warm_up_component("retriever", lambda: load_retriever().warm_up())
+
+def is_ready():
+    return all(component["ready"] for component in readiness.values())
+
+def question_embeddings():
+    # Dùng chung mô hình với retriever nhưng cache vector câu hỏi riêng, không ghi ra đĩa,
+    # để câu hỏi chat không đẩy các truy vấn retrieve ra khỏi cache của retriever
+    return CachedQueryEmbedding(
+        get_retriever().embeddings().embeddings, max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+    )
+
+# Cache câu trả lời LLM; bật so khớp ngữ nghĩa bằng RESPONSE_CACHE_SEMANTIC=1.
+# Mô hình embedding chỉ được nạp ở lần tra cứu đầu tiên.
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+    embeddings_factory=question_embeddings if os.getenv("RESPONSE_CACHE_SEMANTIC") == "1" else None
 )
 
 class_to_key = {
@@ -28,109 +132,314 @@ class_to_key = {
     "Class_5": "narrow_brown_spot",
 }
 
-# Biến toàn cục
-last_disease_key = None
-last_disease_data = None
-retrieve_done = True
-last_location = None
-location_received = False
+# Trạng thái hội thoại theo phiên (chẩn đoán, kết quả retrieve, khu vực).
+# Dùng SESSION_STORE=sqlite:///đường/dẫn.db khi chạy nhiều worker.
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+sessions = create_session_store(ttl=SESSION_TTL)
+
+# Cookie chứa id phiên do server cấp cho client không gửi header X-Session-Id
+SESSION_COOKIE = "plant_session"
 
-def async_retrieve(query):
-    global last_disease_data, retrieve_done
+# Thread pool giới hạn cho retrieve; request chat chờ kết quả tối đa RETRIEVAL_WAIT_TIMEOUT giây
+retrieval_executor = RetrievalExecutor(
+    max_workers=int(os.getenv("RETRIEVAL_WORKERS", "4")),
+    max_queue=int(os.getenv("RETRIEVAL_QUEUE", "64"))
+)
+RETRIEVAL_WAIT_TIMEOUT = float(os.getenv("RETRIEVAL_WAIT_TIMEOUT", "10"))
+
+# Đo thời gian từng bước và xuất ở /metrics (METRICS=0 để tắt).
+# TRACE_HEADER=1 trả thêm header Server-Timing với thời gian các bước của mỗi request.
+metrics = Metrics(enabled=os.getenv("METRICS", "1") == "1", trace_header=os.getenv("TRACE_HEADER") == "1")
+metrics.describe("http_requests_total", "counter", "Số request theo endpoint và mã trạng thái")
+metrics.describe("http_request_seconds", "histogram", "Thời gian xử lý request theo endpoint")
+metrics.describe("predictions_total", "counter", "Số ảnh đã chẩn đoán theo lớp")
+metrics.describe("llm_requests_total", "counter", "Số lần gọi Gemini theo kết quả")
+metrics.gauge("ready", "1 khi mô hình và retriever đã nạp xong", lambda: int(is_ready()))
+metrics.gauge("sessions", "Số phiên đang lưu", lambda: len(sessions))
+metrics.gauge("retrieval_queue_depth", "Số việc retrieve đang chờ", lambda: retrieval_executor.queued)
+metrics.gauge("retrieval_running", "Số việc retrieve đang chạy", lambda: retrieval_executor.running)
+metrics.gauge("graph_cache_hit_rate", "Tỉ lệ trúng cache đồ thị ảnh", lambda: graph_cache.stats()["hit_rate"])
+metrics.gauge("llm_cache_hit_rate", "Tỉ lệ trúng cache câu trả lời LLM", lambda: response_cache.stats()["hit_rate"])
+
+def resolve_session_id(header, cookie):
+    """
+    Trả về (id phiên, có phải id mới cấp không). Ưu tiên header X-Session-Id rồi đến cookie;
+    client không gửi cả hai được cấp một id ngẫu nhiên, không dùng chung phiên với client khác.
+    """
+    session_id = (header or "").strip()[:128] or (cookie or "").strip()[:128]
+    if session_id:
+        return session_id, False
+    return uuid.uuid4().hex, True
+
+def issue_session_id(response, session_id):
+    """Gửi id phiên mới cấp cho client qua header X-Session-Id và cookie."""
+    response.headers["X-Session-Id"] = session_id
+    response.set_cookie(SESSION_COOKIE, session_id, max_age=int(SESSION_TTL), httponly=True, samesite="Lax")
+
+def get_session_id():
+    if "session_id" not in g:
+        g.session_id, g.new_session = resolve_session_id(
+            request.headers.get("X-Session-Id"), request.cookies.get(SESSION_COOKIE)
+        )
+    return g.session_id
+
+def async_retrieve(session_id, diagnosis_id, query):
     try:
-        retrieve_done = False
-        result = retrieve(query)
-        last_disease_data = result
-        print("Retrieve result saved.")
+        with metrics.stage("retrieval"):
+            result = load_retriever().retrieve(query)
     except Exception as e:
         print("Retrieve failed:", e)
-    finally:
-        retrieve_done = True
+        result = None
+    # Chỉ ghi nếu người dùng chưa tải ảnh mới trong lúc retrieve
+    saved = sessions.update(
+        session_id, expected={"diagnosis_id": diagnosis_id}, disease_data=result, retrieving=False
+    )
+    if saved is not None and result is not None:
+        print("Retrieve result saved.")
 
-@app.route("/", methods=["GET"])
-def hello():
-    return jsonify({"message": "Hello, World!"})
+def wait_for_retrieval(session_id, trace=None):
+    """Trạng thái phiên, sau khi chờ việc retrieve đang chạy (nếu có) xong hoặc hết thời gian."""
+    state = sessions.get(session_id)
+    if not state["retrieving"]:
+        return state
 
-@app.route("/api/predict", methods=["POST"])
-def predict_disease():
-    global last_disease_key
+    with metrics.stage("retrieval_wait", trace):
+        if retrieval_executor.pending(session_id) is not None:
+            retrieval_executor.wait(session_id, RETRIEVAL_WAIT_TIMEOUT)
+            return sessions.get(session_id)
 
-    if "image" in request.files:
-        image_file = request.files["image"]
-        image_path = f"/tmp/{image_file.filename}"
-        image_file.save(image_path)
+        # Việc retrieve chạy ở worker khác: kiểm tra lại session store định kỳ
+        started = time.perf_counter()
+        while state["retrieving"] and time.perf_counter() - started < RETRIEVAL_WAIT_TIMEOUT:
+            time.sleep(0.1)
+            state = sessions.get(session_id)
+        retrieval_executor.record_wait(time.perf_counter() - started, state["retrieving"])
+        return state
 
-        disease_class = predictor.predict(image_path)
-        print("Predicted class:", disease_class)
+def chat_unavailable_message(state):
+    """Thông báo khi chưa thể trả lời câu hỏi văn bản, hoặc None nếu đã sẵn sàng."""
+    if not state["disease_key"]:
+        return "Vui lòng cung cấp ảnh lá cây lúa. \nTôi sẽ dựa trên hình ảnh để phân tích và đưa ra dự đoán về bệnh."
+    if state["retrieving"]:
+        return "Vui lòng đợi một chút, hệ thống đang xử lý dữ liệu. Bạn có thể thử lại sau."
+    return None
 
-        disease_key = class_to_key.get(disease_class)
-        last_disease_key = disease_key
+# Tăng khi thay đổi nội dung build_prompt để không dùng lại câu trả lời cũ trong cache
+PROMPT_VERSION = 1
 
-        if disease_key and disease_key in disease_data:
-            disease_info = disease_data[disease_key]
-        else:
-            disease_info = {
-                "disease_name": "Không xác định",
-                "details": "",
-                "treatment": "",
-                "medications": []
-            }
+def get_cached_answer(state, text):
+    return response_cache.get(state["disease_key"], state["location"], text, state["disease_data"], PROMPT_VERSION)
 
-        if disease_key:
-            query = f"thông tin liên quan đến bệnh {disease_key}"
-            if location_received and last_location:
-                query += f" ở khu vực {last_location}"
-            threading.Thread(target=async_retrieve, args=(query,), daemon=True).start()
+def cache_answer(state, text, answer):
+    response_cache.put(state["disease_key"], state["location"], text, state["disease_data"], answer, PROMPT_VERSION)
 
-        return jsonify(disease_info)
+def build_prompt(state, text):
+    # Prompt cho Gemini
+    prompt = f"""
+        Dưới đây là thông tin về bệnh: {state["disease_key"]}
+        {state["disease_data"]}
 
-    elif request.json and "text" in request.json:
-        text = request.json["text"].strip()
+        Câu hỏi từ người dùng: {text}
+        """
 
-        if not last_disease_key:
-            return jsonify({
-                "message": "Vui lòng cung cấp ảnh lá cây lúa. \nTôi sẽ dựa trên hình ảnh để phân tích và đưa ra dự đoán về bệnh."
-            })
+    if state["location"]:
+        prompt += f"\n\nLưu ý: Người dùng đang ở khu vực {state['location']}. Hãy đưa ra câu trả lời phù hợp với điều kiện khí hậu và địa phương tại đây."
 
-        if not retrieve_done:
-            return jsonify({
-                "message": "Vui lòng đợi một chút, hệ thống đang xử lý dữ liệu. Bạn có thể thử lại sau."
-            })
+    prompt += "\nVui lòng trả lời như một chuyên gia nông nghiệp tại Việt Nam."
+    return prompt
 
-        # Prompt cho Gemini
-        prompt = f"""
-        Dưới đây là thông tin về bệnh: {last_disease_key}
-        {last_disease_data}
+def diagnose(session_id, image_bytes, trace=None):
+    """Dự đoán bệnh từ ảnh, lưu vào phiên và bắt đầu retrieve ngữ cảnh. Trả về thông tin bệnh."""
+    # Thời gian giải mã ảnh, từng bước dựng đồ thị và chạy mô hình, do predictor đo
+    timings = {} if metrics.enabled or trace is not None else None
+    disease_class = get_predictor().predict(image_bytes, timings=timings)
+    metrics.record_stages(timings, trace)
+    metrics.inc("predictions_total", disease=disease_class)
+    print("Predicted class:", disease_class, "| cache:", graph_cache.stats())
 
-        Câu hỏi từ người dùng: {text}
-        """
+    disease_key = class_to_key.get(disease_class)
+    # Tăng diagnosis_id trong cùng thao tác ghi, để hai ảnh tải lên cùng lúc không nhận cùng một id
+    state = sessions.increment(
+        session_id,
+        "diagnosis_id",
+        disease_key=disease_key,
+        disease_data=None,
+        retrieving=bool(disease_key)
+    )
+
+    if disease_key and disease_key in disease_data:
+        disease_info = disease_data[disease_key]
+    else:
+        disease_info = {
+            "disease_name": "Không xác định",
+            "details": "",
+            "treatment": "",
+            "medications": []
+        }
+
+    if disease_key:
+        query = f"thông tin liên quan đến bệnh {disease_key}"
+        if state["location"]:
+            query += f" ở khu vực {state['location']}"
+        future = retrieval_executor.submit(
+            session_id, state["diagnosis_id"], async_retrieve, session_id, state["diagnosis_id"], query
+        )
+        if future is None:
+            # Hàng đợi đầy: trả lời chat không kèm ngữ cảnh retrieve thay vì chờ
+            print("Retrieve queue full, skipping retrieval.")
+            sessions.update(session_id, expected={"diagnosis_id": state["diagnosis_id"]}, retrieving=False)
+
+    return disease_info
+
+def prepare_answer(state, text):
+    """
+    Trả về (câu trả lời, prompt): câu trả lời có sẵn nếu chưa thể hỏi LLM hoặc đã có trong cache,
+    ngược lại là prompt cần gửi cho LLM.
+    """
+    unavailable = chat_unavailable_message(state)
+    if unavailable:
+        return unavailable, None
+    cached = get_cached_answer(state, text)
+    if cached is not None:
+        return cached, None
+    return None, build_prompt(state, text)
+
+LLM_ERROR_MESSAGE = "Lỗi hệ thống khi gọi LLM. Vui lòng thử lại."
+
+def sse_event(data, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        if location_received and last_location:
-            prompt += f"\n\nLưu ý: Người dùng đang ở khu vực {last_location}. Hãy đưa ra câu trả lời phù hợp với điều kiện khí hậu và địa phương tại đây."
+@app.before_request
+def start_request():
+    g.started = time.perf_counter()
+    g.trace = metrics.new_trace()
 
-        prompt += "\nVui lòng trả lời như một chuyên gia nông nghiệp tại Việt Nam."
+@app.after_request
+def record_request(response):
+    elapsed = time.perf_counter() - g.started
+    # Nhãn theo route (không theo URL thật) để số chuỗi metric không tăng vô hạn
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+    metrics.observe("http_request_seconds", elapsed, endpoint=endpoint)
+    if g.trace is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(g.trace, elapsed)
+    if g.get("new_session"):
+        issue_session_id(response, g.session_id)
+    return response
+
+@app.route("/", methods=["GET"])
+def hello():
+    return jsonify({"message": "Hello, World!"})
+
+@app.route("/api/predict", methods=["POST"])
+def predict_disease():
+    session_id = get_session_id()
+
+    if "image" in request.files:
+        # Giải mã ảnh trực tiếp trong bộ nhớ, không ghi ra /tmp
+        image_bytes = request.files["image"].read()
+        return jsonify(diagnose(session_id, image_bytes, g.trace))
+
+    elif request.json and "text" in request.json:
+        text = request.json["text"].strip()
+        state = wait_for_retrieval(session_id, g.trace)
+
+        answer, prompt = prepare_answer(state, text)
+        if answer is not None:
+            return jsonify({"message": answer})
 
         try:
-            response = call_gemini(prompt)
+            with metrics.stage("gemini", g.trace):
+                response, ok = call_gemini(prompt, with_status=True)
+            metrics.inc("llm_requests_total", status="ok" if ok else "error")
+            if ok:
+                cache_answer(state, text, response)
             return jsonify({"message": response})
         except Exception as e:
+            metrics.inc("llm_requests_total", status="error")
             print("Lỗi gọi Gemini:", e)
-            return jsonify({"message": "Lỗi hệ thống khi gọi LLM. Vui lòng thử lại."})
+            return jsonify({"message": LLM_ERROR_MESSAGE})
         
     else:
         return jsonify({"error": "Vui lòng cung cấp ảnh hoặc văn bản"}), 400
 
+@app.route("/api/predict/stream", methods=["POST"])
+def predict_stream():
+    """Trả lời câu hỏi văn bản dạng Server-Sent Events, gửi từng đoạn ngay khi Gemini trả về."""
+    if not (request.json and "text" in request.json):
+        return jsonify({"error": "Vui lòng cung cấp văn bản"}), 400
+
+    text = request.json["text"].strip()
+    # Trạng thái được chốt lúc nhận câu hỏi, kể cả khi ảnh mới được gửi lên trong lúc đang trả lời
+    state = wait_for_retrieval(get_session_id(), g.trace)
+    answer, prompt = prepare_answer(state, text)
+
+    completed = []
+
+    def on_complete(answer):
+        completed.append(True)
+        cache_answer(state, text, answer)
+
+    def generate():
+        if answer is not None:
+            yield sse_event({"text": answer})
+        else:
+            # Header đã gửi trước khi stream xong nên thời gian này chỉ có trong /metrics
+            try:
+                with metrics.stage("gemini_stream"):
+                    for chunk in stream_gemini(prompt, on_complete=on_complete):
+                        yield sse_event({"text": chunk})
+                metrics.inc("llm_requests_total", status="ok" if completed else "error")
+            except Exception as e:
+                metrics.inc("llm_requests_total", status="error")
+                print("Lỗi gọi Gemini:", e)
+                yield sse_event({"text": LLM_ERROR_MESSAGE})
+        yield sse_event({}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/api/cache", methods=["GET"])
+def cache_stats():
+    return jsonify({
+        "graph": graph_cache.stats(),
+        "retrieval": get_retriever().stats(),
+        "llm_responses": response_cache.stats()
+    })
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    return jsonify({"ready": is_ready(), "components": readiness}), 200 if is_ready() else 503
+
+@app.route("/api/inference", methods=["GET"])
+def inference_stats():
+    predictor = get_predictor(load=False)
+    return jsonify(predictor.stats() if predictor else {})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/retrieval", methods=["GET"])
+def retrieval_stats():
+    return jsonify(retrieval_executor.stats())
+
 @app.route("/api/weather", methods=["GET"])
 def weather_info():
-    global last_location, location_received
-
     location = request.args.get('location', '').strip()
     if location:
-        last_location = location
-        location_received = True
+        sessions.update(get_session_id(), location=location)
         return jsonify({"message": f"Đã ghi nhận địa phương: {location}"})
     else:
         return jsonify({"message": "Không nhận được thông tin địa phương."})
 
+# Nạp mô hình ở nền để server nhận request ngay; đặt WARMUP=0 để tắt
+if os.getenv("WARMUP", "1") == "1":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
 if __name__ == "__main__":
     app.run(debug=True)
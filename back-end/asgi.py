@@ -0,0 +1,239 @@
+"""
+Chế độ chạy ASGI cho production, cùng API với app.py (/api/predict, /api/weather, ...).
+
+Gọi Gemini bằng client async nên một tiến trình giữ được nhiều kết nối chat cùng lúc;
+tiền xử lý ảnh và suy luận mô hình chạy trong thread pool (và process pool tiền xử lý
+của predictor), không chặn event loop.
+
+Chạy: uvicorn asgi:app --app-dir back-end --port 5000
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+# Dùng chung mô hình, cache, session store và logic xử lý với bản Flask
+import app as core
+from rag_llm.llm_response import acall_gemini, astream_gemini, get_async_client
+
+# Thread pool cho suy luận (torch nhả GIL khi tính toán). Các thread chủ yếu chờ
+# process pool tiền xử lý và bộ gom batch, nên cần đủ nhiều để các ảnh được gom chung batch.
+inference_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INFERENCE_THREADS", "16")), thread_name_prefix="inference"
+)
+
+
+def get_session_id(request):
+    """Giống app.get_session_id: id mới cấp được gửi lại cho client trong `instrumented`."""
+    if not hasattr(request.state, "session_id"):
+        request.state.session_id, request.state.new_session = core.resolve_session_id(
+            request.headers.get("X-Session-Id"), request.cookies.get(core.SESSION_COOKIE)
+        )
+    return request.state.session_id
+
+
+async def wait_for_retrieval(session_id, trace=None):
+    """Giống app.wait_for_retrieval nhưng chờ bằng asyncio."""
+    state = core.sessions.get(session_id)
+    if not state["retrieving"]:
+        return state
+
+    with core.metrics.stage("retrieval_wait", trace):
+        started = time.perf_counter()
+        future = core.retrieval_executor.pending(session_id)
+        if future is not None:
+            try:
+                # shield: hết thời gian chờ không được hủy việc retrieve
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), core.RETRIEVAL_WAIT_TIMEOUT)
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+            core.retrieval_executor.record_wait(time.perf_counter() - started, timed_out)
+            return core.sessions.get(session_id)
+
+        # Việc retrieve chạy ở worker khác: kiểm tra lại session store định kỳ
+        while state["retrieving"] and time.perf_counter() - started < core.RETRIEVAL_WAIT_TIMEOUT:
+            await asyncio.sleep(0.1)
+            state = core.sessions.get(session_id)
+        core.retrieval_executor.record_wait(time.perf_counter() - started, state["retrieving"])
+        return state
+
+
+async def read_text(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    if isinstance(body, dict) and isinstance(body.get("text"), str):
+        return body["text"].strip()
+    return None
+
+
+def instrumented(path, handler):
+    """Đếm và đo thời gian request, thêm header Server-Timing, giống before/after_request của bản Flask."""
+    async def endpoint(request):
+        started = time.perf_counter()
+        request.state.trace = core.metrics.new_trace()
+        response = await handler(request)
+        elapsed = time.perf_counter() - started
+        core.metrics.inc("http_requests_total", endpoint=path, status=response.status_code)
+        core.metrics.observe("http_request_seconds", elapsed, endpoint=path)
+        if request.state.trace is not None:
+            response.headers["Server-Timing"] = core.metrics.server_timing(request.state.trace, elapsed)
+        if getattr(request.state, "new_session", False):
+            core.issue_session_id(response, request.state.session_id)
+        return response
+
+    return endpoint
+
+
+async def hello(request):
+    return JSONResponse({"message": "Hello, World!"})
+
+
+async def predict_disease(request):
+    session_id = get_session_id(request)
+    trace = request.state.trace
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        image = form.get("image")
+        if image is not None and hasattr(image, "read"):
+            image_bytes = await image.read()
+            loop = asyncio.get_running_loop()
+            disease_info = await loop.run_in_executor(inference_pool, core.diagnose, session_id, image_bytes, trace)
+            return JSONResponse(disease_info)
+
+    else:
+        text = await read_text(request)
+        if text is not None:
+            state = await wait_for_retrieval(session_id, trace)
+            answer, prompt = core.prepare_answer(state, text)
+            if answer is not None:
+                return JSONResponse({"message": answer})
+
+            try:
+                with core.metrics.stage("gemini", trace):
+                    response, ok = await acall_gemini(prompt, with_status=True)
+                core.metrics.inc("llm_requests_total", status="ok" if ok else "error")
+                if ok:
+                    core.cache_answer(state, text, response)
+                return JSONResponse({"message": response})
+            except Exception as e:
+                core.metrics.inc("llm_requests_total", status="error")
+                print("Lỗi gọi Gemini:", e)
+                return JSONResponse({"message": core.LLM_ERROR_MESSAGE})
+
+    return JSONResponse({"error": "Vui lòng cung cấp ảnh hoặc văn bản"}, status_code=400)
+
+
+async def predict_stream(request):
+    text = await read_text(request)
+    if text is None:
+        return JSONResponse({"error": "Vui lòng cung cấp văn bản"}, status_code=400)
+
+    state = await wait_for_retrieval(get_session_id(request), request.state.trace)
+    answer, prompt = core.prepare_answer(state, text)
+    completed = []
+
+    def on_complete(full_answer):
+        completed.append(True)
+        core.cache_answer(state, text, full_answer)
+
+    async def generate():
+        if answer is not None:
+            yield core.sse_event({"text": answer})
+        else:
+            try:
+                with core.metrics.stage("gemini_stream"):
+                    async for chunk in astream_gemini(prompt, on_complete=on_complete):
+                        yield core.sse_event({"text": chunk})
+                core.metrics.inc("llm_requests_total", status="ok" if completed else "error")
+            except Exception as e:
+                core.metrics.inc("llm_requests_total", status="error")
+                print("Lỗi gọi Gemini:", e)
+                yield core.sse_event({"text": core.LLM_ERROR_MESSAGE})
+        yield core.sse_event({}, event="done")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def cache_stats(request):
+    return JSONResponse({
+        "graph": core.graph_cache.stats(),
+        "retrieval": core.get_retriever().stats(),
+        "llm_responses": core.response_cache.stats()
+    })
+
+
+async def ready(request):
+    return JSONResponse(
+        {"ready": core.is_ready(), "components": core.readiness}, status_code=200 if core.is_ready() else 503
+    )
+
+
+async def inference_stats(request):
+    predictor = core.get_predictor(load=False)
+    return JSONResponse(predictor.stats() if predictor else {})
+
+
+async def metrics_endpoint(request):
+    return PlainTextResponse(core.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def retrieval_stats(request):
+    return JSONResponse(core.retrieval_executor.stats())
+
+
+async def weather_info(request):
+    location = request.query_params.get("location", "").strip()
+    if location:
+        core.sessions.update(get_session_id(request), location=location)
+        return JSONResponse({"message": f"Đã ghi nhận địa phương: {location}"})
+    else:
+        return JSONResponse({"message": "Không nhận được thông tin địa phương."})
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await get_async_client().close()
+    inference_pool.shutdown(wait=False, cancel_futures=True)
+    core.retrieval_executor.shutdown(wait=False)
+    predictor = core.get_predictor(load=False)
+    if predictor is not None:
+        predictor.close()
+
+
+def route(path, handler, methods):
+    return Route(path, instrumented(path, handler), methods=methods)
+
+
+app = Starlette(
+    routes=[
+        route("/", hello, methods=["GET"]),
+        route("/ready", ready, methods=["GET"]),
+        route("/metrics", metrics_endpoint, methods=["GET"]),
+        route("/api/predict", predict_disease, methods=["POST"]),
+        route("/api/predict/stream", predict_stream, methods=["POST"]),
+        route("/api/cache", cache_stats, methods=["GET"]),
+        route("/api/inference", inference_stats, methods=["GET"]),
+        route("/api/retrieval", retrieval_stats, methods=["GET"]),
+        route("/api/weather", weather_info, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("HOST", "127.0.0.1"), port=int(os.getenv("PORT", "5000")))
@@ -0,0 +1,125 @@
+"""
+Load test cho API chat với Gemini giả lập.
+
+1. Chạy Gemini giả lập (trả lời sau --latency giây):
+       python back-end/load_test.py stub --port 8090 --latency 1.0
+2. Chạy backend trỏ tới server giả lập, ví dụ bản ASGI:
+       GEMINI_API_KEY=test GEMINI_API_URL=http://127.0.0.1:8090/v1/models/stub:generateContent \\
+       uvicorn asgi:app --app-dir back-end --port 5000
+3. Chạy load test:
+       python back-end/load_test.py run --url http://127.0.0.1:5000 --image leaf.jpg --concurrency 200 --requests 1000
+
+Mỗi người dùng ảo có một phiên riêng: tải ảnh lên một lần rồi gửi câu hỏi (mỗi câu khác nhau để không trúng cache).
+Máy tạo tải nên chạy trên máy/CPU khác với backend và server giả lập để không tranh CPU.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+
+def stub_app(latency: float, chunks: int = 5):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, StreamingResponse
+    from starlette.routing import Route
+
+    def candidate(text):
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    async def generate(request):
+        path = request.path_params["method"]
+        await request.body()
+        if path.endswith(":streamGenerateContent"):
+            async def events():
+                for i in range(chunks):
+                    await asyncio.sleep(latency / chunks)
+                    yield f"data: {json.dumps(candidate(f'đoạn {i} '))}\r\n\r\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(latency)
+        return JSONResponse(candidate("Câu trả lời giả lập."))
+
+    return Starlette(routes=[Route("/v1/models/{method}", generate, methods=["POST"])])
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else None
+
+
+async def run_load(url: str, image_path: str, concurrency: int, total: int, stream: bool, timeout: float):
+    import httpx
+
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    latencies, errors = [], 0
+    # Câu hỏi không lặp lại giữa các lần chạy để không trúng cache câu trả lời
+    run_id = uuid.uuid4().hex[:8]
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+
+        async def user(index):
+            nonlocal errors
+            headers = {"X-Session-Id": f"load-{index}-{uuid.uuid4().hex[:8]}"}
+            response = await client.post(
+                "/api/predict", files={"image": ("leaf.jpg", image_bytes, "image/jpeg")}, headers=headers
+            )
+            response.raise_for_status()
+
+            for n in counter:
+                started = time.perf_counter()
+                try:
+                    question = {"text": f"Cách phòng bệnh này? ({run_id}-{n})"}
+                    if stream:
+                        async with client.stream("POST", "/api/predict/stream", json=question, headers=headers) as r:
+                            r.raise_for_status()
+                            async for _ in r.aiter_lines():
+                                pass
+                    else:
+                        r = await client.post("/api/predict", json=question, headers=headers)
+                        r.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError as e:
+                    errors += 1
+                    print(f"Lỗi request #{n}: {type(e).__name__}")
+
+        print(f"🚀 {concurrency} người dùng đồng thời, {total} câu hỏi ({'stream' if stream else 'json'})...")
+        started = time.perf_counter()
+        await asyncio.gather(*(user(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    print(f"✅ Hoàn thành {len(latencies)} request trong {elapsed:.2f}s, {errors} lỗi")
+    print(f"   Throughput: {len(latencies) / elapsed:.1f} req/s")
+    for p in (0.50, 0.95, 0.99):
+        value = percentile(latencies, p)
+        print(f"   p{int(p * 100)}: {value * 1000:.0f} ms" if value is not None else f"   p{int(p * 100)}: -")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test API chat với Gemini giả lập")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stub = subparsers.add_parser("stub", help="Chạy server Gemini giả lập")
+    stub.add_argument("--host", type=str, default="127.0.0.1")
+    stub.add_argument("--port", type=int, default=8090)
+    stub.add_argument("--latency", type=float, default=1.0, help="Thời gian trả lời (giây)")
+
+    run = subparsers.add_parser("run", help="Gửi tải tới backend")
+    run.add_argument("--url", type=str, default="http://127.0.0.1:5000")
+    run.add_argument("--image", type=str, required=True, help="Ảnh lá dùng để tạo chẩn đoán cho mỗi phiên")
+    run.add_argument("--concurrency", type=int, default=100)
+    run.add_argument("--requests", type=int, default=500)
+    run.add_argument("--stream", action="store_true", help="Dùng /api/predict/stream")
+    run.add_argument("--timeout", type=float, default=120.0)
+
+    args = parser.parse_args()
+    if args.command == "stub":
+        import uvicorn
+
+        uvicorn.run(stub_app(args.latency), host=args.host, port=args.port, log_level="warning")
+    else:
+        asyncio.run(run_load(args.url, args.image, args.concurrency, args.requests, args.stream, args.timeout))
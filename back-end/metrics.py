@@ -0,0 +1,159 @@
+import bisect
+import threading
+import time
+from contextlib import nullcontext
+
+# Mốc histogram (giây), giống mặc định của client Prometheus nhưng thêm mốc nhỏ cho các bước tiền xử lý
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DISABLED = nullcontext()
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in items) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "trace", "started")
+
+    def __init__(self, metrics, name, trace):
+        self.metrics = metrics
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record_stages({self.name: time.perf_counter() - self.started}, self.trace)
+        return False
+
+
+class Metrics:
+    """
+    Bộ đếm và histogram trong bộ nhớ, xuất ra dạng text của Prometheus qua `render`.
+
+    Thời gian từng bước (giải mã ảnh, dựng đồ thị, chạy mô hình, retrieve, gọi Gemini) được ghi
+    vào histogram `stage_seconds` theo nhãn `stage`, và vào dict `trace` của request nếu có
+    (trả về cho client qua header Server-Timing). Khi enabled=False mọi hàm ghi đều trả về ngay.
+    """
+
+    def __init__(self, enabled: bool = True, trace_header: bool = False, prefix: str = "plant_",
+                 buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.trace_header = trace_header
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}        # tên -> (loại, mô tả)
+        self._counters = {}    # (tên, nhãn) -> giá trị
+        self._histograms = {}  # (tên, nhãn) -> [số mẫu mỗi mốc..., +Inf, tổng]
+        self._gauges = {}      # tên -> hàm trả về giá trị lúc render
+
+        self.describe("stage_seconds", "histogram", "Thời gian từng bước xử lý request")
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name: str, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self._histograms.get(key)
+            if values is None:
+                values = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += seconds
+
+    def gauge(self, name: str, help_text: str, read):
+        """Giá trị đọc lúc render, ví dụ độ sâu hàng đợi hoặc số phiên."""
+        self.describe(name, "gauge", help_text)
+        self._gauges[name] = read
+
+    def new_trace(self):
+        """Dict ghi thời gian các bước của một request, hoặc None nếu không bật header trace."""
+        return {} if self.trace_header else None
+
+    def stage(self, name: str, trace=None):
+        """Context manager đo thời gian một bước."""
+        if not self.enabled and trace is None:
+            return _DISABLED
+        return _StageTimer(self, name, trace)
+
+    def record_stages(self, timings, trace=None):
+        """Ghi các bước đã đo sẵn (dict tên bước -> giây), ví dụ từ tiền xử lý ảnh."""
+        if not timings:
+            return
+        for stage, seconds in timings.items():
+            self.observe("stage_seconds", seconds, stage=stage)
+            if trace is not None:
+                trace[stage] = trace.get(stage, 0.0) + seconds
+
+    @staticmethod
+    def server_timing(trace, total=None):
+        """Giá trị header Server-Timing (ms), hiển thị được trong DevTools của trình duyệt."""
+        parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in trace.items()]
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def render(self) -> str:
+        if not self.enabled:
+            return "# metrics disabled\n"
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+
+        lines = []
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for (name, labels), values in histograms.items():
+            by_name.setdefault(name, []).append((labels, values))
+
+        for name in sorted(by_name):
+            kind, help_text = self._help.get(name, ("counter", ""))
+            full_name = self.prefix + name
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+                if kind != "histogram":
+                    lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, ('le', le))} {cumulative}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {cumulative}")
+
+        for name in sorted(self._gauges):
+            try:
+                value = self._gauges[name]()
+            except Exception:
+                continue
+            full_name = self.prefix + name
+            lines.append(f"# HELP {full_name} {self._help[name][1]}")
+            lines.append(f"# TYPE {full_name} gauge")
+            lines.append(f"{full_name} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+def _percentiles(samples):
+    values = sorted(samples)
+    if not values:
+        return {"p50": None, "p95": None, "max": None}
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {"p50": pick(0.50), "p95": pick(0.95), "max": values[-1]}
+
+
+class RetrievalExecutor:
+    """
+    Thread pool dùng chung cho việc retrieve, giới hạn số worker và số việc đang chờ.
+
+    Mỗi phiên có tối đa một future đang chờ (lần chẩn đoán mới thay thế lần cũ);
+    request chat có thể chờ future đó với timeout thay vì bắt người dùng thử lại.
+    Thống kê độ sâu hàng đợi, thời gian chờ trong hàng đợi, thời gian chạy và thời gian chat phải chờ.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 64, window: int = 1000):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieve")
+        # Tổng số việc đang chạy + đang chờ không vượt quá max_workers + max_queue
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = {}  # session_id -> (diagnosis_id, future)
+
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_timeouts = 0
+        self._queue_wait = deque(maxlen=window)
+        self._run_time = deque(maxlen=window)
+        self._chat_wait = deque(maxlen=window)
+
+    def submit(self, session_id: str, diagnosis_id, fn, *args):
+        """Đưa việc retrieve của một phiên vào hàng đợi. Trả về future, hoặc None nếu hàng đợi đầy."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return None
+
+        enqueued = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self._queue_wait.append(started - enqueued)
+            failed = True
+            try:
+                result = fn(*args)
+                failed = False
+                return result
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.failed += int(failed)
+                    self._run_time.append(time.perf_counter() - started)
+                self._slots.release()
+
+        with self._lock:
+            self.queued += 1
+            self.submitted += 1
+        future = self._executor.submit(run)
+        with self._lock:
+            self._pending[session_id] = (diagnosis_id, future)
+        future.add_done_callback(lambda f: self._forget(session_id, f))
+        return future
+
+    def _forget(self, session_id, future):
+        with self._lock:
+            entry = self._pending.get(session_id)
+            if entry is not None and entry[1] is future:
+                del self._pending[session_id]
+
+    def pending(self, session_id: str):
+        """Future đang chờ của phiên trong tiến trình này, hoặc None."""
+        with self._lock:
+            entry = self._pending.get(session_id)
+        return entry[1] if entry is not None else None
+
+    def wait(self, session_id: str, timeout: float) -> bool:
+        """
+        Chờ việc retrieve của phiên hoàn tất tối đa `timeout` giây.
+        Trả về False nếu hết thời gian, True nếu đã xong hoặc không có việc nào trong tiến trình này.
+        """
+        future = self.pending(session_id)
+        if future is None:
+            return True
+        started = time.perf_counter()
+        try:
+            future.exception(timeout=timeout)
+            done = True
+        except FutureTimeoutError:
+            done = False
+        with self._lock:
+            self._chat_wait.append(time.perf_counter() - started)
+            self.wait_timeouts += int(not done)
+        return done
+
+    def record_wait(self, seconds: float, timed_out: bool):
+        """Ghi nhận thời gian chat chờ một việc retrieve không thuộc tiến trình này."""
+        with self._lock:
+            self._chat_wait.append(seconds)
+            self.wait_timeouts += int(timed_out)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_timeouts": self.wait_timeouts,
+                "queue_wait": _percentiles(self._queue_wait),
+                "run_time": _percentiles(self._run_time),
+                "chat_wait": _percentiles(self._chat_wait),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
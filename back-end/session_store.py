@@ -0,0 +1,197 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Trạng thái hội thoại của một người dùng
+DEFAULT_STATE = {
+    "disease_key": None,     # Bệnh dự đoán từ ảnh gần nhất
+    "disease_data": None,    # Kết quả retrieve cho bệnh đó
+    "location": None,        # Khu vực người dùng cung cấp
+    "diagnosis_id": 0,       # Tăng mỗi lần tải ảnh, để bỏ kết quả retrieve đã cũ
+    "retrieving": False,     # Đang retrieve cho lần chẩn đoán hiện tại
+}
+
+
+def _new_state():
+    return dict(DEFAULT_STATE)
+
+
+def _matches(state, expected):
+    return expected is None or all(state.get(k) == v for k, v in expected.items())
+
+
+def _set_fields(expected, fields):
+    # Thay đổi của update: ghi `fields` nếu trạng thái khớp `expected`
+    def change(state):
+        if not _matches(state, expected):
+            return False
+        state.update(fields)
+        return True
+    return change
+
+
+def _increment_field(field, amount, fields):
+    # Thay đổi của increment: tăng `field` và ghi `fields`
+    def change(state):
+        state.update(fields)
+        state[field] = state[field] + amount
+        return True
+    return change
+
+
+class MemorySessionStore:
+    """
+    Lưu trạng thái phiên trong bộ nhớ tiến trình, giới hạn số phiên (LRU) và thời gian sống.
+    Chỉ phù hợp khi chạy một worker.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, session_id):
+        item = self._sessions.get(session_id)
+        if item is None:
+            return None
+        state, updated = item
+        if self.ttl is not None and time.monotonic() - updated > self.ttl:
+            del self._sessions[session_id]
+            return None
+        return state
+
+    def get(self, session_id: str) -> dict:
+        with self._lock:
+            state = self._load(session_id)
+            return dict(state) if state is not None else _new_state()
+
+    def update(self, session_id: str, expected: dict = None, **fields):
+        """
+        Cập nhật các trường của phiên và trả về trạng thái mới.
+        Nếu `expected` được truyền mà trạng thái hiện tại không khớp thì không ghi và trả về None.
+        """
+        return self._modify(session_id, _set_fields(expected, fields))
+
+    def increment(self, session_id: str, field: str, amount: int = 1, **fields):
+        """Tăng `field` thêm `amount` và ghi `fields` trong cùng một thao tác, trả về trạng thái mới."""
+        return self._modify(session_id, _increment_field(field, amount, fields))
+
+    def _modify(self, session_id, change):
+        with self._lock:
+            state = self._load(session_id)
+            state = dict(state) if state is not None else _new_state()
+            if not change(state):
+                return None
+            self._sessions[session_id] = (state, time.monotonic())
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return dict(state)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Lưu trạng thái phiên trong một file SQLite dùng chung, để nhiều worker
+    (ví dụ gunicorn) trên cùng máy thấy cùng một phiên.
+    Mỗi lần cập nhật là một transaction ghi nên đọc-sửa-ghi giữa các tiến trình không bị chồng nhau.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, ttl: float = 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: tự quản lý transaction bằng BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, conn, session_id):
+        row = conn.execute("SELECT state, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        state, updated = row
+        if self.ttl is not None and time.time() - updated > self.ttl:
+            return None
+        return dict(_new_state(), **json.loads(state))
+
+    def get(self, session_id: str) -> dict:
+        state = self._load(self._connection(), session_id)
+        return state if state is not None else _new_state()
+
+    def update(self, session_id: str, expected: dict = None, **fields):
+        """Giống MemorySessionStore.update."""
+        return self._modify(session_id, _set_fields(expected, fields))
+
+    def increment(self, session_id: str, field: str, amount: int = 1, **fields):
+        """Giống MemorySessionStore.increment."""
+        return self._modify(session_id, _increment_field(field, amount, fields))
+
+    def _modify(self, session_id, change):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._load(conn, session_id) or _new_state()
+            if not change(state):
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state, ensure_ascii=False), time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._writes += 1
+        if self.ttl is not None and self._writes % self.PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+        return state
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_store(url: str = None, ttl: float = 24 * 3600):
+    """
+    Tạo session store từ cấu hình, ví dụ SESSION_STORE="sqlite:///tmp/sessions.db".
+    Mặc định lưu trong bộ nhớ.
+    """
+    url = url if url is not None else os.getenv("SESSION_STORE", "memory")
+    if url.startswith("sqlite://"):
+        return SQLiteSessionStore(url[len("sqlite://"):], ttl=ttl)
+    if url == "memory":
+        return MemorySessionStore(ttl=ttl)
+    raise ValueError(f"SESSION_STORE không hợp lệ: {url}")
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react';
 import { Message } from '@/types';
-import { predictDisease, getWeatherData } from '@/services/api';
+import { predictDisease, streamChat, getWeatherData } from '@/services/api';
 import * as SessionStorage from '@/utils/sessionStorage';
 import { useToast } from '@/hooks/use-toast';
 
@@ -68,10 +68,35 @@ export const useChat = (): UseChatResult => {
     setIsLoading(true);
 
     try {
+      if (!image) {
+        // Text question - stream the answer into a message as it arrives
+        const streamingMessage: Message = {
+          id: SessionStorage.generateId(),
+          role: 'system',
+          content: '',
+          timestamp: Date.now()
+        };
+        setMessages(prev => [...prev, streamingMessage]);
+
+        const fullText = await streamChat(text.trim(), chunk => {
+          setIsLoading(false);
+          setMessages(prev => prev.map(message =>
+            message.id === streamingMessage.id
+              ? { ...message, content: message.content + chunk }
+              : message
+          ));
+        }, sessionId);
+
+        // Save the complete answer to session storage
+        SessionStorage.addMessage(sessionId, { ...streamingMessage, content: fullText });
+        return;
+      }
+
       // Call API
       const response = await predictDisease({
         text: text.trim() || undefined,
-        image: image || undefined
+        image: image || undefined,
+        sessionId
       });
 
       // Check if response has disease_name (image response) or message (text response)
@@ -144,7 +169,7 @@ export const useChat = (): UseChatResult => {
 
     try {
       // Call the backend API - it returns { message: location }
-      const weatherData = await getWeatherData(values.location);
+      const weatherData = await getWeatherData(values.location, sessionId);
       
       // Create system message with the response
       const weatherMessage: Message = {
@@ -1,15 +1,21 @@
 import { DiseaseOrTextResponse } from '@/types';
 
 const API_URL = '/api/predict';
+const STREAM_API_URL = '/api/predict/stream';
 const WEATHER_API_URL = '/api/weather';
 
 interface PredictDiseaseParams {
   text?: string;
   image?: File;
+  sessionId?: string;
 }
 
+// Server lưu chẩn đoán, kết quả tra cứu và vị trí theo từng phiên trò chuyện
+const sessionHeaders = (sessionId?: string): Record<string, string> =>
+  sessionId ? { 'X-Session-Id': sessionId } : {};
+
 // Hàm gọi API để dự đoán bệnh
-export const predictDisease = async ({ text, image }: PredictDiseaseParams): Promise<DiseaseOrTextResponse> => {
+export const predictDisease = async ({ text, image, sessionId }: PredictDiseaseParams): Promise<DiseaseOrTextResponse> => {
   try {
     const formData = new FormData();
 
@@ -20,8 +26,9 @@ export const predictDisease = async ({ text, image }: PredictDiseaseParams): Pro
     const response = await fetch(API_URL, {
       method: 'POST',
       body: image ? formData : JSON.stringify({ text }),
-      headers: image ? undefined : {
+      headers: image ? sessionHeaders(sessionId) : {
         'Content-Type': 'application/json',
+        ...sessionHeaders(sessionId),
       },
     });
 
@@ -36,12 +43,60 @@ export const predictDisease = async ({ text, image }: PredictDiseaseParams): Pro
   }
 };
 
-export const getWeatherData = async (location: string) => {
+// Hàm gọi API trả lời câu hỏi dạng stream (Server-Sent Events), gọi onChunk với từng đoạn văn bản
+export const streamChat = async (
+  text: string,
+  onChunk: (chunk: string) => void,
+  sessionId?: string
+): Promise<string> => {
+  const response = await fetch(STREAM_API_URL, {
+    method: 'POST',
+    body: JSON.stringify({ text }),
+    headers: {
+      'Content-Type': 'application/json',
+      ...sessionHeaders(sessionId),
+    },
+  });
+
+  if (!response.ok || !response.body) {
+    throw new Error('Lỗi khi gọi API');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let fullText = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop() ?? '';
+
+    for (const event of events) {
+      const dataLine = event.split('\n').find(line => line.startsWith('data:'));
+      if (!dataLine || event.startsWith('event: done')) continue;
+
+      const data = JSON.parse(dataLine.slice('data:'.length));
+      if (data.text) {
+        fullText += data.text;
+        onChunk(data.text);
+      }
+    }
+  }
+
+  return fullText;
+};
+
+export const getWeatherData = async (location: string, sessionId?: string) => {
   try {
     const response = await fetch(`${WEATHER_API_URL}?location=${encodeURIComponent(location)}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
+        ...sessionHeaders(sessionId),
       },
     });
     
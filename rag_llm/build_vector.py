@@ -1,4 +1,5 @@
-from embedding import create_vector_store
+from ingest import ingest_directory
 
 if __name__ == "__main__":
-    create_vector_store("rag_llm/docs/plant_diseases.md")
+    # Chỉ embed lại các tài liệu mới hoặc đã thay đổi trong rag_llm/docs
+    ingest_directory("rag_llm/docs")
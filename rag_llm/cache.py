@@ -0,0 +1,241 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+
+class LRUCache:
+    """
+    Cache LRU có giới hạn số phần tử, TTL tùy chọn và bộ đếm hit/miss.
+    An toàn khi dùng từ nhiều thread.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """Các phần tử còn hạn, từ cũ nhất đến mới nhất."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (key, value) for key, (value, expires_at) in self._data.items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._data),
+            }
+
+
+class CachedQueryEmbedding(Embeddings):
+    """
+    Bọc một mô hình embedding, lưu vector của các câu truy vấn trong cache LRU.
+    Nếu có `persist_path`, cache được ghi ra file JSON sau mỗi `save_every` lần miss
+    và khi tiến trình kết thúc, rồi nạp lại khi khởi động.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_entries: int = 1024, persist_path: str = None,
+                 save_every: int = 32):
+        self.embeddings = embeddings
+        self.persist_path = persist_path
+        self.save_every = save_every
+        self.cache = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if persist_path and os.path.exists(persist_path):
+            try:
+                with open(persist_path, "r", encoding="utf-8") as f:
+                    for text, vector in json.load(f):
+                        self.cache.put(text, vector)
+            except (OSError, ValueError) as e:
+                print(f"Không đọc được cache embedding {persist_path}: {e}")
+        if persist_path:
+            atexit.register(self.flush)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text):
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            with self._lock:
+                self.cache.put(text, vector)
+                self._unsaved += 1
+                if self._unsaved >= self.save_every:
+                    self._save()
+        return list(vector)
+
+    def flush(self):
+        """Ghi các vector chưa lưu ra file (gọi khi tắt tiến trình)."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # Gọi khi đang giữ self._lock. Lỗi ghi file không làm hỏng truy vấn đang chạy.
+        if not self.persist_path:
+            return
+        tmp_path = f"{self.persist_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.cache.items(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.persist_path)
+            self._unsaved = 0
+        except OSError as e:
+            print(f"Không ghi được cache embedding {self.persist_path}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class ResponseCache:
+    """
+    Cache câu trả lời của LLM theo (bệnh, khu vực, câu hỏi đã chuẩn hóa,
+    hash ngữ cảnh retrieve, phiên bản prompt), có TTL và LRU.
+
+    Nếu truyền `embeddings` (hoặc `embeddings_factory`, gọi ở lần tra cứu đầu tiên để không
+    nạp mô hình lúc khởi động), khi không khớp chính xác sẽ tìm câu hỏi tương tự
+    (cosine >= `similarity_threshold`) trong cùng bệnh/khu vực/ngữ cảnh/phiên bản prompt.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 24 * 3600, embeddings: Embeddings = None,
+                 similarity_threshold: float = 0.92, embeddings_factory=None):
+        self.cache = LRUCache(max_entries, ttl)
+        self.embeddings = embeddings
+        self.embeddings_factory = embeddings_factory
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def semantic(self) -> bool:
+        return self.embeddings is not None or self.embeddings_factory is not None
+
+    def _get_embeddings(self):
+        if self.embeddings is None:
+            with self._lock:
+                if self.embeddings is None:
+                    self.embeddings = self.embeddings_factory()
+        return self.embeddings
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        # Giữ dấu tiếng Việt, bỏ dấu câu, khoảng trắng thừa và phân biệt hoa/thường
+        question = unicodedata.normalize("NFC", question).lower()
+        question = re.sub(r"[^\w\s]", " ", question)
+        return " ".join(question.split())
+
+    @staticmethod
+    def context_hash(context) -> str:
+        return hashlib.sha256(str(context).encode("utf-8")).hexdigest()
+
+    def _scope(self, disease_key, location, context, prompt_version):
+        return (disease_key, location or "", self.context_hash(context), prompt_version)
+
+    def _vector(self, question):
+        vector = np.asarray(self._get_embeddings().embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, disease_key, location, question, context, prompt_version=1):
+        scope = self._scope(disease_key, location, context, prompt_version)
+        normalized = self.normalize(question)
+        entry = self.cache.get(scope + (normalized,))
+        if entry is not None:
+            self._count("exact_hits")
+            return entry[0]
+
+        if not self.semantic:
+            self._count("misses")
+            return None
+
+        # Tìm câu hỏi gần nghĩa trong cùng phạm vi
+        vector = self._vector(normalized)
+        best_answer, best_score = None, self.similarity_threshold
+        for key, (answer, other) in self.cache.items():
+            if key[:4] != scope or other is None:
+                continue
+            score = float(np.dot(vector, other))
+            if score >= best_score:
+                best_answer, best_score = answer, score
+        self._count("semantic_hits" if best_answer is not None else "misses")
+        return best_answer
+
+    def put(self, disease_key, location, question, context, answer, prompt_version=1):
+        scope = self._scope(disease_key, location, context, prompt_version)
+        normalized = self.normalize(question)
+        vector = self._vector(normalized) if self.semantic else None
+        self.cache.put(scope + (normalized,), (answer, vector))
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self.cache),
+            }
@@ -1,12 +1,17 @@
+import hashlib
 import json
+import os
 import re
-from sentence_transformers import SentenceTransformer
 from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import TextLoader
 from langchain_core.embeddings import Embeddings
 
 class SentenceTransformerEmbedding(Embeddings):
     def __init__(self, model_name='paraphrase-multilingual-mpnet-base-v2'):
+        # Import khi cần: sentence_transformers mất vài giây để import
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
         self.model = SentenceTransformer(model_name)
 
     def embed_documents(self, texts):
@@ -15,31 +20,35 @@ class SentenceTransformerEmbedding(Embeddings):
     def embed_query(self, text):
         return self.model.encode([text], convert_to_numpy=True)[0].tolist()
 
-def split_by_disease(doc_content):
-    lines = doc_content.splitlines()
-    chunks = []
+def iter_disease_chunks(lines, source: str = "plant_diseases.md"):
+    """
+    Chia tài liệu thành các chunk theo tiêu đề bệnh (`# ten_benh`), trả về dần từng chunk.
+    `lines` có thể là một file đang mở nên không cần đọc toàn bộ tài liệu vào bộ nhớ.
+    """
     current_chunk = []
     current_disease = None
 
     for line in lines:
+        line = line.rstrip("\r\n")
         match = re.match(r'^# (\w+)', line)
         if match:
             if current_chunk:
-                chunks.append({
+                yield {
                     "content": "\n".join(current_chunk).strip(),
-                    "metadata": {"disease": current_disease, "source": "plant_diseases.md"}
-                })
+                    "metadata": {"disease": current_disease, "source": source}
+                }
                 current_chunk = []
             current_disease = match.group(1)
         current_chunk.append(line)
     
     if current_chunk:
-        chunks.append({
+        yield {
             "content": "\n".join(current_chunk).strip(),
-            "metadata": {"disease": current_disease, "source": "plant_diseases.md"}
-        })
-    
-    return chunks
+            "metadata": {"disease": current_disease, "source": source}
+        }
+
+def split_by_disease(doc_content):
+    return list(iter_disease_chunks(doc_content.splitlines()))
 
 def remove_duplicates(chunks):
     seen = set()
@@ -51,13 +60,60 @@ def remove_duplicates(chunks):
             unique_chunks.append(chunk)
     return unique_chunks
 
-def create_vector_store(doc_path: str, persist_path: str = "faiss_index"):
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embed_chunks(texts, embeddings: Embeddings, batch_size: int = 32, cache_path: str = None):
+    """
+    Tính embedding cho các chunk, mỗi nội dung chỉ embed một lần, theo từng batch.
+
+    Args:
+        texts (list[str]): Nội dung các chunk.
+        embeddings (Embeddings): Mô hình embedding.
+        batch_size (int, optional): Số chunk mỗi lần gọi mô hình. Defaults to 32.
+        cache_path (str, optional): File JSON lưu vector theo hash nội dung từ lần build trước;
+            chunk không đổi sẽ không bị embed lại.
+
+    Returns:
+        list[list[float]]: Vector tương ứng với từng phần tử của `texts`.
+    """
+    model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("model") == model_name:
+            cached = data.get("vectors", {})
+
+    hashes = [content_hash(text) for text in texts]
+    pending = {}
+    for h, text in zip(hashes, texts):
+        if h not in cached and h not in pending:
+            pending[h] = text
+    print(f"Embedding {len(pending)}/{len(set(hashes))} chunk (phần còn lại dùng lại từ cache).")
+
+    pending_items = list(pending.items())
+    for start in range(0, len(pending_items), batch_size):
+        batch = pending_items[start:start + batch_size]
+        vectors = embeddings.embed_documents([text for _, text in batch])
+        for (h, _), vector in zip(batch, vectors):
+            cached[h] = list(vector)
+
+    if cache_path:
+        # Chỉ giữ vector của các chunk hiện tại
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"model": model_name, "vectors": {h: cached[h] for h in set(hashes)}}, f)
+
+    return [cached[h] for h in hashes]
+
+def create_vector_store(doc_path: str, persist_path: str = "faiss_index", batch_size: int = 32):
     """
     Tạo vector store từ tài liệu Markdown và lưu vào đĩa.
 
     Args:
         doc_path (str): Đường dẫn đến tài liệu Markdown.
         persist_path (str, optional): Đường dẫn đến vị trí lưu vector store. Defaults to "faiss_index".
+        batch_size (int, optional): Số chunk embed mỗi batch. Defaults to 32.
     """
     loader = TextLoader(doc_path, encoding="utf-8")
     docs = loader.load()
@@ -69,11 +125,17 @@ def create_vector_store(doc_path: str, persist_path: str = "faiss_index"):
     docs_text = [chunk["content"] for chunk in unique_chunks]
     metadatas = [chunk["metadata"] for chunk in unique_chunks]
     embeddings = SentenceTransformerEmbedding()
-    vectorstore = FAISS.from_texts(docs_text, embeddings, metadatas=metadatas)
+
+    # Embed một lần, dùng chung cho FAISS index và vectors.json
+    os.makedirs(persist_path, exist_ok=True)
+    vectors = embed_chunks(
+        docs_text, embeddings, batch_size=batch_size,
+        cache_path=os.path.join(persist_path, "chunk_embeddings.json")
+    )
+    vectorstore = FAISS.from_embeddings(list(zip(docs_text, vectors)), embeddings, metadatas=metadatas)
     vectorstore.save_local(persist_path)
     print(f"✅ Vector store đã được lưu vào: {persist_path}")
 
-    vectors = embeddings.embed_documents(docs_text)
     vector_dict = [
         {"disease": metadata["disease"], "vector": vector[:5]}
         for metadata, vector in zip(metadatas, vectors)
@@ -82,8 +144,16 @@ def create_vector_store(doc_path: str, persist_path: str = "faiss_index"):
         json.dump(vector_dict, f, ensure_ascii=False, indent=2)
     print("✅ Vector cho tất cả các bệnh đã được lưu vào: vectors.json")
 
-def load_vector_store(persist_path: str = "faiss_index"):
-    embeddings = SentenceTransformerEmbedding()
+def load_vector_store(persist_path: str = "faiss_index", embeddings: Embeddings = None):
+    """
+    Nạp vector store từ đĩa.
+
+    Args:
+        persist_path (str, optional): Thư mục chứa FAISS index. Defaults to "faiss_index".
+        embeddings (Embeddings, optional): Mô hình embedding dùng lại; nếu không truyền sẽ tạo mới.
+    """
+    if embeddings is None:
+        embeddings = SentenceTransformerEmbedding()
     return FAISS.load_local(persist_path, embeddings, allow_dangerous_deserialization=True)
 
 if __name__ == "__main__":
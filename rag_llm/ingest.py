@@ -0,0 +1,187 @@
+import argparse
+import hashlib
+import json
+import os
+
+from langchain_community.vectorstores import FAISS
+
+try:
+    from .embedding import SentenceTransformerEmbedding, content_hash, iter_disease_chunks
+except ImportError:
+    # Chạy trực tiếp dạng script (python rag_llm/build_vector.py)
+    from embedding import SentenceTransformerEmbedding, content_hash, iter_disease_chunks
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def iter_document_paths(docs_dir: str, extensions=(".md", ".txt")):
+    """Duyệt thư mục tài liệu, trả về đường dẫn các file theo thứ tự ổn định."""
+    for root, dirs, files in os.walk(docs_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(extensions):
+                yield os.path.join(root, name)
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(persist_path: str):
+    path = os.path.join(persist_path, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(persist_path: str, manifest):
+    path = os.path.join(persist_path, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def ingest_directory(docs_dir: str, persist_path: str = "faiss_index", batch_size: int = 32, embeddings=None):
+    """
+    Cập nhật FAISS index từ một thư mục tài liệu, chỉ xử lý các file đã thay đổi.
+
+    Mỗi file được chia chunk dần (generator) và embed theo batch. Manifest trong
+    `persist_path` lưu hash của từng file cùng hash nội dung các chunk của nó, và với
+    mỗi hash nội dung (cũng là id vector trong index) số file đang chứa chunk đó.
+    Chunk trùng nhau giữa các file chỉ được embed và lưu một lần; vector chỉ bị gỡ
+    khỏi index khi không còn file nào chứa chunk đó.
+
+    Args:
+        docs_dir (str): Thư mục chứa tài liệu (.md, .txt).
+        persist_path (str, optional): Thư mục FAISS index. Defaults to "faiss_index".
+        batch_size (int, optional): Số chunk embed mỗi batch. Defaults to 32.
+        embeddings (Embeddings, optional): Mô hình embedding; mặc định SentenceTransformerEmbedding.
+
+    Returns:
+        dict: Số file được thêm, cập nhật, xóa, giữ nguyên, số chunk đã embed và đã gỡ.
+    """
+    if embeddings is None:
+        embeddings = SentenceTransformerEmbedding()
+    model_name = getattr(embeddings, "model_name", type(embeddings).__name__)
+
+    manifest = load_manifest(persist_path)
+    index_exists = os.path.exists(os.path.join(persist_path, "index.faiss"))
+    if (manifest is None or manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("model") != model_name or not index_exists):
+        # Không có manifest hợp lệ: không biết vector nào thuộc file nào nên build lại từ đầu
+        manifest = {"version": MANIFEST_VERSION, "model": model_name, "files": {}, "chunks": {}}
+        vectorstore = None
+    else:
+        vectorstore = FAISS.load_local(persist_path, embeddings, allow_dangerous_deserialization=True)
+        indexed_ids = set(vectorstore.index_to_docstore_id.values())
+        if any(chunk_hash not in indexed_ids for chunk_hash in manifest["chunks"]):
+            # Index đã được build lại bằng cách khác, manifest không còn khớp
+            manifest = {"version": MANIFEST_VERSION, "model": model_name, "files": {}, "chunks": {}}
+            vectorstore = None
+
+    known = manifest["files"]
+    refs = manifest["chunks"]  # hash nội dung -> số file chứa chunk đó
+    current = {}
+    for path in iter_document_paths(docs_dir):
+        current[os.path.relpath(path, docs_dir).replace(os.sep, "/")] = path
+
+    stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "chunks_embedded": 0, "chunks_removed": 0}
+
+    def release(entry):
+        for chunk_hash in entry["chunks"]:
+            refs[chunk_hash] -= 1
+
+    # Bỏ tham chiếu của file đã bị xóa
+    for source in list(known):
+        if source not in current:
+            release(known.pop(source))
+            stats["removed"] += 1
+
+    changed = []
+    for source, path in current.items():
+        digest = file_hash(path)
+        entry = known.get(source)
+        if entry is not None and entry["hash"] == digest:
+            stats["unchanged"] += 1
+            continue
+        if entry is not None:
+            release(entry)
+            stats["updated"] += 1
+        else:
+            stats["added"] += 1
+        changed.append((source, path, digest))
+
+    def flush(batch):
+        nonlocal vectorstore
+        texts = [chunk["content"] for _, chunk in batch]
+        vectors = embeddings.embed_documents(texts)
+        ids = [chunk_hash for chunk_hash, _ in batch]
+        metadatas = [chunk["metadata"] for _, chunk in batch]
+        if vectorstore is None:
+            vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas, ids=ids)
+        else:
+            vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        stats["chunks_embedded"] += len(batch)
+
+    # Thêm chunk của file mới/đã sửa; chỉ embed nội dung chưa có trong index (kể cả từ file khác),
+    # theo batch để bộ nhớ không phụ thuộc kích thước corpus
+    batch = []
+    for source, path, digest in changed:
+        hashes = []
+        with open(path, "r", encoding="utf-8") as f:
+            for chunk in iter_disease_chunks(f, source=source):
+                if not chunk["content"]:
+                    continue
+                chunk_hash = content_hash(chunk["content"])
+                if chunk_hash in hashes:
+                    continue
+                hashes.append(chunk_hash)
+                if chunk_hash in refs:
+                    # Đã có vector (của file khác hoặc phiên bản trước của file này)
+                    refs[chunk_hash] += 1
+                    continue
+                refs[chunk_hash] = 1
+                batch.append((chunk_hash, chunk))
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+        known[source] = {"hash": digest, "chunks": hashes}
+    if batch:
+        flush(batch)
+
+    # Gỡ vector không còn file nào tham chiếu
+    stale_ids = [chunk_hash for chunk_hash, count in refs.items() if count <= 0]
+    for chunk_hash in stale_ids:
+        del refs[chunk_hash]
+    if stale_ids and vectorstore is not None:
+        vectorstore.delete(stale_ids)
+        stats["chunks_removed"] = len(stale_ids)
+
+    os.makedirs(persist_path, exist_ok=True)
+    if vectorstore is not None and (changed or stale_ids):
+        vectorstore.save_local(persist_path)
+    save_manifest(persist_path, manifest)
+
+    print(
+        f"✅ Index {persist_path}: +{stats['added']} file mới, ~{stats['updated']} file sửa, "
+        f"-{stats['removed']} file xóa, {stats['unchanged']} file giữ nguyên "
+        f"({stats['chunks_embedded']} chunk được embed, {stats['chunks_removed']} chunk được gỡ)."
+    )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cập nhật FAISS index từ thư mục tài liệu")
+    parser.add_argument("--docs_dir", type=str, default="rag_llm/docs")
+    parser.add_argument("--persist_path", type=str, default="faiss_index")
+    parser.add_argument("--batch_size", type=int, default=32)
+    args = parser.parse_args()
+
+    ingest_directory(args.docs_dir, args.persist_path, args.batch_size)
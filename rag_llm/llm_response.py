@@ -1,47 +1,446 @@
+import asyncio
+import json
 import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
 import requests
+from requests.adapters import HTTPAdapter
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY")
+API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+)
 
-def call_gemini(prompt: str, retries: int = 3, delay: int = 2) -> str:
-    if not API_KEY:
-        return "API key không tồn tại. Vui lòng kiểm tra file .env."
-
-    api_url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-    headers = {"Content-Type": "application/json"}
-    params = {"key": API_KEY}
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-    }
-
-    for attempt in range(retries):
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class SSEParser:
+    """
+    Ghép các dòng Server-Sent Events thành sự kiện (kết thúc bởi một dòng trống, nhiều dòng
+    `data:` được nối bằng "\n") và lấy phần văn bản câu trả lời của Gemini trong mỗi sự kiện.
+    """
+
+    def __init__(self):
+        self._data = []
+
+    def feed(self, line: str):
+        """Nhận một dòng (không có ký tự xuống dòng). Trả về văn bản khi kết thúc một sự kiện, ngược lại None."""
+        if not line:
+            return self.flush()
+        if line.startswith("data:"):
+            value = line[len("data:"):]
+            self._data.append(value[1:] if value.startswith(" ") else value)
+        return None
+
+    def flush(self):
+        """Văn bản của sự kiện đang ghép dở (khi kết nối đóng mà không có dòng trống cuối), hoặc None."""
+        if not self._data:
+            return None
+        data, self._data = "\n".join(self._data), []
         try:
-            response = requests.post(api_url, headers=headers, params=params, json=payload)
-            response.raise_for_status()
-            result = response.json()
-            return result["candidates"][0]["content"]["parts"][0]["text"]
-        except requests.exceptions.RequestException as e:
-            if response.status_code >= 500:
+            chunk = json.loads(data)
+            return chunk["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError, ValueError):
+            # Ví dụ đoạn cuối chỉ chứa finishReason
+            return None
+
+
+class GeminiClient:
+    """
+    Client gọi Gemini dùng chung một HTTP session (giữ kết nối), có timeout cho
+    mỗi lần gọi, thử lại với exponential backoff + jitter (tôn trọng 429/Retry-After),
+    giới hạn số request đồng thời và thống kê độ trễ.
+    `api_url` có thể trỏ tới một server giả lập khi kiểm thử.
+    """
+
+    def __init__(self, api_key: str = None, api_url: str = API_URL, timeout: float = 30.0,
+                 retries: int = 3, backoff: float = 1.0, max_backoff: float = 30.0,
+                 max_concurrency: int = 8):
+        self.api_key = api_key if api_key is not None else API_KEY
+        self.api_url = api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    @staticmethod
+    def build_payload(prompt: str):
+        return {
+            "contents": [
+                {
+                    "parts": [
+                        {
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+        }
+
+    def _retry_delay(self, attempt: int, backoff: float, response=None) -> float:
+        # Ưu tiên Retry-After của server (số giây hoặc HTTP date)
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                    return min(max(delay, 0.0), self.max_backoff)
+                except (TypeError, ValueError):
+                    pass
+        # Full jitter: ngẫu nhiên trong [0, backoff * 2^attempt]
+        return random.uniform(0, min(self.max_backoff, backoff * (2 ** attempt)))
+
+    def _record(self, started: float, retried: int, failed: bool):
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+            self.requests += 1
+            self.retried += retried
+            self.failures += int(failed)
+
+    def _post(self, url: str, prompt: str, retries: int, backoff: float, stream: bool = False, params=None):
+        """Gửi request, thử lại khi cần. Trả về (response, số lần thử lại, thông báo lỗi hoặc None)."""
+        params = dict(params or {}, key=self.api_key)
+        payload = self.build_payload(prompt)
+        attempt = 0
+
+        while True:
+            response = None
+            try:
+                response = self.session.post(
+                    url, params=params, json=payload, timeout=self.timeout, stream=stream
+                )
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response, attempt, None
                 print(f"Lỗi server {response.status_code}, thử lại ({attempt+1}/{retries})...")
-                time.sleep(delay)
-                continue
-            return f"Lỗi khi gọi API: {str(e)}"
-        except Exception:
-            return "Không thể phân tích phản hồi từ mô hình."
-    
-    return "Dịch vụ quá tải. Vui lòng thử lại sau."
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                print(f"Lỗi kết nối {type(e).__name__}, thử lại ({attempt+1}/{retries})...")
+            except requests.exceptions.RequestException as e:
+                # Ví dụ 4xx: trả kết nối về pool (quan trọng khi stream=True)
+                if response is not None:
+                    response.close()
+                return None, attempt, f"Lỗi khi gọi API: {str(e)}"
+
+            attempt += 1
+            if attempt >= retries:
+                return None, attempt, "Dịch vụ quá tải. Vui lòng thử lại sau."
+            time.sleep(self._retry_delay(attempt - 1, backoff, response))
+
+    def generate(self, prompt: str, retries: int = None, backoff: float = None, with_status: bool = False):
+        """
+        Gọi Gemini và trả về câu trả lời, hoặc thông báo lỗi nếu thất bại.
+        Với `with_status=True` trả về (văn bản, thành_công) để phân biệt câu trả lời với thông báo lỗi.
+        """
+        text, ok = self._generate(prompt, retries, backoff)
+        return (text, ok) if with_status else text
+
+    def _generate(self, prompt: str, retries: int = None, backoff: float = None):
+        if not self.api_key:
+            return "API key không tồn tại. Vui lòng kiểm tra file .env.", False
+
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        started = time.perf_counter()
+
+        with self._semaphore:
+            response, attempts, error = self._post(self.api_url, prompt, retries, backoff)
+            if error is not None:
+                self._record(started, attempts, True)
+                return error, False
+            try:
+                result = response.json()
+                text = result["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError, ValueError):
+                # Bao gồm lỗi JSON không hợp lệ
+                self._record(started, attempts, True)
+                return "Không thể phân tích phản hồi từ mô hình.", False
+
+        self._record(started, attempts, False)
+        return text, True
+
+    @property
+    def stream_url(self) -> str:
+        return self.api_url.replace(":generateContent", ":streamGenerateContent")
+
+    def stream(self, prompt: str, retries: int = None, backoff: float = None, on_complete=None):
+        """
+        Gọi biến thể streamGenerateContent (SSE) và trả về dần từng đoạn văn bản.
+        Chỉ thử lại trước khi nhận được đoạn đầu tiên; lỗi được trả về như một đoạn văn bản.
+        Nếu thành công, `on_complete` được gọi với toàn bộ câu trả lời.
+        """
+        if not self.api_key:
+            yield "API key không tồn tại. Vui lòng kiểm tra file .env."
+            return
+
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        started = time.perf_counter()
+        failed = False
+        parts = []
+
+        with self._semaphore:
+            response, attempts, error = self._post(
+                self.stream_url, prompt, retries, backoff, stream=True, params={"alt": "sse"}
+            )
+            if error is not None:
+                self._record(started, attempts, True)
+                yield error
+                return
+
+            # SSE luôn là UTF-8; requests mặc định ISO-8859-1 cho text/* không khai báo charset
+            response.encoding = "utf-8"
+            parser = SSEParser()
+            try:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    text = parser.feed(line)
+                    if text:
+                        parts.append(text)
+                        yield text
+                text = parser.flush()
+                if text:
+                    parts.append(text)
+                    yield text
+            except requests.exceptions.RequestException as e:
+                failed = True
+                yield f"\n[Kết nối bị gián đoạn: {type(e).__name__}]"
+            finally:
+                response.close()
+                self._record(started, attempts, failed)
+
+        if not failed and parts and on_complete is not None:
+            on_complete("".join(parts))
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            requests_count, retried, failures = self.requests, self.retried, self.failures
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "requests": requests_count,
+            "retries": retried,
+            "failures": failures,
+            "latency_p50": percentile(0.50),
+            "latency_p95": percentile(0.95),
+            "latency_max": latencies[-1] if latencies else None,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncGeminiClient(GeminiClient):
+    """
+    Phiên bản asyncio của GeminiClient (dùng httpx) cho chế độ ASGI: các request
+    chờ Gemini không chiếm thread, nên một tiến trình giữ được hàng trăm kết nối chat.
+    Cùng cơ chế timeout, thử lại, giới hạn đồng thời và thống kê như GeminiClient.
+    """
+
+    def __init__(self, api_key: str = None, api_url: str = API_URL, timeout: float = 30.0,
+                 retries: int = 3, backoff: float = 1.0, max_backoff: float = 30.0,
+                 max_concurrency: int = 256):
+        import httpx
+
+        self.api_key = api_key if api_key is not None else API_KEY
+        self.api_url = api_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+        self._httpx = httpx
+        self.session = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=1000)
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    def _get_semaphore(self):
+        # Tạo khi đã có event loop đang chạy
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _post(self, url: str, prompt: str, retries: int, backoff: float, stream: bool = False, params=None):
+        """Giống GeminiClient._post nhưng không chặn event loop."""
+        httpx = self._httpx
+        params = dict(params or {}, key=self.api_key)
+        request = self.session.build_request("POST", url, params=params, json=self.build_payload(prompt))
+        attempt = 0
+
+        while True:
+            response = None
+            try:
+                response = await self.session.send(request, stream=stream)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response, attempt, None
+                print(f"Lỗi server {response.status_code}, thử lại ({attempt+1}/{retries})...")
+                await response.aclose()
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                print(f"Lỗi kết nối {type(e).__name__}, thử lại ({attempt+1}/{retries})...")
+            except httpx.HTTPError as e:
+                # Ví dụ 4xx: trả kết nối về pool (quan trọng khi stream=True)
+                if response is not None:
+                    await response.aclose()
+                return None, attempt, f"Lỗi khi gọi API: {str(e)}"
+
+            attempt += 1
+            if attempt >= retries:
+                return None, attempt, "Dịch vụ quá tải. Vui lòng thử lại sau."
+            await asyncio.sleep(self._retry_delay(attempt - 1, backoff, response))
+
+    async def generate(self, prompt: str, retries: int = None, backoff: float = None, with_status: bool = False):
+        text, ok = await self._generate(prompt, retries, backoff)
+        return (text, ok) if with_status else text
+
+    async def _generate(self, prompt: str, retries: int = None, backoff: float = None):
+        if not self.api_key:
+            return "API key không tồn tại. Vui lòng kiểm tra file .env.", False
+
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        started = time.perf_counter()
+
+        async with self._get_semaphore():
+            response, attempts, error = await self._post(self.api_url, prompt, retries, backoff)
+            if error is not None:
+                self._record(started, attempts, True)
+                return error, False
+            try:
+                result = response.json()
+                text = result["candidates"][0]["content"]["parts"][0]["text"]
+            except (KeyError, IndexError, TypeError, ValueError):
+                self._record(started, attempts, True)
+                return "Không thể phân tích phản hồi từ mô hình.", False
+
+        self._record(started, attempts, False)
+        return text, True
+
+    async def stream(self, prompt: str, retries: int = None, backoff: float = None, on_complete=None):
+        """Async generator các đoạn văn bản, giống GeminiClient.stream."""
+        if not self.api_key:
+            yield "API key không tồn tại. Vui lòng kiểm tra file .env."
+            return
+
+        retries = self.retries if retries is None else retries
+        backoff = self.backoff if backoff is None else backoff
+        started = time.perf_counter()
+        failed = False
+        parts = []
+
+        async with self._get_semaphore():
+            response, attempts, error = await self._post(
+                self.stream_url, prompt, retries, backoff, stream=True, params={"alt": "sse"}
+            )
+            if error is not None:
+                self._record(started, attempts, True)
+                yield error
+                return
+
+            response.encoding = "utf-8"
+            parser = SSEParser()
+            try:
+                async for line in response.aiter_lines():
+                    text = parser.feed(line)
+                    if text:
+                        parts.append(text)
+                        yield text
+                text = parser.flush()
+                if text:
+                    parts.append(text)
+                    yield text
+            except self._httpx.HTTPError as e:
+                failed = True
+                yield f"\n[Kết nối bị gián đoạn: {type(e).__name__}]"
+            finally:
+                await response.aclose()
+                self._record(started, attempts, failed)
+
+        if not failed and parts and on_complete is not None:
+            on_complete("".join(parts))
+
+    async def close(self):
+        await self.session.aclose()
+
+
+_default_client = None
+_default_async_client = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> GeminiClient:
+    """Client dùng chung cho toàn bộ tiến trình."""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = GeminiClient()
+    return _default_client
+
+
+def get_async_client() -> AsyncGeminiClient:
+    """Client async dùng chung, chỉ dùng trong cùng một event loop (chế độ ASGI)."""
+    global _default_async_client
+    if _default_async_client is None:
+        with _default_lock:
+            if _default_async_client is None:
+                _default_async_client = AsyncGeminiClient(
+                    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+                )
+    return _default_async_client
+
+
+def call_gemini(prompt: str, retries: int = 3, delay: int = 2, with_status: bool = False):
+    return get_client().generate(prompt, retries=retries, backoff=delay, with_status=with_status)
+
+
+def stream_gemini(prompt: str, retries: int = 3, delay: int = 2, on_complete=None):
+    """Giống call_gemini nhưng trả về generator các đoạn văn bản ngay khi nhận được."""
+    return get_client().stream(prompt, retries=retries, backoff=delay, on_complete=on_complete)
+
+
+async def acall_gemini(prompt: str, retries: int = 3, delay: int = 2, with_status: bool = False):
+    """Phiên bản async của call_gemini."""
+    return await get_async_client().generate(prompt, retries=retries, backoff=delay, with_status=with_status)
+
+
+def astream_gemini(prompt: str, retries: int = 3, delay: int = 2, on_complete=None):
+    """Phiên bản async của stream_gemini, trả về async generator."""
+    return get_async_client().stream(prompt, retries=retries, backoff=delay, on_complete=on_complete)
 
 if __name__ == "__main__":
     reply = call_gemini("Explain how AI works in a few words")
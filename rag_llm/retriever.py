@@ -1,17 +1,136 @@
-from typing import List
-from .embedding import load_vector_store
+import os
+import threading
+import time
+from typing import List, Optional
 
-def retrieve(query: str, k: int = 2) -> List[str]:
-    vectorstore = load_vector_store()
-    results = vectorstore.similarity_search_with_score(query, k=k)
+from .cache import CachedQueryEmbedding, LRUCache
+from .embedding import SentenceTransformerEmbedding, load_vector_store
+
+
+class Retriever:
+    """
+    Giữ mô hình embedding và FAISS index trong bộ nhớ giữa các lần truy vấn.
+
+    Mô hình chỉ được nạp một lần; index được nạp lại khi các file trong
+    `persist_path` thay đổi (kiểm tra tối đa mỗi `check_interval` giây).
+    Vector của câu truy vấn và kết quả retrieve (theo query, k, phiên bản index)
+    được cache LRU. An toàn khi gọi đồng thời từ nhiều thread.
+    """
+
+    def __init__(self, persist_path: str = "faiss_index", embeddings=None, check_interval: float = 5.0,
+                 cache_size: int = 1024, query_cache_path: str = None):
+        self.persist_path = persist_path
+        self.check_interval = check_interval
+        self.cache_size = cache_size
+        self.query_cache_path = query_cache_path
+        self._embeddings = embeddings
+        self._results = LRUCache(cache_size)
+        self._vectorstore = None
+        self._version = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _index_version(self):
+        # Thời điểm sửa đổi mới nhất của các file index
+        try:
+            return max(
+                os.stat(os.path.join(self.persist_path, name)).st_mtime_ns
+                for name in os.listdir(self.persist_path)
+            )
+        except (OSError, ValueError):
+            return None
+
+    def _get_embeddings(self):
+        if self._embeddings is None:
+            self._embeddings = SentenceTransformerEmbedding()
+        if not isinstance(self._embeddings, CachedQueryEmbedding):
+            self._embeddings = CachedQueryEmbedding(self._embeddings, self.cache_size, self.query_cache_path)
+        return self._embeddings
+
+    def embeddings(self):
+        """Mô hình embedding (có cache truy vấn) dùng chung, nạp nếu chưa có."""
+        with self._lock:
+            return self._get_embeddings()
+
+    def _load(self):
+        embeddings = self._get_embeddings()
+        version = self._index_version()
+        self._vectorstore = load_vector_store(self.persist_path, embeddings)
+        self._version = version
+        self._last_check = time.monotonic()
+
+    def vectorstore(self):
+        """Trả về vector store hiện tại, nạp (lại) nếu cần."""
+        now = time.monotonic()
+        if self._vectorstore is not None and now - self._last_check < self.check_interval:
+            return self._vectorstore
+
+        with self._lock:
+            if self._vectorstore is None:
+                self._load()
+            elif time.monotonic() - self._last_check >= self.check_interval:
+                self._last_check = time.monotonic()
+                if self._index_version() != self._version:
+                    print(f"Index thay đổi, nạp lại: {self.persist_path}")
+                    self._load()
+            return self._vectorstore
+
+    @property
+    def version(self):
+        return self._version
 
-    output = []
-    for doc, score in results:
-        disease = doc.metadata.get("disease", "Không rõ")
-        summary = f"Bệnh: {disease}\nScore: {score:.2f}\n{doc.page_content[:500]}"
-        output.append(summary)
+    def reload(self):
+        with self._lock:
+            self._load()
 
-    return output
+    def retrieve(self, query: str, k: int = 2) -> List[str]:
+        vectorstore = self.vectorstore()
+        key = (query, k, self._version)
+        cached = self._results.get(key)
+        if cached is not None:
+            return list(cached)
+
+        results = vectorstore.similarity_search_with_score(query, k=k)
+
+        output = []
+        for doc, score in results:
+            disease = doc.metadata.get("disease", "Không rõ")
+            summary = f"Bệnh: {disease}\nScore: {score:.2f}\n{doc.page_content[:500]}"
+            output.append(summary)
+
+        self._results.put(key, tuple(output))
+        return output
+
+    def warm_up(self, query: str = "khởi động"):
+        """Nạp mô hình embedding và index, chạy thử một truy vấn (không ghi vào cache kết quả)."""
+        self.vectorstore().similarity_search_with_score(query, k=1)
+
+    def stats(self):
+        return {
+            "index_version": self._version,
+            "results": self._results.stats(),
+            "query_embeddings": (
+                self._embeddings.cache.stats() if isinstance(self._embeddings, CachedQueryEmbedding) else None
+            ),
+        }
+
+
+_default_retriever: Optional[Retriever] = None
+_default_lock = threading.Lock()
+
+
+def get_retriever() -> Retriever:
+    """Retriever dùng chung cho toàn bộ tiến trình."""
+    global _default_retriever
+    if _default_retriever is None:
+        with _default_lock:
+            if _default_retriever is None:
+                _default_retriever = Retriever(query_cache_path=os.getenv("RAG_QUERY_CACHE_PATH") or None)
+    return _default_retriever
+
+
+def retrieve(query: str, k: int = 2) -> List[str]:
+    return get_retriever().retrieve(query, k=k)
 
 if __name__ == "__main__":
     query = "Cháy lá bacterial_leaf_blight?"
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Giống cách back-end/app.py được chạy: thư mục gốc (ai_model, rag_llm) và back-end nằm trong sys.path
+for path in (ROOT, os.path.join(ROOT, "back-end")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# Không nạp mô hình ở nền khi import back-end/app.py, không tải mô hình từ mạng
+os.environ.setdefault("WARMUP", "0")
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+
+@pytest.fixture(scope="session")
+def model_path(tmp_path_factory):
+    """Checkpoint HybridGCNGATModel với trọng số ngẫu nhiên, cùng kiến trúc với ai_model/model.pt."""
+    import torch
+
+    from ai_model.utils import HybridGCNGATModel
+
+    torch.manual_seed(0)
+    model = HybridGCNGATModel(num_node_features=10, num_classes=6, hidden_channels=512,
+                              use_edge_attr=True, gcn_layers=1, gat_layers=1)
+    path = str(tmp_path_factory.mktemp("model") / "model.pt")
+    torch.save(model.state_dict(), path)
+    return path
@@ -0,0 +1,107 @@
+"""
+Per-stage preprocessing and forward-pass benchmarks (pytest-benchmark, see requirements-dev.txt).
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests/test_benchmark.py --benchmark-autosave
+    python -m pytest tests/test_benchmark.py --benchmark-compare --benchmark-compare-fail=median:20%
+
+BENCHMARK_MODEL selects the checkpoint (random weights by default). With
+BENCHMARK_BASELINE pointing at `python -m ai_model.benchmark --output` results,
+test_no_regression_against_baseline applies the same gate as `--compare`.
+"""
+import json
+import os
+
+import pytest
+
+from ai_model.benchmark import (
+    STAGES, benchmark_dataset, compare, run_stage, stage_inputs, synthetic_leaf_images
+)
+from ai_model.predict import LeafDiseasePredictor
+
+try:
+    import pytest_benchmark  # noqa: F401
+    HAVE_BENCHMARK = True
+except ImportError:
+    HAVE_BENCHMARK = False
+
+requires_benchmark = pytest.mark.skipif(not HAVE_BENCHMARK, reason="pytest-benchmark is not installed")
+
+RESOLUTIONS = [256, 1024]
+
+
+@pytest.fixture(scope="module")
+def predictor(model_path):
+    predictor = LeafDiseasePredictor(os.getenv("BENCHMARK_MODEL") or model_path)
+    yield predictor
+    predictor.close()
+
+
+@pytest.fixture(scope="module", params=RESOLUTIONS, ids=lambda resolution: f"{resolution}px")
+def inputs(request):
+    _, data = next(synthetic_leaf_images(1, request.param))
+    return stage_inputs(data)
+
+
+@requires_benchmark
+@pytest.mark.parametrize("stage", STAGES)
+def test_stage(benchmark, inputs, stage):
+    benchmark.group = f"stage {stage}"
+    assert benchmark(run_stage, stage, inputs) is not None
+
+
+@requires_benchmark
+@pytest.mark.parametrize("batch_size", [1, 8, 32])
+def test_forward(benchmark, predictor, batch_size):
+    images = list(synthetic_leaf_images(batch_size, 256))
+    graphs = [predictor._image_to_graph(data) for _, data in images]
+    benchmark.group = "forward"
+    benchmark.extra_info["batch_size"] = batch_size
+    assert len(benchmark(predictor._predict_graphs, graphs)) == batch_size
+
+
+@requires_benchmark
+def test_end_to_end(benchmark, predictor):
+    _, data = next(synthetic_leaf_images(1, 1024))
+    benchmark.group = "end to end"
+    assert benchmark(predictor.predict, data) is not None
+
+
+def test_failed_images_counted_once(predictor, monkeypatch):
+    import ai_model.benchmark as benchmark_module
+
+    images = list(synthetic_leaf_images(3, 256))
+    calls = []
+    preprocess = benchmark_module.preprocessing_image_to_graph
+
+    def flaky(data, **kwargs):
+        # Ảnh thứ hai chỉ lỗi ở lần lặp đầu tiên
+        calls.append(data)
+        if data == images[1][1] and calls.count(data) == 1:
+            raise ValueError("flaky image")
+        return preprocess(data, **kwargs)
+
+    monkeypatch.setattr(benchmark_module, "preprocessing_image_to_graph", flaky)
+    assert benchmark_dataset(predictor, images, [1], repeats=3)["failed"] == 1
+
+
+def test_no_regression_against_baseline(predictor):
+    baseline_path = os.getenv("BENCHMARK_BASELINE")
+    if not baseline_path:
+        pytest.skip("set BENCHMARK_BASELINE to the JSON written by python -m ai_model.benchmark --output")
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    meta = baseline.get("meta", {})
+
+    results = {"datasets": {}}
+    for name, previous in baseline["datasets"].items():
+        if not name.startswith("synthetic-"):
+            continue
+        images = list(synthetic_leaf_images(previous["images"], int(name.split("-")[1])))
+        results["datasets"][name] = benchmark_dataset(
+            predictor, images, [int(size) for size in previous["forward"]],
+            meta.get("repeats", 1), meta.get("image_size", 128), meta.get("fast", False)
+        )
+
+    threshold = float(os.getenv("BENCHMARK_THRESHOLD", "0.2"))
+    assert compare(results, baseline, threshold) == []
@@ -0,0 +1,130 @@
+import atexit
+import json
+import os
+import threading
+
+import pytest
+
+from rag_llm.cache import CachedQueryEmbedding, ResponseCache
+
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+
+@pytest.fixture
+def make_cached():
+    """Tạo CachedQueryEmbedding và gỡ flush khỏi atexit sau test, để không ghi vào thư mục tạm đã xóa."""
+    created = []
+
+    def make(*args, **kwargs):
+        created.append(CachedQueryEmbedding(*args, **kwargs))
+        return created[-1]
+
+    yield make
+    for cached in created:
+        atexit.unregister(cached.flush)
+
+
+def test_query_embedding_persists_in_batches(tmp_path, make_cached):
+    path = str(tmp_path / "queries.json")
+    cached = make_cached(FakeEmbeddings(), persist_path=path, save_every=3)
+
+    cached.embed_query("a")
+    cached.embed_query("bb")
+    assert not os.path.exists(path)
+
+    cached.embed_query("ccc")
+    with open(path, encoding="utf-8") as f:
+        assert len(json.load(f)) == 3
+
+    cached.embed_query("dddd")
+    cached.flush()
+    reloaded = make_cached(FakeEmbeddings(), persist_path=path)
+    assert reloaded.embed_query("dddd") == [4.0, 1.0]
+    assert reloaded.embeddings.calls == 0
+
+
+def test_concurrent_misses_write_valid_file(tmp_path, make_cached):
+    path = str(tmp_path / "queries.json")
+    cached = make_cached(FakeEmbeddings(), persist_path=path, save_every=1)
+    errors = []
+
+    def worker(offset):
+        try:
+            for i in range(50):
+                cached.embed_query(f"q{offset}-{i}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(path, encoding="utf-8") as f:
+        assert len(json.load(f)) == 400
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_failed_save_does_not_fail_lookup(tmp_path, make_cached, capsys):
+    path = str(tmp_path / "missing" / "queries.json")
+    cached = make_cached(FakeEmbeddings(), persist_path=path, save_every=1)
+    assert cached.embed_query("abc") == [3.0, 1.0]
+
+    # Ghi thất bại: không có file nào được tạo, vector vẫn chờ lần lưu sau
+    assert not os.path.exists(path)
+    assert not os.path.exists(os.path.dirname(path))
+    assert cached._unsaved == 1
+    assert f"Không ghi được cache embedding {path}" in capsys.readouterr().out
+    assert cached.embed_query("abc") == [3.0, 1.0]
+    assert cached.embeddings.calls == 1
+
+
+class WordEmbeddings:
+    """Vector theo tập từ, đủ để câu hỏi chỉ khác trật tự từ có cosine 1."""
+
+    words = ["cách", "trị", "bệnh", "phòng", "này"]
+
+    def embed_query(self, text):
+        return [float(word in text.split()) for word in self.words]
+
+
+def test_response_cache_counts_exact_and_semantic_hits():
+    factory_calls = []
+
+    def factory():
+        factory_calls.append(True)
+        return WordEmbeddings()
+
+    cache = ResponseCache(embeddings_factory=factory)
+    assert factory_calls == []
+
+    assert cache.get("brown_spot", None, "Cách trị bệnh này?", "ctx") is None
+    cache.put("brown_spot", None, "Cách trị bệnh này?", "ctx", "Phun thuốc.")
+    assert cache.get("brown_spot", None, "cách trị bệnh này", "ctx") == "Phun thuốc."
+    assert cache.get("brown_spot", None, "bệnh này cách trị", "ctx") == "Phun thuốc."
+    assert cache.get("leaf_blast", None, "cách trị bệnh này", "ctx") is None
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["hits"] == 2 and stats["hit_rate"] == 0.5
+    assert len(factory_calls) == 1
+
+
+def test_response_cache_without_embeddings_counts_misses():
+    cache = ResponseCache()
+    cache.put("brown_spot", "Hà Nội", "Cách trị?", "ctx", "Phun thuốc.")
+    assert cache.get("brown_spot", "Hà Nội", "cách trị", "ctx") == "Phun thuốc."
+    assert cache.get("brown_spot", "Huế", "cách trị", "ctx") is None
+    assert cache.stats()["hit_rate"] == 0.5
@@ -0,0 +1,78 @@
+import hashlib
+
+from langchain_core.embeddings import Embeddings
+
+from rag_llm.embedding import content_hash
+from rag_llm.ingest import ingest_directory, load_manifest
+
+
+class HashEmbeddings(Embeddings):
+    model_name = "hash-test"
+
+    def __init__(self):
+        self.embedded = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [byte / 255.0 for byte in digest[:8]]
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+SHARED = "# brown_spot\nĐốm nâu trên lá."
+
+
+def write_docs(docs, **files):
+    for name, text in files.items():
+        (docs / name).write_text(text, encoding="utf-8")
+
+
+def indexed_texts(persist_path):
+    from langchain_community.vectorstores import FAISS
+
+    store = FAISS.load_local(str(persist_path), HashEmbeddings(), allow_dangerous_deserialization=True)
+    return sorted(store.docstore.search(doc_id).page_content for doc_id in store.index_to_docstore_id.values())
+
+
+def test_shared_chunks_are_embedded_once_and_reference_counted(tmp_path):
+    docs, index = tmp_path / "docs", tmp_path / "index"
+    docs.mkdir()
+    write_docs(docs, **{
+        "a.md": SHARED + "\n# leaf_blast\nĐạo ôn.",
+        "b.md": SHARED + "\n# leaf_scald\nCháy bìa lá.",
+    })
+
+    embeddings = HashEmbeddings()
+    stats = ingest_directory(str(docs), str(index), embeddings=embeddings)
+    assert stats["added"] == 2 and stats["chunks_embedded"] == 3
+    assert embeddings.embedded.count(SHARED) == 1
+    assert load_manifest(str(index))["chunks"][content_hash(SHARED)] == 2
+
+    stats = ingest_directory(str(docs), str(index), embeddings=HashEmbeddings())
+    assert stats["unchanged"] == 2 and stats["chunks_embedded"] == 0
+
+    # Xóa a.md: chunk chung vẫn còn vì b.md chứa nó
+    (docs / "a.md").unlink()
+    stats = ingest_directory(str(docs), str(index), embeddings=HashEmbeddings())
+    assert stats["removed"] == 1 and stats["chunks_removed"] == 1
+    assert indexed_texts(index) == sorted([SHARED, "# leaf_scald\nCháy bìa lá."])
+    assert load_manifest(str(index))["chunks"][content_hash(SHARED)] == 1
+
+
+def test_updated_file_keeps_unchanged_chunks(tmp_path):
+    docs, index = tmp_path / "docs", tmp_path / "index"
+    docs.mkdir()
+    write_docs(docs, **{"a.md": SHARED + "\n# leaf_blast\nĐạo ôn."})
+    ingest_directory(str(docs), str(index), embeddings=HashEmbeddings())
+
+    write_docs(docs, **{"a.md": SHARED + "\n# leaf_blast\nĐạo ôn, phun thuốc."})
+    embeddings = HashEmbeddings()
+    stats = ingest_directory(str(docs), str(index), embeddings=embeddings)
+    assert stats["updated"] == 1 and stats["chunks_removed"] == 1
+    assert embeddings.embedded == ["# leaf_blast\nĐạo ôn, phun thuốc."]
+    assert indexed_texts(index) == sorted([SHARED, "# leaf_blast\nĐạo ôn, phun thuốc."])
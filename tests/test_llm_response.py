@@ -0,0 +1,180 @@
+import asyncio
+import json
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rag_llm.llm_response import AsyncGeminiClient, GeminiClient
+
+
+def candidate(text):
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+class StubGemini:
+    """Server Gemini giả lập trả lần lượt các phản hồi (status, headers, body, độ trễ) đã định sẵn."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests.append(time.monotonic())
+                status, headers, body, delay = stub.responses.pop(0) if stub.responses else (200, {}, candidate("ok"), 0)
+                time.sleep(delay)
+                data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/models/stub:generateContent"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reply(self, status, body=None, headers=None, delay=0.0):
+        self.responses.append((status, headers or {}, body if body is not None else {"error": status}, delay))
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    server = StubGemini()
+    yield server
+    server.close()
+
+
+def sync_client(stub, **kwargs):
+    return GeminiClient(api_key="test", api_url=stub.url, backoff=0.0, **kwargs)
+
+
+def async_generate(stub, prompt="hỏi", **kwargs):
+    async def run():
+        client = AsyncGeminiClient(api_key="test", api_url=stub.url, backoff=0.0, **kwargs)
+        try:
+            return await client.generate(prompt, with_status=True), client.stats()
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_retries_retryable_status(stub, status):
+    stub.reply(status)
+    stub.reply(status)
+    stub.reply(200, candidate("Trả lời"))
+    client = sync_client(stub)
+    assert client.generate("hỏi", with_status=True) == ("Trả lời", True)
+    assert len(stub.requests) == 3
+    assert client.stats()["retries"] == 2
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_async_retries_retryable_status(stub, status):
+    stub.reply(status)
+    stub.reply(200, candidate("Trả lời"))
+    result, stats = async_generate(stub)
+    assert result == ("Trả lời", True)
+    assert stats["retries"] == 1
+
+
+def test_gives_up_after_retries(stub):
+    for _ in range(3):
+        stub.reply(503)
+    text, ok = sync_client(stub, retries=3).generate("hỏi", with_status=True)
+    assert not ok and text == "Dịch vụ quá tải. Vui lòng thử lại sau."
+    assert len(stub.requests) == 3
+
+
+def test_retry_after_is_respected(stub):
+    stub.reply(429, headers={"Retry-After": "1"})
+    stub.reply(200, candidate("Trả lời"))
+    assert sync_client(stub).generate("hỏi") == "Trả lời"
+    assert stub.requests[1] - stub.requests[0] >= 0.9
+
+
+def test_async_retry_after_is_respected(stub):
+    stub.reply(429, headers={"Retry-After": "1"})
+    stub.reply(200, candidate("Trả lời"))
+    result, _ = async_generate(stub)
+    assert result == ("Trả lời", True)
+    assert stub.requests[1] - stub.requests[0] >= 0.9
+
+
+def test_retry_after_http_date_is_capped():
+    client = GeminiClient(api_key="test", max_backoff=5.0)
+
+    class Response:
+        headers = {"Retry-After": formatdate(time.time() + 3600, usegmt=True)}
+
+    assert client._retry_delay(0, 1.0, Response()) == 5.0
+
+
+@pytest.mark.parametrize("status", [400, 403, 404])
+def test_client_error_is_not_retried(stub, status):
+    stub.reply(status)
+    text, ok = sync_client(stub).generate("hỏi", with_status=True)
+    assert not ok and text.startswith("Lỗi khi gọi API")
+    assert len(stub.requests) == 1
+
+
+def test_async_client_error_is_not_retried(stub):
+    stub.reply(400)
+    (text, ok), stats = async_generate(stub)
+    assert not ok and text.startswith("Lỗi khi gọi API")
+    assert len(stub.requests) == 1 and stats["failures"] == 1
+
+
+def test_client_error_closes_streamed_response(stub):
+    stub.reply(400)
+    client = sync_client(stub)
+    opened = []
+    post = client.session.post
+
+    def spy(*args, **kwargs):
+        response = post(*args, **kwargs)
+        opened.append(response)
+        return response
+
+    client.session.post = spy
+    response, _, error = client._post(stub.url, "hỏi", retries=3, backoff=0.0, stream=True)
+    assert response is None and error.startswith("Lỗi khi gọi API")
+    assert opened[0].raw.closed
+
+
+def test_timeout_is_retried(stub):
+    stub.reply(200, candidate("chậm"), delay=1.0)
+    stub.reply(200, candidate("Trả lời"))
+    client = sync_client(stub, timeout=0.2)
+    assert client.generate("hỏi", with_status=True) == ("Trả lời", True)
+    assert len(stub.requests) == 2
+
+
+def test_async_timeout_is_retried(stub):
+    stub.reply(200, candidate("chậm"), delay=1.0)
+    stub.reply(200, candidate("Trả lời"))
+    result, stats = async_generate(stub, timeout=0.2)
+    assert result == ("Trả lời", True)
+    assert stats["retries"] == 1
@@ -0,0 +1,99 @@
+import pytest
+
+from ai_model.benchmark import synthetic_leaf_images
+from ai_model.predict import LeafDiseasePredictor
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name, data in synthetic_leaf_images(4, 128):
+        path = tmp_path / f"{name}.jpg"
+        path.write_bytes(data)
+        paths.append(str(path))
+    return paths
+
+
+def test_predict_batch_isolates_failing_graph(model_path, images, monkeypatch, capsys):
+    predictor = LeafDiseasePredictor(model_path)
+    expected = dict(predictor.predict_batch(images))
+    bad = predictor._image_to_graph(images[1])
+    predict_graphs = predictor._predict_graphs
+
+    def failing(graphs):
+        if any(graph.x.data_ptr() == bad.x.data_ptr() for graph in graphs):
+            raise RuntimeError("bad graph")
+        return predict_graphs(graphs)
+
+    monkeypatch.setattr(predictor, "_image_to_graph", lambda image, timings=None: (
+        bad if image == images[1] else LeafDiseasePredictor._image_to_graph(predictor, image, timings)
+    ))
+    monkeypatch.setattr(predictor, "_predict_graphs", failing)
+
+    results = dict(predictor.predict_batch(images))
+    assert results[images[1]] == "ERROR"
+    for path in images[:1] + images[2:]:
+        assert results[path] == expected[path]
+    assert f"Prediction failed for {images[1]}: RuntimeError: bad graph" in capsys.readouterr().out
+    predictor.close()
+
+
+def test_exported_model_loads_without_training_code(model_path, tmp_path):
+    import os
+    import subprocess
+    import sys
+
+    import torch
+    from torch_geometric.data import Batch
+
+    from ai_model.export import _random_graphs, export_torchscript
+
+    model = LeafDiseasePredictor(model_path).model
+    scripted_path = str(tmp_path / "model.ts")
+    scripted = export_torchscript(model, scripted_path)
+
+    # BatchNorm đã gộp vào trọng số nhưng logits phải giữ nguyên, kể cả khi gom nhiều graph một lượt
+    batch = Batch.from_data_list(_random_graphs(8, 10))
+    with torch.inference_mode():
+        expected = model(batch)
+        actual = scripted(batch.x, batch.edge_index, batch.batch, batch.num_graphs)
+    torch.testing.assert_close(actual, expected, atol=1e-5, rtol=1e-5)
+
+    code = (
+        "import sys\n"
+        "from ai_model.predict import LeafDiseasePredictor\n"
+        f"predictor = LeafDiseasePredictor({scripted_path!r})\n"
+        "assert predictor.scripted\n"
+        "print('ai_model.utils' in sys.modules)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
+
+
+def test_quantized_predictor_agrees_with_fp32(model_path):
+    from ai_model.export import _random_graphs
+
+    calibration = _random_graphs(32, 10, seed=1)
+    graphs = _random_graphs(16, 10, seed=2)
+    fp32 = LeafDiseasePredictor(model_path)
+    int8 = LeafDiseasePredictor(model_path, quantize=True, calibration_graphs=calibration)
+
+    assert int8.scripted and int8.quantized_layers
+    assert int8.model_fingerprint != fp32.model_fingerprint
+    assert int8.stats()["quantized_layers"] == int8.quantized_layers
+    assert int8._predict_graphs(graphs) == fp32._predict_graphs(graphs)
+
+
+def test_quantize_requires_calibration_graphs(model_path):
+    with pytest.raises(ValueError, match="calibration graphs"):
+        LeafDiseasePredictor(model_path, quantize=True)
+
+
+def test_warm_up_bypasses_cache(model_path):
+    from ai_model.cache import GraphCache
+
+    cache = GraphCache()
+    predictor = LeafDiseasePredictor(model_path, cache=cache)
+    assert predictor.warm_up() in {f"Class_{index}" for index in range(6)}
+    assert cache.hits == cache.misses == 0
@@ -0,0 +1,72 @@
+import os
+import signal
+
+import pytest
+
+from ai_model import preprocess_pool
+from ai_model.benchmark import synthetic_leaf_images
+from ai_model.preprocess_pool import GraphPreprocessingPool
+
+original_image_to_arrays = preprocess_pool._image_to_arrays
+
+
+def crash_on_marked(image_path, *args):
+    # Simulates a worker crash, e.g. a segfault in an image decoder
+    if "crash" in os.path.basename(image_path):
+        os._exit(1)
+    return original_image_to_arrays(image_path, *args)
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name, data in synthetic_leaf_images(12, 128):
+        path = tmp_path / f"{name}.jpg"
+        path.write_bytes(data)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_map_recovers_when_workers_are_killed(images, ordered):
+    with GraphPreprocessingPool(num_workers=2, max_pending=8) as pool:
+        results = pool.map(images, ordered=ordered)
+        first = next(results)
+        broken = pool._executor
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        results = [first] + list(results)
+
+        assert sorted(result.index for result in results) == list(range(len(images)))
+        assert all(result.error is None and result.graph is not None for result in results)
+        if ordered:
+            assert [result.index for result in results] == list(range(len(images)))
+        # The broken pool was shut down and replaced
+        assert pool._executor is not broken
+        assert broken._shutdown_thread
+
+
+def test_map_reports_image_that_kills_workers(images, monkeypatch):
+    monkeypatch.setattr(preprocess_pool, "_image_to_arrays", crash_on_marked)
+    crash = os.path.join(os.path.dirname(images[0]), "crash.jpg")
+    os.link(images[0], crash)
+    paths = images[:5] + [crash] + images[5:]
+
+    with GraphPreprocessingPool(num_workers=2, max_pending=4) as pool:
+        results = list(pool.map(paths))
+
+    failed = [result.image_path for result in results if result.error is not None]
+    assert failed == [crash]
+    assert all(result.graph is not None for result in results if result.image_path != crash)
+
+
+def test_image_to_graph_retries_on_fresh_pool(images):
+    with GraphPreprocessingPool(num_workers=1) as pool:
+        pool.image_to_graph(images[0])
+        broken = pool._executor
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+        # Let the pool notice the dead worker
+        broken._executor_manager_thread.join(5)
+        assert pool.image_to_graph(images[1]).num_nodes > 0
+        assert pool._executor is not broken
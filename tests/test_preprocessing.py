@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+import pytest
+
+from ai_model.preprocessing import construct_region_adjacency_graph, obtain_enhanced_node_features
+
+# tests/data/<case>.npz: ảnh RGB 128x128 sau CLAHE và resize, segments SLIC và đặc trưng node do
+# vòng lặp theo từng segment (bản gốc mà model.pt được huấn luyện) tính ra. "synthetic" đánh số
+# segment cách quãng để có segment rỗng, và một segment chỉ gồm một pixel.
+# tests/data/<case>_adjacency.npz: edge_index, edge_attr do RAG của skimage (networkx) tạo ra
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CASES = ["test_jpg", "synthetic"]
+
+
+def load_case(name):
+    with np.load(os.path.join(DATA_DIR, f"{name}.npz")) as data:
+        return data["image"] / 255.0, data["segments"].astype(np.int64), data["node_features"]
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_node_features_match_per_segment_loop(name):
+    image, segments, expected = load_case(name)
+    features = obtain_enhanced_node_features(image, segments)
+    assert features.dtype == expected.dtype
+    # So sánh từng bit: thứ tự cộng số thực khác đi cũng làm lệch đầu vào của checkpoint
+    np.testing.assert_array_equal(features, expected)
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_adjacency_matches_skimage_rag(name):
+    image, segments, _ = load_case(name)
+    with np.load(os.path.join(DATA_DIR, f"{name}_adjacency.npz")) as data:
+        expected_index, expected_attr = data["edge_index"], data["edge_attr"]
+    edge_index, edge_attr = construct_region_adjacency_graph(image, segments)
+    # Thứ tự cạnh phải giống thứ tự duyệt cạnh của networkx, không chỉ cùng tập cạnh
+    np.testing.assert_array_equal(edge_index, expected_index)
+    # Khoảng cách màu tính bằng einsum thay cho norm của skimage nên có thể lệch một ulp
+    np.testing.assert_allclose(edge_attr, expected_attr, rtol=1e-12, atol=0)
@@ -0,0 +1,110 @@
+import pytest
+
+
+class FakePredictor:
+    def predict(self, image, timings=None):
+        return "Class_1"
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.loads = 0
+
+    def vectorstore(self):
+        self.loads += 1
+        return object()
+
+    def retrieve(self, query, k=2):
+        return ["Bệnh: brown_spot"]
+
+
+@pytest.fixture
+def core(monkeypatch):
+    import app as core
+
+    assert core.os.getenv("WARMUP") == "0"
+    monkeypatch.setattr(core, "_predictor", None)
+    monkeypatch.setattr(core, "_create_predictor", FakePredictor)
+    retriever = FakeRetriever()
+    monkeypatch.setattr(core, "get_retriever", lambda: retriever)
+    for name in core.readiness:
+        monkeypatch.setitem(core.readiness, name, {"ready": False, "seconds": None, "error": None})
+    return core
+
+
+def test_ready_after_lazy_load_without_warmup(core):
+    client = core.app.test_client()
+    assert client.get("/ready").status_code == 503
+
+    core.get_predictor()
+    assert client.get("/ready").status_code == 503
+
+    core.async_retrieve("s1", 1, "brown_spot")
+    response = client.get("/ready")
+    assert response.status_code == 200
+    components = response.get_json()["components"]
+    assert components["predictor"]["ready"] and components["predictor"]["seconds"] is not None
+    assert components["retriever"]["ready"]
+
+    core.load_retriever()
+    assert core.get_retriever().loads == 1
+
+
+def test_ready_records_load_error(core, monkeypatch):
+    def broken():
+        raise OSError("model.pt not found")
+
+    monkeypatch.setattr(core, "_create_predictor", broken)
+    with pytest.raises(OSError):
+        core.get_predictor()
+    assert core.readiness["predictor"]["error"] == "OSError: model.pt not found"
+    assert core.app.test_client().get("/ready").status_code == 503
+
+
+def test_asgi_ready_after_lazy_load(core):
+    from starlette.testclient import TestClient
+
+    import asgi
+
+    # Không chạy lifespan: nó đóng các executor dùng chung của app
+    client = TestClient(asgi.app)
+    assert client.get("/ready").status_code == 503
+    core.get_predictor()
+    core.load_retriever()
+    assert client.get("/ready").status_code == 200
+
+
+def test_semantic_cache_loads_embeddings_lazily(monkeypatch):
+    import importlib
+    import sys
+
+    import app as core
+
+    calls = []
+    monkeypatch.setenv("RESPONSE_CACHE_SEMANTIC", "1")
+    monkeypatch.setattr("rag_llm.retriever.get_retriever", lambda: calls.append(True))
+    monkeypatch.delitem(sys.modules, "app")
+    try:
+        fresh = importlib.import_module("app")
+        assert calls == [] and fresh.response_cache.semantic
+        fresh.retrieval_executor.shutdown(wait=False)
+    finally:
+        sys.modules["app"] = core
+
+
+def test_question_embeddings_are_not_persisted(core, tmp_path):
+    from rag_llm.cache import CachedQueryEmbedding
+
+    model = object()
+    retriever = core.get_retriever()
+    retriever.embeddings = lambda: CachedQueryEmbedding(model, persist_path=str(tmp_path / "queries.json"))
+
+    questions = core.question_embeddings()
+    assert questions.embeddings is model
+    assert questions.persist_path is None
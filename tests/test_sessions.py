@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore()
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+
+def test_increment_is_atomic(store):
+    ids, lock = [], threading.Lock()
+
+    def upload():
+        for _ in range(25):
+            state = store.increment("s1", "diagnosis_id", retrieving=True)
+            with lock:
+                ids.append(state["diagnosis_id"])
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(ids) == list(range(1, 201))
+    assert store.get("s1")["diagnosis_id"] == 200 and store.get("s1")["retrieving"]
+
+
+def test_update_with_expected(store):
+    store.increment("s1", "diagnosis_id", disease_key="brown_spot")
+    assert store.update("s1", expected={"diagnosis_id": 2}, disease_data="cũ") is None
+    assert store.update("s1", expected={"diagnosis_id": 1}, disease_data="mới")["disease_data"] == "mới"
+
+
+@pytest.fixture
+def client():
+    import app as core
+
+    return core, core.app.test_client()
+
+
+def test_client_without_session_gets_its_own(client):
+    core, first = client
+    response = first.get("/api/weather", query_string={"location": "Hà Nội"})
+    session_id = response.headers["X-Session-Id"]
+    assert core.SESSION_COOKIE + "=" + session_id in response.headers["Set-Cookie"]
+    assert core.sessions.get(session_id)["location"] == "Hà Nội"
+
+    # Lần sau trình duyệt gửi lại cookie nên dùng cùng phiên, không cấp id mới
+    response = first.get("/api/weather", query_string={"location": "Huế"})
+    assert "X-Session-Id" not in response.headers
+    assert core.sessions.get(session_id)["location"] == "Huế"
+
+    other = core.app.test_client().get("/api/weather", query_string={"location": "Cần Thơ"})
+    assert other.headers["X-Session-Id"] != session_id
+    assert core.sessions.get(session_id)["location"] == "Huế"
+    assert core.sessions.get("default")["location"] is None
+
+
+def test_header_session_id_is_kept(client):
+    core, test_client = client
+    response = test_client.get("/api/weather", query_string={"location": "Huế"}, headers={"X-Session-Id": "abc"})
+    assert "X-Session-Id" not in response.headers and "Set-Cookie" not in response.headers
+    assert core.sessions.get("abc")["location"] == "Huế"
+
+
+def test_asgi_client_without_session_gets_its_own(client):
+    from starlette.testclient import TestClient
+
+    import asgi
+
+    core, _ = client
+    test_client = TestClient(asgi.app)
+    response = test_client.get("/api/weather", params={"location": "Đà Nẵng"})
+    session_id = response.headers["X-Session-Id"]
+    assert core.sessions.get(session_id)["location"] == "Đà Nẵng"
+
+    response = test_client.get("/api/weather", params={"location": "Huế"})
+    assert "X-Session-Id" not in response.headers
+    assert core.sessions.get(session_id)["location"] == "Huế"
@@ -0,0 +1,183 @@
+import asyncio
+import json
+import uuid
+
+import httpx
+import pytest
+import requests
+from urllib3.exceptions import ProtocolError
+
+from rag_llm.llm_response import AsyncGeminiClient, GeminiClient, SSEParser
+
+
+def event(text):
+    return "data: " + json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}, ensure_ascii=False)
+
+
+# Hai sự kiện, sự kiện thứ hai bị cắt giữa dòng và giữa một ký tự UTF-8 nhiều byte,
+# cùng một sự kiện chỉ có finishReason như đoạn cuối của Gemini
+BODY = (event("Bệnh đạo ôn ") + "\r\n\r\n" + event("cần phun thuốc.") + "\r\n\r\n"
+        + 'data: {"candidates": [{"finishReason": "STOP"}]}\r\n\r\n').encode("utf-8")
+SPLIT = BODY.index("phun".encode("utf-8")) - 2
+CHUNKS = [BODY[:7], BODY[7:SPLIT], BODY[SPLIT:SPLIT + 1], BODY[SPLIT + 1:]]
+
+
+class FakeRaw:
+    """Thay cho urllib3 response: trả lần lượt các chunk rồi (tùy chọn) ngắt kết nối."""
+
+    def __init__(self, chunks, error=False):
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+        self.released = False
+
+    def stream(self, chunk_size=None, decode_content=True):
+        yield from self.chunks
+        if self.error:
+            raise ProtocolError("Connection broken")
+
+    def close(self):
+        self.closed = True
+
+    def release_conn(self):
+        self.released = True
+
+
+def fake_response(chunks, error=False):
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/event-stream"
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.raw = FakeRaw(chunks, error)
+    return response
+
+
+def sync_stream(chunks, error=False):
+    client = GeminiClient(api_key="test", api_url="http://gemini.invalid/v1/models/stub:generateContent")
+    response = fake_response(chunks, error)
+    client.session.post = lambda *args, **kwargs: response
+    completed = []
+    parts = list(client.stream("hỏi", on_complete=completed.append))
+    return parts, completed, response
+
+
+def async_stream(chunks, error=False):
+    class Stream(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            for chunk in chunks:
+                yield chunk
+            if error:
+                raise httpx.ReadError("Connection broken")
+
+    async def run():
+        client = AsyncGeminiClient(api_key="test", api_url="http://gemini.invalid/v1/models/stub:generateContent")
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, headers={"Content-Type": "text/event-stream"}, stream=Stream())
+        ))
+        completed = []
+        parts = [part async for part in client.stream("hỏi", on_complete=completed.append)]
+        await client.close()
+        return parts, completed
+
+    return asyncio.run(run())
+
+
+def test_parser_joins_multiline_data_and_waits_for_blank_line():
+    parser = SSEParser()
+    payload = json.dumps({"candidates": [{"content": {"parts": [{"text": "xin chào"}]}}]}, indent=1)
+    lines = ["event: message", ": comment"] + ["data: " + line for line in payload.splitlines()]
+    assert [parser.feed(line) for line in lines] == [None] * len(lines)
+    assert parser.feed("") == "xin chào"
+    assert parser.feed("") is None
+
+
+def test_parser_flushes_last_event_without_blank_line():
+    parser = SSEParser()
+    assert parser.feed(event("cuối")) is None
+    assert parser.flush() == "cuối"
+
+
+def test_stream_partial_chunks():
+    parts, completed, response = sync_stream(CHUNKS)
+    assert parts == ["Bệnh đạo ôn ", "cần phun thuốc."]
+    assert completed == ["Bệnh đạo ôn cần phun thuốc."]
+    assert response.raw.released
+
+
+def test_stream_mid_stream_error():
+    parts, completed, response = sync_stream(CHUNKS[:2], error=True)
+    assert parts[0] == "Bệnh đạo ôn "
+    assert parts[-1] == "\n[Kết nối bị gián đoạn: ChunkedEncodingError]"
+    assert completed == []
+    assert response.raw.closed
+
+
+def test_async_stream_partial_chunks():
+    parts, completed = async_stream(CHUNKS)
+    assert parts == ["Bệnh đạo ôn ", "cần phun thuốc."]
+    assert completed == ["Bệnh đạo ôn cần phun thuốc."]
+
+
+def test_async_stream_mid_stream_error():
+    parts, completed = async_stream(CHUNKS[:2], error=True)
+    assert parts == ["Bệnh đạo ôn ", "\n[Kết nối bị gián đoạn: ReadError]"]
+    assert completed == []
+
+
+def read_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = block.split("\n")
+        name = lines[0][len("event: "):] if lines[0].startswith("event: ") else None
+        events.append((name, json.loads(lines[-1][len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def chat_session(monkeypatch):
+    import app as core
+
+    session_id = uuid.uuid4().hex
+    core.sessions.update(session_id, disease_key="leaf_blast", disease_data="Bệnh: leaf_blast", retrieving=False)
+    return core, {"X-Session-Id": session_id}
+
+
+def test_stream_endpoint(chat_session, monkeypatch):
+    core, headers = chat_session
+
+    def stream_gemini(prompt, on_complete=None):
+        return GeminiClient.stream(client, prompt, on_complete=on_complete)
+
+    client = GeminiClient(api_key="test")
+    client.session.post = lambda *args, **kwargs: fake_response(CHUNKS)
+    monkeypatch.setattr(core, "stream_gemini", stream_gemini)
+
+    question = {"text": f"Cách trị? {uuid.uuid4().hex}"}
+    response = core.app.test_client().post("/api/predict/stream", json=question, headers=headers)
+    assert response.mimetype == "text/event-stream"
+    assert read_events(response.get_data(as_text=True)) == [
+        (None, {"text": "Bệnh đạo ôn "}), (None, {"text": "cần phun thuốc."}), ("done", {})
+    ]
+
+    # Câu trả lời đầy đủ được cache, lần hỏi lại trả về một sự kiện
+    monkeypatch.setattr(core, "stream_gemini", None)
+    response = core.app.test_client().post("/api/predict/stream", json=question, headers=headers)
+    assert read_events(response.get_data(as_text=True)) == [
+        (None, {"text": "Bệnh đạo ôn cần phun thuốc."}), ("done", {})
+    ]
+
+
+def test_stream_endpoint_mid_stream_error(chat_session, monkeypatch):
+    core, headers = chat_session
+
+    def stream_gemini(prompt, on_complete=None):
+        yield "Bệnh đạo ôn "
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(core, "stream_gemini", stream_gemini)
+    response = core.app.test_client().post(
+        "/api/predict/stream", json={"text": f"Cách trị? {uuid.uuid4().hex}"}, headers=headers
+    )
+    assert read_events(response.get_data(as_text=True)) == [
+        (None, {"text": "Bệnh đạo ôn "}), (None, {"text": core.LLM_ERROR_MESSAGE}), ("done", {})
+    ]